@@ -1,16 +1,135 @@
 import time
+import threading
 from DrissionPage import ChromiumPage
+from DrissionPage._base.driver import Driver
+from DrissionPage._pages.chromium_tab import ChromiumTab
 import os
 import logging
-from utils import get_browser_path, check_cf_clearance, LOG_LANG, check_turnstile_token
+from utils import get_browser_path, check_cf_clearance, LOG_LANG, check_turnstile_token, CancellationToken, LazyMessage, \
+    stop_cdp_session
+
+# 英文日志译文，键为 log_message 使用的中文消息模板
+MESSAGES_EN = {
+    "基础搜索失败，正在递归查找按钮...": "Basic search failed. Searching for button recursively...",
+    "基础搜索失败，可能是过盾跳转太慢先检查是否已成功...": "Basic search failed. The redirect may be slow, checking whether the bypass already succeeded...",
+    "未找到iframe，按钮搜索失败": "Iframe not found. Button search failed",
+    "过盾成功": "Bypass successful",
+    "找到验证按钮，尝试点击...": "Verification button found. Attempting to click",
+    "未找到验证按钮": "Verification button not found",
+    "点击验证按钮时出错: {0}": "Error clicking verification button: {0}",
+    "检查页面标题时出错: {0}": "Error checking page title: {0}",
+    "注入turnstile监听脚本失败: {0}": "Failed to inject turnstile watcher: {0}",
+    "检查turnstile时出错: {0}": "Error checking turnstile: {0}",
+    "超过最大重试次数，绕过失败": "Exceeded maximum retries. Bypass failed",
+    "过盾超时，停止尝试": "Bypass timed out, giving up",
+    "尝试 {0}: 检测到验证页面，正在尝试绕过...": "Attempt {0}: Verification page detected. Trying to bypass...",
+    "成功绕过验证": "Bypass successful",
+    "绕过验证失败": "Bypass failed",
+    "成功绕过turnstile前的challenge验证": "Successfully bypassed challenge verification before turnstile",
+    "绕过turnstile前的challenge验证失败（可能没有5秒盾，继续处理Turnstile）": "Failed to bypass challenge verification before turnstile (there may be no challenge, continuing with Turnstile)",
+    "成功绕过turnstile验证": "Successfully bypassed turnstile verification",
+    "绕过turnstile验证失败（可能超时或需要手动交互）": "Failed to bypass turnstile verification (timed out or needs manual interaction)",
+    "Turnstile等待超时，停止等待": "Turnstile wait timed out",
+    "超过最大重试次数，但继续等待Turnstile自动完成...": "Exceeded maximum retries, still waiting for Turnstile to complete...",
+    "等待Turnstile验证自动完成...": "Waiting for Turnstile to complete...",
+    "等待Turnstile验证中... (已等待 {0} 秒)": "Waiting for Turnstile... ({0} seconds elapsed)"
+}
+
+# 页面内的turnstile_token监听脚本，扩展未加载时由这里补注入
+TOKEN_WATCHER_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "turnstilePatch", "token_watcher.js")
+
+
+class ChallengeWatcher:
+    """
+    通过独立的CDP会话监听页面事件，让过盾流程在状态变化时立即醒来，而不是固定间隔轮询：
+    - 响应头中写入 cf_clearance
+    - 主框架导航、DOMContentLoaded、load
+    """
+
+    def __init__(self, driver: ChromiumPage | ChromiumTab):
+        self.driver = driver
+        self.cdp = None
+        self.changed = threading.Event()
+        self.cleared = threading.Event()
+
+    @property
+    def active(self):
+        return self.cdp is not None
+
+    def start(self):
+        try:
+            self.cdp = Driver(self.driver.tab_id, "page", self.driver.browser.address)
+            self.cdp.set_callback("Network.responseReceivedExtraInfo", self._on_response_extra_info)
+            self.cdp.set_callback("Page.frameNavigated", self._on_frame_navigated)
+            self.cdp.set_callback("Page.domContentEventFired", self._on_page_event)
+            self.cdp.set_callback("Page.loadEventFired", self._on_page_event)
+            self.cdp.run("Network.enable")
+            self.cdp.run("Page.enable")
+        except Exception as e:
+            logging.warning(f"无法监听页面事件，回退为轮询: {e}")
+            self.stop()
+        return self
+
+    def stop(self):
+        cdp, self.cdp = self.cdp, None
+        if cdp is not None:
+            stop_cdp_session(cdp)
+
+    def _on_response_extra_info(self, **kwargs):
+        for name, value in (kwargs.get("headers") or {}).items():
+            if name.lower() == "set-cookie" and "cf_clearance=" in str(value):
+                self.cleared.set()
+                self.changed.set()
+                return
+
+    def _on_frame_navigated(self, **kwargs):
+        if not (kwargs.get("frame") or {}).get("parentId"):
+            self.changed.set()
+
+    def _on_page_event(self, **kwargs):
+        self.changed.set()
+
+    def wait(self, timeout: float) -> bool:
+        """等待页面发生变化，最多等待 timeout 秒，返回期间是否有事件"""
+        if not self.active:
+            time.sleep(timeout)
+            return False
+        happened = self.changed.wait(timeout)
+        self.changed.clear()
+        return happened
+
+    def wait_for_clearance(self, timeout: float) -> bool:
+        return self.cleared.wait(timeout)
 
 
 class CloudflareBypasser:
-    def __init__(self, driver: ChromiumPage, max_retries=-1, log=True):
+    def __init__(self, driver: ChromiumPage | ChromiumTab, max_retries=-1, log=True,
+                 timeout: float = None, watcher: ChallengeWatcher = None, cancel_token: CancellationToken = None,
+                 progress=None):
+        # driver 可以是整个浏览器页面，也可以是共享浏览器中的一个标签页
         self.driver = driver
         self.max_retries = max_retries
         self.log = log
         self.log_lang = LOG_LANG  # 使用全局定义的LOG_LANG
+        self.timeout = timeout  # 整个过盾流程的最长时间（秒），None 表示只受重试次数限制
+        self.watcher = watcher  # 由调用方在导航前启动，可以更早捕获事件
+        self.cancel_token = cancel_token  # 每一步之间检查，取消后抛出 BypassCancelled
+        self.timings = {}  # 各阶段耗时（秒）：challenge_solve / turnstile_wait
+        self.progress = progress  # 进度回调 progress(event, **data)，事件见 _report
+        if cancel_token is not None and watcher is not None:
+            cancel_token.add_callback(watcher.changed.set)
+
+    def _report(self, event: str, **data):
+        # 事件：challenge_detected / clicked / cleared / turnstile_token
+        if self.progress is not None:
+            try:
+                self.progress(event, **data)
+            except Exception as e:
+                logging.warning(f"进度回调出错: {e}")
+
+    def _check_cancelled(self):
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
 
     def search_recursively_shadow_root_with_iframe(self, ele):
         if ele.shadow_root:
@@ -49,7 +168,7 @@ class CloudflareBypasser:
             # If the button is not found, search it recursively
             self.log_message("基础搜索失败，正在递归查找按钮...")
             self.log_message("基础搜索失败，可能是过盾跳转太慢先检查是否已成功...")
-            if check_cf_clearance(self.driver,retries=3):
+            if check_cf_clearance(self.driver, retries=3, watcher=self.watcher):
                 if turnstile:
                     if check_turnstile_token(self.driver):
                         return "success"
@@ -63,29 +182,15 @@ class CloudflareBypasser:
                 self.log_message("未找到iframe，按钮搜索失败")
             return button
 
-    def log_message(self, message):
-        if self.log:
+    def log_message(self, message, *args):
+        """
+        记录日志。message 为消息模板，args 按 {0}、{1} 填入；
+        英文日志从预先构建的 MESSAGES_EN 中查找译文，字符串拼接推迟到日志线程中进行。
+        """
+        if self.log and logging.getLogger().isEnabledFor(logging.INFO):
             if self.log_lang == "en":
-                # 英文日志翻译
-                translations = {
-                    "基础搜索失败，正在递归查找按钮...": "Basic search failed. Searching for button recursively...",
-                    "未找到iframe，按钮搜索失败": "Iframe not found. Button search failed",
-                    "找到验证按钮，尝试点击...": "Verification button found. Attempting to click",
-                    "未找到验证按钮": "Verification button not found",
-                    "点击验证按钮时出错": "Error clicking verification button",
-                    "检查页面标题时出错": "Error checking page title",
-                    "超过最大重试次数，绕过失败": "Exceeded maximum retries. Bypass failed",
-                    "尝试 {0}: 检测到验证页面，正在尝试绕过...": "Attempt {0}: Verification page detected. Trying to bypass...",
-                    "成功绕过验证": "Bypass successful",
-                    "绕过验证失败": "Bypass failed",
-                    "成功绕过turnstile前的challenge验证": "Successfully bypassed challenge verification before turnstile",
-                    "绕过turnstile前的challenge验证失败": "Failed to bypass challenge verification before turnstile",
-                    "成功绕过turnstile验证": "Successfully bypassed turnstile verification",
-                    "绕过turnstile验证失败": "Failed to bypass turnstile verification",
-                    "检查turnstile时出错": "Error checking turnstile"
-                }
-                message = translations.get(message, message)
-            logging.info(message)
+                message = MESSAGES_EN.get(message, message)
+            logging.info(LazyMessage(message, *args))
 
     def click_verification_button(self, turnstile=False):
         try:
@@ -96,23 +201,43 @@ class CloudflareBypasser:
             if button:
                 self.log_message("找到验证按钮，尝试点击...")
                 button.click()
+                self._report("clicked", turnstile=turnstile)
             else:
                 self.log_message("未找到验证按钮")
         except Exception as e:
-            self.log_message(f"点击验证按钮时出错: {e}")
+            self.log_message("点击验证按钮时出错: {0}", e)
 
     def is_bypassed(self):
         try:
+            if self.watcher is not None and self.watcher.cleared.is_set():
+                return True
             title = self.driver.title.lower()
-            title_check = "just a moment" not in title and "请稍候…" not in title
-            clearance_check = False
-            if title_check:
-                clearance_check = check_cf_clearance(self.driver)
-            return title_check or clearance_check
+            return "just a moment" not in title and "请稍候…" not in title
         except Exception as e:
-            self.log_message(f"检查页面标题时出错: {e}")
+            self.log_message("检查页面标题时出错: {0}", e)
             return False
 
+    def _install_token_watcher(self):
+        try:
+            if not self.driver.run_js("return !!window.__cfTurnstileWatcher"):
+                with open(TOKEN_WATCHER_JS, encoding="utf-8") as f:
+                    self.driver.run_js(f.read())
+            return True
+        except Exception as e:
+            self.log_message("注入turnstile监听脚本失败: {0}", e)
+            return False
+
+    def wait_turnstile_token(self, timeout: float) -> str:
+        """在页面内等待token写入，写入后立即返回；超时返回空字符串"""
+        try:
+            token = self.driver.run_js(
+                "return window.__cfTurnstileWatcher ? window.__cfTurnstileWatcher.wait(arguments[0]) : ''",
+                int(timeout * 1000), timeout=timeout + 5)
+            return token or ""
+        except Exception as e:
+            self.log_message("检查turnstile时出错: {0}", e)
+            return ""
+
     def is_turnstile(self):
         try:
             turnstile = self.driver.ele('tag:input@name=cf-turnstile-response')
@@ -123,43 +248,82 @@ class CloudflareBypasser:
             else:
                 return ""
         except Exception as e:
-            self.log_message(f"检查turnstile时出错: {e}")
+            self.log_message("检查turnstile时出错: {0}", e)
             return ""
 
-    def bypass(self):
-        try_count = 0
-        while not self.is_bypassed():
-            if 0 < self.max_retries + 1 <= try_count:
-                self.log_message("超过最大重试次数，绕过失败")
-                break
-            self.log_message(f"尝试 {try_count + 1}: 检测到验证页面，正在尝试绕过...")
-            self.click_verification_button()
-            try_count += 1
-            time.sleep(2)
-        if self.is_bypassed():
+    def _time_left(self, started_at):
+        if self.timeout is None:
+            return float("inf")
+        return self.timeout - (time.time() - started_at)
+
+    def _solve_challenge(self):
+        """循环点击验证按钮，直到通过、超过重试次数或超时；每轮等待页面事件而不是固定睡眠"""
+        own_watcher = self.watcher is None
+        if own_watcher:
+            self.watcher = ChallengeWatcher(self.driver).start()
+            if self.cancel_token is not None:
+                self.cancel_token.add_callback(self.watcher.changed.set)
+        started_at = time.time()
+        try:
+            try_count = 0
+            while not self.is_bypassed():
+                self._check_cancelled()
+                if 0 < self.max_retries + 1 <= try_count:
+                    self.log_message("超过最大重试次数，绕过失败")
+                    break
+                if self._time_left(started_at) <= 0:
+                    self.log_message("过盾超时，停止尝试")
+                    break
+                self.log_message("尝试 {0}: 检测到验证页面，正在尝试绕过...", try_count + 1)
+                if try_count == 0:
+                    self._report("challenge_detected")
+                self.click_verification_button()
+                try_count += 1
+                self.watcher.wait(min(2, max(self._time_left(started_at), 0)))
+            self._check_cancelled()
+            bypassed = self.is_bypassed()
+            if bypassed:
+                self._report("cleared", attempts=try_count)
+            return bypassed
+        finally:
+            self.timings["challenge_solve"] = time.time() - started_at
+            if own_watcher:
+                self.watcher.stop()
+                self.watcher = None
+
+    def bypass(self) -> bool:
+        if self._solve_challenge():
             self.log_message("成功绕过验证")
-        else:
-            self.log_message("绕过验证失败")
+            return True
+        self.log_message("绕过验证失败")
+        return False
 
     def bypass_turnstile(self):
-        try_count = 0
-        while not self.is_bypassed():
-            if 0 < self.max_retries + 1 <= try_count:
-                self.log_message("超过最大重试次数，绕过失败")
-                break
-            self.log_message(f"尝试 {try_count + 1}: 检测到验证页面，正在尝试绕过...")
-            self.click_verification_button()
-            try_count += 1
-            time.sleep(2)
-        if self.is_bypassed():
+        if self._solve_challenge():
             self.log_message("成功绕过turnstile前的challenge验证")
         else:
             self.log_message("绕过turnstile前的challenge验证失败（可能没有5秒盾，继续处理Turnstile）")
-        # 处理 Turnstile：增加等待时间，因为 Turnstile 可能需要更长时间自动完成
+        # 处理 Turnstile：页面内的监听脚本在token写入时立即返回，未写入时每2秒尝试点击一次
+        started_at = time.time()
+        try:
+            token = self._wait_turnstile(started_at)
+        finally:
+            self.timings["turnstile_wait"] = time.time() - started_at
+        if token:
+            self._report("turnstile_token")
+            self.log_message("成功绕过turnstile验证")
+        else:
+            self.log_message("绕过turnstile验证失败（可能超时或需要手动交互）")
+        return token
+
+    def _wait_turnstile(self, started_at):
         try_count = 0
-        max_turnstile_wait = 30  # 最多等待30次（60秒）
-        while not self.is_turnstile():
-            if try_count >= max_turnstile_wait:
+        max_turnstile_wait = 30  # 最多等待30轮（60秒）
+        watching = self._install_token_watcher()
+        token = self.is_turnstile()
+        while not token:
+            self._check_cancelled()
+            if try_count >= max_turnstile_wait or self._time_left(started_at) <= 0:
                 self.log_message("Turnstile等待超时，停止等待")
                 break
             if 0 < self.max_retries + 1 <= try_count:
@@ -167,12 +331,15 @@ class CloudflareBypasser:
                 # 即使超过重试次数，也继续等待，因为 Turnstile 可能需要更长时间
             if try_count == 0:
                 self.log_message("等待Turnstile验证自动完成...")
-            elif try_count % 5 == 0:  # 每5次（10秒）输出一次日志
-                self.log_message(f"等待Turnstile验证中... (已等待 {try_count * 2} 秒)")
+            elif try_count % 5 == 0:  # 每5轮（10秒）输出一次日志
+                self.log_message("等待Turnstile验证中... (已等待 {0} 秒)", int(time.time() - started_at))
             self.click_verification_button(turnstile=True)
             try_count += 1
-            time.sleep(2)  # 每次等待2秒
-        if self.is_turnstile():
-            self.log_message("成功绕过turnstile验证")
-        else:
-            self.log_message("绕过turnstile验证失败（可能超时或需要手动交互）")
+            wait = min(2, max(self._time_left(started_at), 0))
+            if watching:
+                token = self.wait_turnstile_token(wait)
+            else:
+                time.sleep(wait)
+                token = self.is_turnstile()
+        self._check_cancelled()
+        return token
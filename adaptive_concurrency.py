@@ -0,0 +1,131 @@
+import threading
+import time
+
+import psutil
+
+from utils import logging
+
+
+class AdaptiveConcurrency:
+    """
+    按主机压力自动调整并发任务上限（AIMD）：
+    - CPU 超过 cpu_high、可用内存低于 min_free_bytes，或过盾耗时超过基线的 latency_tolerance 倍时，上限乘以 decrease_factor
+    - 没有压力且任务已占满上限（或有请求在排队）时，上限加一
+    上限始终在 [floor, ceiling] 之间。
+    """
+
+    def __init__(self, get_limit, set_limit, saturated, floor: int = 1, ceiling: int = 8, interval: float = 5,
+                 cpu_high: float = 85, min_free_bytes: int = 1024 ** 3, latency_tolerance: float = 2.0,
+                 decrease_factor: float = 0.75):
+        """
+        Args:
+            get_limit: 返回当前上限的可调用对象
+            set_limit: 设置新上限的可调用对象
+            saturated: 返回任务是否已占满上限（或有排队）的可调用对象
+            floor / ceiling: 上限的取值范围
+            interval: 调整间隔（秒）
+            cpu_high: CPU 使用率阈值（百分比）
+            min_free_bytes: 可用内存阈值（字节）
+            latency_tolerance: 耗时相对基线的容忍倍数
+            decrease_factor: 有压力时上限的缩小比例
+        """
+        self.get_limit = get_limit
+        self.set_limit = set_limit
+        self.saturated = saturated
+        self.floor = max(floor, 1)
+        self.ceiling = max(ceiling, self.floor)
+        self.interval = interval
+        self.cpu_high = cpu_high
+        self.min_free_bytes = min_free_bytes
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.lock = threading.Lock()
+        self.latency = None  # 每单位权重耗时的 EWMA
+        self.baseline = None  # 无压力时的耗时基线，缓慢上浮以适应站点变化
+        self.last_sample = {}
+        self.last_change = None
+        self.increases = 0
+        self.decreases = 0
+        self.thread = None
+        self.stopped = False
+
+    def record_latency(self, duration: float, weight: float = 1.0):
+        """记录一次成功过盾的耗时，可在任意线程中调用"""
+        sample = duration / max(weight, 0.1)
+        with self.lock:
+            self.latency = sample if self.latency is None else self.latency * 0.8 + sample * 0.2
+            if self.baseline is None or self.latency < self.baseline:
+                self.baseline = self.latency
+
+    def _sample(self) -> dict:
+        memory = psutil.virtual_memory()
+        with self.lock:
+            latency, baseline = self.latency, self.baseline
+            if baseline is not None:
+                self.baseline = baseline * 1.01
+        return {
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_available": memory.available,
+            "latency": latency,
+            "latency_baseline": baseline,
+            "latency_ratio": latency / baseline if latency and baseline else 1.0
+        }
+
+    def step(self) -> int:
+        """根据当前压力调整一次上限，返回新上限"""
+        sample = self._sample()
+        self.last_sample = sample
+        limit = self.get_limit()
+        reasons = []
+        if sample["cpu_percent"] > self.cpu_high:
+            reasons.append(f"CPU {sample['cpu_percent']:.0f}%")
+        if sample["memory_available"] < self.min_free_bytes:
+            reasons.append(f"可用内存 {sample['memory_available'] // 1024 ** 2}MB")
+        if sample["latency_ratio"] > self.latency_tolerance:
+            reasons.append(f"耗时为基线的 {sample['latency_ratio']:.1f} 倍")
+
+        if reasons:
+            new_limit = max(self.floor, int(limit * self.decrease_factor))
+        elif self.saturated() and sample["cpu_percent"] < self.cpu_high * 0.8:
+            new_limit = min(self.ceiling, limit + 1)
+        else:
+            new_limit = min(max(limit, self.floor), self.ceiling)
+
+        if new_limit != limit:
+            if new_limit < limit:
+                self.decreases += 1
+                logging.warning(f"主机压力过高（{', '.join(reasons)}），并发上限 {limit} -> {new_limit}")
+            else:
+                self.increases += 1
+                logging.info(f"并发上限 {limit} -> {new_limit}")
+            self.last_change = time.time()
+            self.set_limit(new_limit)
+        return new_limit
+
+    def _loop(self):
+        psutil.cpu_percent(interval=None)  # 第一次调用只建立基准
+        while not self.stopped:
+            time.sleep(self.interval)
+            try:
+                self.step()
+            except Exception as e:
+                logging.error(f"调整并发上限失败: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="adaptive-concurrency", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def get_stats(self):
+        return {
+            "limit": self.get_limit(),
+            "floor": self.floor,
+            "ceiling": self.ceiling,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "last_change": self.last_change,
+            **self.last_sample
+        }
@@ -0,0 +1,210 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from utils import logging
+
+# 优先级从高到低
+PRIORITIES = ("high", "normal", "low")
+
+
+class AdmissionRejected(Exception):
+    """排队已满或无法在截止时间前获得浏览器资源"""
+
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, client: str, priority: str, weight: float, deadline: float, future: asyncio.Future):
+        self.client = client
+        self.priority = priority
+        self.weight = weight
+        self.deadline = deadline
+        self.enqueued_at = time.time()
+        self.future = future
+        self.removed = False  # 已出队（获得资源、超时或取消）
+
+
+class AdmissionQueue:
+    """
+    浏览器资源的公平准入队列。
+    - 队列长度有上限，超出直接拒绝
+    - 每个请求带截止时间，预计排队时间加执行时间超过截止时间时立即拒绝，来不及执行时出队
+    - 高优先级先于低优先级；同一优先级内按客户端做加权公平排队（start-time fair queuing），
+      权重较大的任务（如turnstile）会相应推迟同一客户端后续任务的出队
+    """
+
+    def __init__(self, try_acquire, release, max_depth: int = 100, capacity=lambda: 1):
+        """
+        Args:
+            try_acquire: 非阻塞获取浏览器资源，成功返回 True
+            release: 释放一份浏览器资源
+            max_depth: 最大排队数
+            capacity: 返回当前并发任务上限的可调用对象，用于估算等待时间
+        """
+        self.try_acquire = try_acquire
+        self.release = release
+        self.max_depth = max_depth
+        self.capacity = capacity
+        self.loop = None
+        self.queues = {priority: [] for priority in PRIORITIES}
+        self.virtual_time = {priority: 0.0 for priority in PRIORITIES}
+        self.client_finish = {priority: {} for priority in PRIORITIES}
+        self.counter = itertools.count()
+        self.depth = 0
+        # 统计
+        self.service_time_per_weight = 10.0  # 每单位权重的平均执行时间（秒），EWMA
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_deadline = 0
+        self.expired = 0
+        self.last_wait = 0.0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+
+    def _pending_weight(self, priority: str) -> float:
+        # 排在该优先级（含）之前的任务总权重
+        total = 0.0
+        for p in PRIORITIES:
+            total += sum(entry[2].weight for entry in self.queues[p] if not entry[2].removed)
+            if p == priority:
+                break
+        return total
+
+    def estimate_wait(self, priority: str = "normal") -> float:
+        """估算一个新请求的排队时间（秒）"""
+        capacity = max(self.capacity(), 1)
+        return self._pending_weight(priority) * self.service_time_per_weight / capacity
+
+    def record_service_time(self, duration: float, weight: float = 1.0):
+        sample = duration / max(weight, 0.1)
+        self.service_time_per_weight = self.service_time_per_weight * 0.8 + sample * 0.2
+
+    def _record_wait(self, wait: float):
+        self.admitted += 1
+        self.last_wait = wait
+        self.avg_wait = self.avg_wait * 0.9 + wait * 0.1 if self.admitted > 1 else wait
+        self.max_wait = max(self.max_wait, wait)
+
+    async def admit(self, client: str, priority: str = "normal", weight: float = 1.0, deadline: float = 60) -> float:
+        """
+        等待获得一份浏览器资源。
+        Args:
+            client: 客户端标识，用于同一优先级内的公平排队
+            priority: high / normal / low
+            weight: 任务权重，耗时越长的任务权重越大
+            deadline: 请求的截止时间（秒），需要在此之前完成排队和执行
+        Returns:
+            float: 实际排队时间（秒）
+        Raises:
+            AdmissionRejected: 排队已满、预计无法按时获得资源或排队超时
+        """
+        self.loop = asyncio.get_running_loop()
+        if priority not in self.queues:
+            priority = "normal"
+        start = time.time()
+        if self.depth == 0 and self.try_acquire():
+            self._record_wait(0.0)
+            return 0.0
+        if self.depth >= self.max_depth:
+            self.rejected_full += 1
+            logging.warning(f"排队已满({self.depth}/{self.max_depth})，拒绝请求: {client}")
+            raise AdmissionRejected("排队人数已满，请稍后重试", retry_after=self.estimate_wait(priority))
+        # 最晚必须在此之前出队，否则剩余时间不够执行任务
+        max_queue_wait = deadline - self.service_time_per_weight * weight
+        estimate = self.estimate_wait(priority)
+        if estimate > max_queue_wait:
+            self.rejected_deadline += 1
+            logging.warning(f"预计排队 {estimate:.1f} 秒，无法在截止时间 {deadline} 秒内完成，拒绝请求: {client}")
+            raise AdmissionRejected("无法在截止时间内获得浏览器资源", retry_after=estimate)
+
+        ticket = _Ticket(client, priority, weight, start + max_queue_wait, self.loop.create_future())
+        start_tag = max(self.virtual_time[priority], self.client_finish[priority].get(client, 0.0))
+        finish_tag = start_tag + weight
+        self.client_finish[priority][client] = finish_tag
+        heapq.heappush(self.queues[priority], (finish_tag, next(self.counter), ticket, start_tag))
+        self.depth += 1
+        logging.info(f"请求进入排队: {client}, 优先级: {priority}, 当前排队数: {self.depth}")
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=max(ticket.deadline - time.time(), 0))
+        except asyncio.TimeoutError:
+            if ticket.future.done():
+                # 超时的同时恰好获得了资源
+                return self._admitted(ticket)
+            self._remove(ticket)
+            self.expired += 1
+            logging.warning(f"排队超时，放弃请求: {client}")
+            raise AdmissionRejected("排队超时", retry_after=self.estimate_wait(priority))
+        except asyncio.CancelledError:
+            if ticket.future.done():
+                # 客户端已离开，但资源已分配，归还
+                self.release()
+            else:
+                self._remove(ticket)
+            raise
+        return self._admitted(ticket)
+
+    def _admitted(self, ticket: _Ticket) -> float:
+        wait = time.time() - ticket.enqueued_at
+        self._record_wait(wait)
+        return wait
+
+    def _remove(self, ticket: _Ticket):
+        if not ticket.removed:
+            ticket.removed = True
+            self.depth -= 1
+
+    def _next_ticket(self):
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            while queue:
+                finish_tag, _, ticket, start_tag = queue[0]
+                if ticket.removed:
+                    heapq.heappop(queue)
+                    continue
+                return priority, ticket, start_tag
+            # 队列清空后重置虚拟时间，避免数值无限增长
+            self.virtual_time[priority] = 0.0
+            self.client_finish[priority].clear()
+        return None, None, None
+
+    def _dispatch(self):
+        while True:
+            priority, ticket, start_tag = self._next_ticket()
+            if ticket is None:
+                return
+            if ticket.deadline <= time.time():
+                heapq.heappop(self.queues[priority])
+                self._remove(ticket)
+                continue
+            if not self.try_acquire():
+                return
+            heapq.heappop(self.queues[priority])
+            self.virtual_time[priority] = start_tag
+            self._remove(ticket)
+            ticket.future.set_result(True)
+
+    def notify(self):
+        """浏览器资源被释放时调用，可在任意线程中调用"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._dispatch)
+
+    def get_stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "depth_by_priority": {p: sum(1 for e in self.queues[p] if not e[2].removed) for p in PRIORITIES},
+            "estimated_wait": self.estimate_wait(),
+            "last_wait": self.last_wait,
+            "avg_wait": self.avg_wait,
+            "max_wait": self.max_wait,
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_deadline": self.rejected_deadline,
+            "expired": self.expired,
+            "service_time_per_weight": self.service_time_per_weight
+        }
@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+import weakref
+
+import psutil
+
+from shared_slots import tracked_processes
+from utils import logging
+
+# 视为浏览器或代理进程的进程名关键字
+CHILD_PROCESS_NAMES = ("chrome", "chromium", "msedge", "mitmdump")
+
+
+def tree_rss(pid: int) -> int:
+    """进程及其所有子进程的常驻内存之和（字节），进程不存在时返回 0"""
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return 0
+    total = 0
+    for p in processes:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def kill_tree(pid: int) -> int:
+    """结束进程树，返回结束前的常驻内存之和（字节）"""
+    rss = tree_rss(pid)
+    try:
+        process = psutil.Process(pid)
+        children = process.children(recursive=True)
+    except psutil.Error:
+        return 0
+    for p in children + [process]:
+        try:
+            p.kill()
+        except psutil.Error:
+            pass
+    psutil.wait_procs(children + [process], timeout=5)
+    return rss
+
+
+class BrowserWatchdog:
+    """
+    浏览器池的后台看门狗：
+    - 浏览器进程树的常驻内存超过 max_rss 或存活超过 max_lifetime 时回收（空闲的立即回收，忙碌的在任务结束后回收）
+    - 任务超过 hang_timeout 仍未归还视为卡死：独占浏览器的直接结束浏览器；与其他任务共享浏览器的只关闭它的标签页，
+      浏览器不再接收新任务，其余任务结束后回收。卡住的工作线程随之出错返回
+    - 结束本进程启动、但既不属于池中浏览器也未登记的 chrome/mitmdump 子进程（例如 quit 失败遗留的）
+    """
+
+    def __init__(self, pool, max_rss: int = 1024 ** 3, max_lifetime: float = 3600,
+                 hang_timeout: float = 180, interval: float = 30, orphan_grace: float = 60):
+        """
+        Args:
+            pool: BrowserPoolManager
+            max_rss: 单个浏览器进程树的常驻内存上限（字节），0 表示不限制
+            max_lifetime: 单个浏览器的最长存活时间（秒），0 表示不限制
+            hang_timeout: 任务占用浏览器的最长时间（秒），0 表示不检查
+            interval: 检查间隔（秒）
+            orphan_grace: 子进程启动后多久才可能被判定为孤儿（秒），避免误杀正在启动的浏览器
+        """
+        self.pool = pool
+        self.max_rss = max_rss
+        self.max_lifetime = max_lifetime
+        self.hang_timeout = hang_timeout
+        self.interval = interval
+        self.orphan_grace = orphan_grace
+        self.reclaimed = {"rss": 0, "lifetime": 0, "hung": 0, "orphan": 0}
+        self.reclaimed_bytes = 0
+        self.last_check = None
+        self.last_rss = {}
+        self.listeners = []  # 回收时的回调 (reason, rss)
+        self.hung_leases = weakref.WeakSet()  # 已处理过的卡死任务，避免重复关闭
+        self.thread = None
+        self.stopped = False
+
+    def _record(self, reason: str, rss: int):
+        self.reclaimed[reason] += 1
+        self.reclaimed_bytes += rss
+        for listener in self.listeners:
+            listener(reason, rss)
+
+    def check_browsers(self):
+        now = time.time()
+        pool = self.pool
+        with pool.pool_lock:
+            browsers = [(pooled, list(pooled.leases))
+                        for pooled in pool.idle_pool + list(pool.busy_pool) if not pooled.retired]
+        rss_by_pid = {}
+        for pooled, leases in browsers:
+            rss = tree_rss(pooled.process_id) if pooled.process_id else 0
+            rss_by_pid[pooled.process_id] = rss
+            hung = [lease for lease in leases if self.hang_timeout and now - lease.started_at > self.hang_timeout
+                    and lease not in self.hung_leases]
+            if hung:
+                self._release_hung(pooled, hung, rss)
+                continue
+            reason = None
+            if self.max_rss and rss > self.max_rss:
+                reason = "rss"
+            elif self.max_lifetime and now - pooled.created_at > self.max_lifetime:
+                reason = "lifetime"
+            if reason is None or pooled.retiring:
+                continue
+            logging.info(f"回收浏览器（{'内存超限' if reason == 'rss' else '存活时间超限'}）, "
+                         f"进程ID: {pooled.process_id}, 常驻内存: {rss // 1024 ** 2}MB")
+            with pool.pool_lock:
+                pooled.retiring = True
+                is_idle = pooled in pool.idle_pool
+                if is_idle:
+                    pool.idle_pool.remove(pooled)
+            if is_idle:
+                pool.retire_browser(pooled)
+                pool.warm_event.set()
+            # 忙碌的浏览器在最后一个任务归还时回收
+            self._record(reason, rss)
+        self.last_rss = rss_by_pid
+
+    def _release_hung(self, pooled, hung: list, rss: int):
+        """处理卡死的任务：浏览器只有这些任务时结束整个浏览器，否则只关闭卡死任务的标签页并让浏览器排空后回收"""
+        pool = self.pool
+        with pool.pool_lock:
+            pooled.retiring = True
+            exclusive = pooled.leases.issubset(hung)
+        self.hung_leases.update(hung)
+        if exclusive and pooled.process_id:
+            # 先直接结束进程，卡住的 CDP 连接上 quit 可能同样卡住
+            logging.warning(f"浏览器任务超过 {self.hang_timeout:.0f} 秒未归还，强制结束, 进程ID: {pooled.process_id}")
+            kill_tree(pooled.process_id)
+            with pool.pool_lock:
+                pool.busy_pool.discard(pooled)
+            pool.retire_browser(pooled)
+            pool.warm_event.set()
+            self._record("hung", rss)
+            return
+        logging.warning(f"{len(hung)} 个任务超过 {self.hang_timeout:.0f} 秒未归还，关闭其标签页，"
+                        f"浏览器在其余任务结束后回收, 进程ID: {pooled.process_id}")
+        for lease in hung:
+            # 卡住的任务可能占着浏览器的 CDP 锁，在独立线程中关闭，不阻塞看门狗
+            threading.Thread(target=pool.abort_lease, args=(lease,), name="watchdog-abort", daemon=True).start()
+            self._record("hung", 0)
+
+    def _owned_pids(self) -> tuple:
+        """
+        本进程仍在使用的子进程：池中浏览器（含有任务的）及其到本进程之间的父进程，以及登记的代理进程。
+        Returns:
+            tuple: (PID集合, 是否有浏览器的进程ID未知)
+        """
+        pool = self.pool
+        with pool.pool_lock:
+            browsers = pool.idle_pool + list(pool.busy_pool)
+        owned = set(tracked_processes())
+        unknown = False
+        me = os.getpid()
+        for pooled in browsers:
+            if not pooled.process_id:
+                unknown = True
+                continue
+            owned.add(pooled.process_id)
+            try:
+                # 浏览器可能由包装脚本启动，本进程的直接子进程是它的某个父进程
+                for parent in psutil.Process(pooled.process_id).parents():
+                    if parent.pid == me:
+                        break
+                    owned.add(parent.pid)
+            except psutil.Error:
+                pass
+        return owned, unknown
+
+    def reap_orphans(self, grace: float = None) -> int:
+        """结束不属于池中浏览器也未登记的浏览器和代理子进程，返回结束的进程树数量"""
+        grace = self.orphan_grace if grace is None else grace
+        owned, unknown = self._owned_pids()
+        reaped = 0
+        now = time.time()
+        for child in psutil.Process(os.getpid()).children():
+            try:
+                name = child.name().lower()
+                if child.status() == psutil.STATUS_ZOMBIE:
+                    child.wait(timeout=0)  # 回收僵尸进程
+                    continue
+                if (child.pid in owned or not any(n in name for n in CHILD_PROCESS_NAMES)
+                        or now - child.create_time() < grace):
+                    continue
+                if unknown and "mitmdump" not in name:
+                    # 有浏览器的进程ID未知时无法判断浏览器进程是否属于它，不冒险结束
+                    continue
+            except (psutil.Error, psutil.TimeoutExpired):
+                continue
+            rss = kill_tree(child.pid)
+            logging.warning(f"结束孤儿进程: {name} ({child.pid}), 释放常驻内存 {rss // 1024 ** 2}MB")
+            self._record("orphan", rss)
+            reaped += 1
+        return reaped
+
+    def check(self):
+        self.last_check = time.time()
+        self.check_browsers()
+        self.reap_orphans()
+
+    def _loop(self):
+        while not self.stopped:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"浏览器看门狗检查失败: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="browser-watchdog", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def get_stats(self):
+        return {
+            "reclaimed": dict(self.reclaimed),
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "browser_rss": sum(self.last_rss.values()),
+            "browsers_checked": len(self.last_rss),
+            "max_rss": self.max_rss,
+            "max_lifetime": self.max_lifetime,
+            "hang_timeout": self.hang_timeout,
+            "last_check": self.last_check
+        }
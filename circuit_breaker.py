@@ -0,0 +1,251 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from utils import logging
+
+# 表示代理本身不可用的 Chromium 网络错误码，其余错误码视为目标站点不可达
+PROXY_NET_ERRORS = {
+    "ERR_PROXY_CONNECTION_FAILED", "ERR_TUNNEL_CONNECTION_FAILED", "ERR_PROXY_AUTH_UNSUPPORTED",
+    "ERR_PROXY_AUTH_REQUESTED", "ERR_PROXY_CERTIFICATE_INVALID", "ERR_NO_SUPPORTED_PROXIES",
+    "ERR_SOCKS_CONNECTION_FAILED", "ERR_MANDATORY_PROXY_CONFIGURATION_FAILED", "ERR_PROXY_HTTP_1_1_REQUIRED"
+}
+# Cloudflare 拦截页面（如 1020 Access denied）的标题关键字
+BLOCK_PAGE_TITLES = ("attention required", "access denied")
+
+
+class BypassFailure(Exception):
+    """可归因于代理或目标站点的过盾失败，计入对应的熔断器"""
+
+    scope = "host"
+    kind = "failure"
+
+
+class ProxyFailure(BypassFailure):
+    """上游代理不可用"""
+
+    scope = "proxy"
+    kind = "proxy_unreachable"
+
+
+class TargetUnreachable(BypassFailure):
+    """目标站点无法连接（DNS、连接被拒绝或超时、TLS错误等）"""
+
+    kind = "target_unreachable"
+
+
+class TargetBlocked(BypassFailure):
+    """目标站点返回了拦截页面"""
+
+    kind = "blocked"
+
+
+class ChallengeFailed(BypassFailure):
+    """超过重试次数或超时仍未通过验证"""
+
+    kind = "challenge_failed"
+
+
+class CircuitOpen(Exception):
+    """熔断器处于打开状态，请求不执行直接失败"""
+
+    def __init__(self, message: str, scope: str, retry_after: float):
+        super().__init__(message)
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def classify_net_error(html: str) -> BypassFailure:
+    """根据 Chromium 错误页中的网络错误码生成对应的失败类型"""
+    match = re.search(r"\bERR_[A-Z0-9_]+", html or "")
+    code = match.group(0) if match else "ERR_UNKNOWN"
+    if code in PROXY_NET_ERRORS:
+        return ProxyFailure(f"代理连接失败: {code}")
+    return TargetUnreachable(f"无法访问目标站点: {code}")
+
+
+def is_block_page(title: str) -> bool:
+    title = (title or "").lower()
+    return any(keyword in title for keyword in BLOCK_PAGE_TITLES)
+
+
+def mask_proxy(proxy: str) -> str:
+    """隐藏代理地址中的密码"""
+    return re.sub(r"(://[^:@/]*:|^[^:@/]*:)[^@/]*@", r"\1****@", proxy)
+
+
+class CircuitBreaker:
+    """
+    单个目标站点或代理的熔断器：
+    - closed：正常执行，连续失败 failure_threshold 次后打开
+    - open：直接失败，recovery_time 秒后进入 half_open
+    - half_open：同一时间只放行一个探测请求，成功则关闭，失败则重新打开并把恢复时间加倍（不超过 max_recovery_time）
+    """
+
+    def __init__(self, scope: str, key: str, recovery_time: float):
+        self.scope = scope
+        self.key = key
+        self.state = "closed"
+        self.failures = 0
+        self.recovery_time = recovery_time
+        self.opened_at = None
+        self.probe_started_at = None
+        self.last_error = ""
+        self.last_kind = ""
+        self.rejected = 0
+
+    def retry_after(self, now: float) -> float:
+        return max(self.opened_at + self.recovery_time - now, 0)
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "scope": self.scope,
+            "key": self.key,
+            "state": self.state,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_kind": self.last_kind,
+            "retry_after": self.retry_after(now) if self.state == "open" else 0,
+            "rejected": self.rejected
+        }
+
+
+class CircuitBreakerRegistry:
+    """按目标主机和上游代理分别维护熔断器，避免不可用的目标长期占用浏览器槽位"""
+
+    def __init__(self, failure_threshold: int = 3, recovery_time: float = 30, max_recovery_time: float = 600,
+                 probe_timeout: float = 150, max_entries: int = 1000):
+        """
+        Args:
+            failure_threshold: 连续失败多少次后打开熔断器
+            recovery_time: 打开后多少秒开始探测
+            max_recovery_time: 探测连续失败时恢复时间的上限（秒）
+            probe_timeout: 探测请求超过该秒数没有结果时允许新的探测
+            max_entries: 最多保存的熔断器数量，超出时淘汰最早的
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.max_recovery_time = max_recovery_time
+        self.probe_timeout = probe_timeout
+        self.max_entries = max_entries
+        self.breakers = OrderedDict()  # (scope, key) -> CircuitBreaker，只保存有失败记录的
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.rejected = {"host": 0, "proxy": 0}
+
+    @staticmethod
+    def _name(target: tuple) -> str:
+        return target[1] if target[0] == "host" else mask_proxy(target[1])
+
+    def _targets(self, host: str, proxy: str) -> list:
+        targets = [("host", host or "")]
+        if proxy:
+            targets.append(("proxy", proxy))
+        return targets
+
+    def before_request(self, host: str, proxy: str = None) -> bool:
+        """
+        执行请求前检查熔断器。
+        Returns:
+            bool: 本次请求是否为半开状态下的探测请求，探测没有实际执行时需调用 cancel_probe
+        Raises:
+            CircuitOpen: 目标主机或代理的熔断器打开，或正在探测中
+        """
+        now = time.time()
+        granted = []
+        with self.lock:
+            for target in self._targets(host, proxy):
+                breaker = self.breakers.get(target)
+                if breaker is None or breaker.state == "closed":
+                    continue
+                if breaker.state == "open" and breaker.retry_after(now) <= 0:
+                    breaker.state = "half_open"
+                    breaker.probe_started_at = None
+                if breaker.state == "half_open" and (
+                        breaker.probe_started_at is None or now - breaker.probe_started_at > self.probe_timeout):
+                    breaker.probe_started_at = now
+                    granted.append(breaker)
+                    logging.info(f"熔断器半开，放行探测请求: {self._name(target)}")
+                    continue
+                for probe in granted:
+                    probe.probe_started_at = None
+                breaker.rejected += 1
+                self.rejected[breaker.scope] += 1
+                retry_after = breaker.retry_after(now) if breaker.state == "open" else self.recovery_time
+                name = "目标站点" if breaker.scope == "host" else "代理"
+                raise CircuitOpen(f"{name}暂时不可用（已熔断）: {breaker.last_error}", breaker.scope,
+                                  max(retry_after, 1))
+        return bool(granted)
+
+    def cancel_probe(self, host: str, proxy: str = None):
+        """探测请求没有得出结论（排队被拒绝、超时或取消）时归还探测名额"""
+        with self.lock:
+            for target in self._targets(host, proxy):
+                breaker = self.breakers.get(target)
+                if breaker is not None and breaker.state == "half_open":
+                    breaker.probe_started_at = None
+
+    def record_success(self, host: str, proxy: str = None):
+        with self.lock:
+            for target in self._targets(host, proxy):
+                breaker = self.breakers.pop(target, None)
+                if breaker is not None and breaker.state != "closed":
+                    self.closed += 1
+                    logging.info(f"熔断器恢复: {self._name(target)}")
+
+    def record_failure(self, host: str, proxy: str, error: BypassFailure):
+        """记录一次可归因的失败，只计入错误所属范围（目标主机或代理）的熔断器"""
+        if error.scope == "proxy" and not proxy:
+            return
+        target = ("proxy", proxy) if error.scope == "proxy" else ("host", host or "")
+        now = time.time()
+        with self.lock:
+            breaker = self.breakers.get(target)
+            if breaker is None:
+                breaker = self.breakers[target] = CircuitBreaker(target[0], target[1], self.recovery_time)
+                while len(self.breakers) > self.max_entries:
+                    self.breakers.popitem(last=False)
+            self.breakers.move_to_end(target)
+            # 另一范围的探测没有得出结论，归还名额
+            for other in self._targets(host, proxy):
+                other_breaker = self.breakers.get(other)
+                if other != target and other_breaker is not None and other_breaker.state == "half_open":
+                    other_breaker.probe_started_at = None
+            breaker.failures += 1
+            breaker.last_error = str(error)
+            breaker.last_kind = error.kind
+            if breaker.state == "half_open":
+                breaker.recovery_time = min(breaker.recovery_time * 2, self.max_recovery_time)
+            elif breaker.state == "open" or breaker.failures < self.failure_threshold:
+                return
+            breaker.state = "open"
+            breaker.opened_at = now
+            breaker.probe_started_at = None
+            self.opened += 1
+            logging.warning(f"熔断器打开: {self._name(target)}, {int(breaker.recovery_time)} 秒后探测, 最近错误: {error}")
+
+    def open_count(self) -> dict:
+        with self.lock:
+            counts = {"host": 0, "proxy": 0}
+            for breaker in self.breakers.values():
+                if breaker.state != "closed":
+                    counts[breaker.scope] += 1
+            return counts
+
+    def get_stats(self):
+        now = time.time()
+        with self.lock:
+            breakers = [b.to_dict(now) for b in self.breakers.values()]
+        for item in breakers:
+            if item["scope"] == "proxy":
+                item["key"] = mask_proxy(item["key"])
+        return {
+            "breakers": breakers,
+            "opened": self.opened,
+            "closed": self.closed,
+            "rejected": dict(self.rejected),
+            "failure_threshold": self.failure_threshold,
+            "recovery_time": self.recovery_time
+        }
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import tldextract
+
+from utils import logging
+
+# 只使用随包发布的公共后缀列表快照，不联网下载，也不写磁盘缓存，离线环境和只读文件系统中都能启动
+_extract = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None, fallback_to_snapshot=True)
+
+
+def registrable_domain(url: str) -> str:
+    """
+    返回URL的可注册域名，例如 https://a.b.example.co.uk/x -> example.co.uk。
+    IP地址或无法识别后缀的主机名原样返回。
+    """
+    host = (urlparse(url).hostname or "").lower()
+    parts = _extract(host)
+    if parts.domain and parts.suffix:
+        return f"{parts.domain}.{parts.suffix}"
+    return host
+
+
+def clearance_expiry(cookies: list, default_ttl: float, max_ttl: float, margin: float = 30) -> float:
+    """
+    根据cf_clearance的过期时间计算缓存过期时间戳。
+    Args:
+        cookies: 包含完整信息的cookie列表（需要 expires 字段）
+        default_ttl: 没有cf_clearance或其为会话cookie时使用的TTL（秒）
+        max_ttl: TTL上限（秒）
+        margin: 提前失效的安全余量（秒）
+    Returns:
+        float: 缓存条目的过期时间戳
+    """
+    now = time.time()
+    ttl = default_ttl
+    for cookie in cookies:
+        if cookie.get("name") == "cf_clearance":
+            expires = cookie.get("expires") or -1
+            if expires > 0:
+                ttl = expires - now - margin
+            break
+    return now + max(min(ttl, max_ttl), 0)
+
+
+class CacheEntry:
+    def __init__(self, value, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class ClearanceCache:
+    """
+    cf_clearance 结果缓存，键为 (可注册域名, 代理, UA)。
+    条目按cookie实际过期时间失效，超出条目数或字节数上限时按LRU淘汰。
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(url: str, proxy: str = None, user_agent: str = None) -> tuple:
+        return registrable_domain(url), proxy or "", user_agent or ""
+
+    @staticmethod
+    def _estimate_size(value) -> int:
+        if hasattr(value, "model_dump"):
+            value = value.model_dump()
+        return len(json.dumps(value, ensure_ascii=False, default=str))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value, expires_at: float):
+        if expires_at <= time.time():
+            return
+        size = self._estimate_size(value)
+        if size > self.max_bytes:
+            logging.warning(f"缓存条目过大，跳过缓存: {key[0]}")
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CacheEntry(value, expires_at, size)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+        logging.info(f"缓存clearance: {key[0]}, 有效期 {int(expires_at - time.time())} 秒")
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
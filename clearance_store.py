@@ -0,0 +1,340 @@
+import abc
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, unquote
+
+from utils import logging
+
+
+def store_key(key: tuple) -> str:
+    """把 (可注册域名, 代理, UA) 转为共享存储中的键，对代理和UA取哈希，避免把代理凭据写入共享存储"""
+    domain, rest = key[0], json.dumps(list(key[1:]), ensure_ascii=False)
+    return f"{domain}:{hashlib.sha256(rest.encode('utf-8')).hexdigest()[:32]}"
+
+
+class ClearanceStore(abc.ABC):
+    """
+    多个服务实例共享的clearance存储接口。
+    值为可JSON序列化的字典（cookies 和 user_agent），按过期时间戳自动失效。
+    """
+
+    name = ""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    @abc.abstractmethod
+    def get(self, key: tuple):
+        """
+        Returns:
+            tuple: (值, 过期时间戳)；不存在或已过期时返回 None
+        """
+
+    @abc.abstractmethod
+    def put(self, key: tuple, value: dict, expires_at: float):
+        """写入条目，expires_at 之后不再返回"""
+
+    @abc.abstractmethod
+    def delete(self, key: tuple):
+        """删除条目，不存在时忽略"""
+
+    def close(self):
+        pass
+
+    def call(self, method: str, *args):
+        """调用存储操作，出错时记录日志并返回 None，共享存储不可用不应影响过盾"""
+        try:
+            return getattr(self, method)(*args)
+        except Exception as e:
+            self.errors += 1
+            logging.warning(f"clearance存储({self.name}) {method} 失败: {e}")
+            return None
+
+    def _count(self, found: bool):
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get_stats(self):
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors
+        }
+
+
+class MemoryClearanceStore(ClearanceStore):
+    """进程内存储，仅在单个实例内共享，用于开发和测试"""
+
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self.lock:
+            entry = self.entries.get(store_key(key))
+            if entry is not None and entry[1] <= time.time():
+                del self.entries[store_key(key)]
+                entry = None
+            self._count(entry is not None)
+            return entry
+
+    def put(self, key: tuple, value: dict, expires_at: float):
+        with self.lock:
+            self.entries[store_key(key)] = (value, expires_at)
+            self.writes += 1
+
+    def delete(self, key: tuple):
+        with self.lock:
+            self.entries.pop(store_key(key), None)
+
+
+class SQLiteClearanceStore(ClearanceStore):
+    """
+    基于 SQLite 文件的存储，开启 WAL 模式，同一台机器上的多个进程可以并发读写。
+    每个线程使用独立的连接，关闭存储时关闭所有线程的连接。
+    """
+
+    name = "sqlite"
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.local = threading.local()
+        self.connections = set()  # 所有线程打开的连接，关闭时统一关闭
+        self.connections_lock = threading.Lock()
+        self.last_purge = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS clearance ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS clearance_expires ON clearance (expires_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        with self.connections_lock:
+            if conn is not None and conn in self.connections:
+                return conn
+            # 连接只由创建它的线程使用，但关闭存储时需要在其他线程中关闭
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.connections.add(conn)
+        self.local.conn = conn
+        return conn
+
+    def get(self, key: tuple):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM clearance WHERE key = ? AND expires_at > ?",
+            (store_key(key), time.time())
+        ).fetchone()
+        self._count(row is not None)
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: tuple, value: dict, expires_at: float):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO clearance (key, value, expires_at) VALUES (?, ?, ?)",
+                (store_key(key), json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            if now - self.last_purge > self.PURGE_INTERVAL:
+                self.last_purge = now
+                conn.execute("DELETE FROM clearance WHERE expires_at <= ?", (now,))
+        self.writes += 1
+
+    def delete(self, key: tuple):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM clearance WHERE key = ?", (store_key(key),))
+
+    def close(self):
+        with self.connections_lock:
+            connections, self.connections = self.connections, set()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.warning(f"关闭SQLite连接失败: {e}")
+
+
+class RedisError(Exception):
+    """Redis 返回的错误回复"""
+
+
+class RedisConnection:
+    """
+    最小的 RESP2 客户端，只实现共享存储用到的命令，不依赖 redis 库。
+    连接按需建立，出错后关闭，下次调用时重连；复用的连接已断开时立即重连重试一次。
+    """
+
+    def __init__(self, url: str, timeout: float = 2):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile("rb")
+        try:
+            if self.password:
+                args = ("AUTH", self.username, self.password) if self.username else ("AUTH", self.password)
+                self._call(*args)
+            if self.db:
+                self._call("SELECT", self.db)
+        except Exception:
+            # 认证或选库失败的连接不能继续使用
+            self._close()
+            raise
+
+    def _close(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                self.reader.close()
+                sock.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis 连接已断开")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Redis 连接已断开")
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f"无法解析的 Redis 回复: {line!r}")
+
+    def _call(self, *args):
+        self.sock.sendall(self._encode(args))
+        return self._read()
+
+    def execute(self, *args):
+        with self.lock:
+            # 复用的连接可能已被服务端关闭（如 Redis 重启），失败时重连重试一次
+            reused = self.sock is not None
+            try:
+                if self.sock is None:
+                    self._connect()
+                return self._call(*args)
+            except RedisError:
+                raise
+            except (OSError, ValueError):
+                self._close()
+                if not reused:
+                    raise
+            try:
+                self._connect()
+                return self._call(*args)
+            except RedisError:
+                raise
+            except (OSError, ValueError):
+                self._close()
+                raise
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+
+class RedisClearanceStore(ClearanceStore):
+    """基于 Redis（或兼容 RESP 协议的服务）的存储，条目过期由 Redis 负责清理"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "cf_clearance:"):
+        super().__init__()
+        self.conn = RedisConnection(url)
+        self.prefix = prefix
+
+    def get(self, key: tuple):
+        data = self.conn.execute("GET", self.prefix + store_key(key))
+        entry = json.loads(data) if data else None
+        if entry is not None and entry["expires_at"] <= time.time():
+            entry = None
+        self._count(entry is not None)
+        return (entry["value"], entry["expires_at"]) if entry else None
+
+    def put(self, key: tuple, value: dict, expires_at: float):
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        data = json.dumps({"value": value, "expires_at": expires_at}, ensure_ascii=False)
+        self.conn.execute("SET", self.prefix + store_key(key), data, "PX", ttl_ms)
+        self.writes += 1
+
+    def delete(self, key: tuple):
+        self.conn.execute("DEL", self.prefix + store_key(key))
+
+    def close(self):
+        self.conn.close()
+
+
+def create_clearance_store(url: str):
+    """
+    根据配置创建共享存储。
+    Args:
+        url: "memory"、"sqlite://路径" 或 "redis://[:密码@]主机[:端口][/库]"；为空时返回 None
+    Raises:
+        ValueError: 不支持的存储类型
+    """
+    if not url:
+        return None
+    if url == "memory":
+        return MemoryClearanceStore()
+    if url.startswith("sqlite://"):
+        # sqlite:///data/x.db 为绝对路径，sqlite://x.db 为相对路径
+        return SQLiteClearanceStore(url[len("sqlite://"):])
+    if url.startswith("redis://"):
+        return RedisClearanceStore(url)
+    raise ValueError(f"不支持的clearance存储: {url}")
@@ -0,0 +1,65 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+# 每次压缩并输出的原文大小
+CHUNK_SIZE = 64 * 1024
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    根据 Accept-Encoding 选择响应编码：取客户端 q 值最高的编码，q 值相同时优先 br。
+    Returns:
+        str: "br"、"gzip" 或 "identity"
+    """
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+    wildcard = accepted.get("*", 0.0)
+    chosen, chosen_quality = "identity", 0.0
+    for name in (("br", "gzip") if brotli is not None else ("gzip",)):
+        quality = accepted.get(name, wildcard)
+        if quality > chosen_quality:
+            chosen, chosen_quality = name, quality
+    return chosen
+
+
+def iter_encoded(text: str, encoding: str, chunk_size: int = CHUNK_SIZE):
+    """
+    分块编码并压缩文本，逐块产出字节，不在内存中生成完整的压缩结果。
+    Args:
+        text: 原文
+        encoding: negotiate_encoding 的返回值
+        chunk_size: 每块原文的字符数
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        compress, flush = compressor.process, compressor.finish
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress, flush = compressor.compress, compressor.flush
+    else:
+        compress, flush = None, None
+    for start in range(0, len(text), chunk_size):
+        data = text[start:start + chunk_size].encode("utf-8")
+        if compress is not None:
+            data = compress(data)
+        if data:
+            yield data
+    if flush is not None:
+        tail = flush()
+        if tail:
+            yield tail
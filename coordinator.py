@@ -0,0 +1,264 @@
+import asyncio
+import bisect
+import hashlib
+import math
+import threading
+import time
+from urllib.parse import quote
+
+try:
+    import aiohttp
+except ImportError:  # 只有协调节点和向协调节点汇报的工作节点需要
+    aiohttp = None
+
+from utils import logging
+
+# 转发时不复制的逐跳头部
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade",
+               "proxy-authorization", "proxy-authenticate", "host", "content-length"}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环，每个节点放置 vnodes 个虚拟节点，节点加入或离开时只有相邻区间的键会迁移"""
+
+    def __init__(self, vnodes: int = 64):
+        self.vnodes = vnodes
+        self.points = []  # 有序的哈希值
+        self.owners = {}  # 哈希值 -> 节点ID
+
+    def add(self, node_id: str):
+        for i in range(self.vnodes):
+            point = _hash(f"{node_id}#{i}")
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = node_id
+
+    def remove(self, node_id: str):
+        self.points = [p for p in self.points if self.owners[p] != node_id]
+        self.owners = {p: self.owners[p] for p in self.points}
+
+    def walk(self, key: str):
+        """从键的位置顺时针遍历，依次产出不重复的节点ID"""
+        if not self.points:
+            return
+        start = bisect.bisect(self.points, _hash(key))
+        seen = set()
+        for i in range(len(self.points)):
+            node_id = self.owners[self.points[(start + i) % len(self.points)]]
+            if node_id not in seen:
+                seen.add(node_id)
+                yield node_id
+
+
+class WorkerNode:
+    def __init__(self, node_id: str, url: str):
+        self.id = node_id
+        self.url = url.rstrip("/")
+        self.max_jobs = 1
+        self.free_slots = 0
+        self.queue_depth = 0
+        self.inflight = 0  # 由本协调节点转发、尚未返回的请求数
+        self.routed = 0
+        self.failures = 0  # 连续转发失败次数，转发成功后清零
+        self.joined_at = time.time()
+        self.last_seen = self.joined_at
+
+    @property
+    def load(self) -> int:
+        # 心跳中的占用数有延迟，与本节点转发中的请求数取较大者
+        return max(self.inflight, self.max_jobs - self.free_slots)
+
+    def to_dict(self) -> dict:
+        return {
+            "node_id": self.id,
+            "url": self.url,
+            "max_jobs": self.max_jobs,
+            "free_slots": self.free_slots,
+            "queue_depth": self.queue_depth,
+            "inflight": self.inflight,
+            "routed": self.routed,
+            "failures": self.failures,
+            "last_seen": self.last_seen
+        }
+
+
+class NodeRegistry:
+    """
+    工作节点登记表与路由。
+    按目标站点的可注册域名做一致性哈希，使同一站点的请求落到同一节点，复用其缓存和预热浏览器；
+    有界负载：节点负载超过平均负载的 load_factor 倍或已无空闲槽位时，顺着哈希环溢出到下一个节点。
+    超过 node_ttl 秒没有心跳、或连续 max_failures 次转发失败的节点被移出哈希环；
+    偶发的连接错误或超时只让本次请求换下一个节点，不影响该节点承接的其他站点。
+    """
+
+    def __init__(self, node_ttl: float = 15, load_factor: float = 1.25, vnodes: int = 64, max_failures: int = 3):
+        self.node_ttl = node_ttl
+        self.load_factor = load_factor
+        self.max_failures = max(max_failures, 1)
+        self.ring = HashRing(vnodes)
+        self.nodes = {}
+        self.lock = threading.Lock()
+        self.primary = 0
+        self.spilled = 0
+        self.unavailable = 0
+        self.forward_failures = 0
+
+    def heartbeat(self, node_id: str, url: str, max_jobs: int, free_slots: int, queue_depth: int = 0) -> WorkerNode:
+        with self.lock:
+            node = self.nodes.get(node_id)
+            if node is None:
+                node = self.nodes[node_id] = WorkerNode(node_id, url)
+                self.ring.add(node_id)
+                logging.info(f"工作节点加入: {node_id} ({url}), 当前节点数: {len(self.nodes)}")
+            node.url = url.rstrip("/")
+            node.max_jobs = max(max_jobs, 1)
+            node.free_slots = free_slots
+            node.queue_depth = queue_depth
+            node.last_seen = time.time()
+            return node
+
+    def remove(self, node_id: str, reason: str = "离开"):
+        with self.lock:
+            if self.nodes.pop(node_id, None) is None:
+                return
+            self.ring.remove(node_id)
+        logging.info(f"工作节点{reason}: {node_id}, 当前节点数: {len(self.nodes)}")
+
+    def prune(self):
+        now = time.time()
+        with self.lock:
+            expired = [node_id for node_id, node in self.nodes.items() if now - node.last_seen > self.node_ttl]
+        for node_id in expired:
+            self.remove(node_id, "心跳超时")
+
+    def route(self, key: str, exclude=()) -> WorkerNode:
+        """
+        为键选择节点并计入转发中的请求，调用方处理完后必须调用 done。
+        Args:
+            key: 路由键（可注册域名）
+            exclude: 不参与选择的节点ID，例如刚转发失败的节点
+        Returns:
+            WorkerNode: 没有可用节点时返回 None
+        """
+        self.prune()
+        with self.lock:
+            candidates = [self.nodes[i] for i in self.ring.walk(key) if i not in exclude]
+            if not candidates:
+                self.unavailable += 1
+                return None
+            total = sum(node.load for node in candidates)
+            bound = math.ceil(self.load_factor * (total + 1) / len(candidates))
+            chosen = next((node for node in candidates if node.load < min(bound, node.max_jobs)), None)
+            if chosen is candidates[0]:
+                self.primary += 1
+            else:
+                self.spilled += 1
+                if chosen is None:
+                    # 所有节点都满了，交给相对负载最低的节点排队
+                    chosen = min(candidates, key=lambda node: node.load / node.max_jobs)
+            chosen.inflight += 1
+            chosen.routed += 1
+            return chosen
+
+    def done(self, node: WorkerNode):
+        with self.lock:
+            node.inflight = max(node.inflight - 1, 0)
+
+    def record_success(self, node: WorkerNode):
+        with self.lock:
+            node.failures = 0
+
+    def record_failure(self, node: WorkerNode) -> bool:
+        """
+        记录一次转发失败，连续失败达到 max_failures 次时移除节点。
+        Returns:
+            bool: 节点是否被移除
+        """
+        with self.lock:
+            self.forward_failures += 1
+            node.failures += 1
+            evict = node.failures >= self.max_failures and self.nodes.get(node.id) is node
+        if evict:
+            self.remove(node.id, f"连续 {node.failures} 次不可达")
+        return evict
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "nodes": [node.to_dict() for node in self.nodes.values()],
+                "primary": self.primary,
+                "spilled": self.spilled,
+                "unavailable": self.unavailable,
+                "forward_failures": self.forward_failures,
+                "max_failures": self.max_failures,
+                "load_factor": self.load_factor,
+                "node_ttl": self.node_ttl
+            }
+
+
+async def forward_request(session, node: WorkerNode, method: str, path: str, query: str, headers: dict, body: bytes):
+    """
+    把请求转发到工作节点，返回 (状态码, 响应头, 响应体分块迭代器, 关闭函数)。
+    session 需以 auto_decompress=False 创建，使工作节点的响应按原样（包括压缩编码）透传给客户端。
+    Raises:
+        aiohttp.ClientError: 无法连接工作节点
+    """
+    url = f"{node.url}{path}" + (f"?{query}" if query else "")
+    headers = {k: v for k, v in headers.items() if k.lower() not in HOP_HEADERS}
+    response = await session.request(method, url, headers=headers, data=body or None)
+    response_headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS}
+    return response.status, response_headers, response.content.iter_chunked(64 * 1024), response.release
+
+
+class HeartbeatSender:
+    """工作节点定期向协调节点汇报空闲槽位，停止时通知协调节点移除自己"""
+
+    def __init__(self, coordinator_url: str, password: str, node_id: str, node_url: str, status, interval: float = 5):
+        """
+        Args:
+            coordinator_url: 协调节点地址
+            password: 协调节点的访问密码
+            node_id: 本节点ID
+            node_url: 协调节点访问本节点使用的地址
+            status: 返回 {"max_jobs", "free_slots", "queue_depth"} 的可调用对象
+            interval: 汇报间隔（秒）
+        """
+        self.base_url = f"{coordinator_url.rstrip('/')}/{password}/nodes"
+        self.node_id = node_id
+        self.node_url = node_url
+        self.status = status
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        if aiohttp is None:
+            raise RuntimeError("向协调节点汇报需要安装 aiohttp")
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        timeout = aiohttp.ClientTimeout(total=self.interval)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while True:
+                payload = {"node_id": self.node_id, "url": self.node_url, **self.status()}
+                try:
+                    async with session.post(f"{self.base_url}/heartbeat", json=payload) as response:
+                        if response.status != 200:
+                            logging.warning(f"协调节点拒绝心跳: {response.status}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning(f"向协调节点发送心跳失败: {e}")
+                await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=2)) as session:
+                async with session.delete(f"{self.base_url}/{quote(self.node_id, safe='')}"):
+                    pass
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"通知协调节点下线失败: {e}")
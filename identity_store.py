@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 系统只做进程内加锁
+    fcntl = None
+
+from utils import logging
+
+# 写入cookie jar时保留的字段，其余字段（如 size、session）不能传给 Storage.setCookies
+COOKIE_FIELDS = ("name", "value", "domain", "path", "expires", "httpOnly", "secure", "sameSite", "priority")
+
+
+def identity_id(proxy: str = None, user_agent: str = None) -> str:
+    """身份目录名，对代理和UA取哈希，避免把代理凭据写进路径"""
+    return hashlib.sha256(f"{proxy or ''}\n{user_agent or ''}".encode("utf-8")).hexdigest()[:24]
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Identity:
+    """一个 (代理, UA) 对应的持久化浏览器目录和cookie jar，持有期间独占"""
+
+    def __init__(self, store, identity_id: str):
+        self.store = store
+        self.id = identity_id
+        self.path = os.path.join(store.root, identity_id)
+        self.profile_dir = os.path.join(self.path, "profile")
+        self.jar_path = os.path.join(self.path, "cookies.json")
+        self.lock_file = None
+
+    def load_cookies(self) -> list:
+        """读取cookie jar，丢弃已过期的cookie"""
+        try:
+            with open(self.jar_path, encoding="utf-8") as f:
+                cookies = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取cookie jar失败: {self.id}, {e}")
+            return []
+        now = time.time()
+        return [c for c in cookies if not c.get("expires") or c["expires"] > now]
+
+    def save_cookies(self, cookies: list):
+        """先写临时文件再替换，进程中途退出也不会留下损坏的jar"""
+        cookies = [{k: c[k] for k in COOKIE_FIELDS if k in c} for c in cookies]
+        for cookie in cookies:
+            # 会话cookie的 expires 为 -1，写回时不能带上，否则会被当作已过期
+            if cookie.get("expires", 0) <= 0:
+                cookie.pop("expires", None)
+        tmp_path = f"{self.jar_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cookies, f, ensure_ascii=False)
+        os.replace(tmp_path, self.jar_path)
+
+    def release(self):
+        self.store.release(self)
+
+
+class IdentityStore:
+    """
+    按 (代理, UA) 持久化浏览器的 user-data-dir 和cookie jar，让同一身份再次访问时沿用上次的验证状态。
+    - 每个身份同一时间只能被一个浏览器使用：进程内用集合登记，跨进程用锁文件（仅 POSIX）
+    - 超过 max_age 秒未使用的身份被清理；总大小超过 max_bytes 时从最久未使用的开始清理
+    """
+
+    def __init__(self, root: str, max_age: float = 7 * 86400, max_bytes: int = 2 * 1024 ** 3,
+                 gc_interval: float = 600):
+        self.root = os.path.abspath(root)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.gc_interval = gc_interval
+        self.lock = threading.Lock()
+        self.held = set()
+        self.last_gc = 0
+        self.total_bytes = 0  # 上次清理后的总大小和身份数，避免查询状态时遍历目录
+        self.count = 0
+        self.acquired = 0
+        self.busy = 0
+        self.removed = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _lock_path(self, identity_id: str) -> str:
+        return os.path.join(self.root, f"{identity_id}.lock")
+
+    def _try_lock_file(self, identity_id: str):
+        """获取跨进程锁，返回打开的锁文件；已被其他进程持有时返回 None"""
+        if fcntl is None:
+            return True
+        f = open(self._lock_path(identity_id), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    @staticmethod
+    def _unlock_file(f):
+        if f is True or f is None:
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+    def try_acquire(self, proxy: str = None, user_agent: str = None) -> Identity:
+        """
+        获取身份的独占使用权。
+        Returns:
+            Identity: 获取成功时返回；身份正被其他浏览器使用时返回 None，调用方应退回临时目录
+        """
+        identity = Identity(self, identity_id(proxy, user_agent))
+        with self.lock:
+            if identity.id in self.held:
+                self.busy += 1
+                return None
+            lock_file = self._try_lock_file(identity.id)
+            if lock_file is None:
+                self.busy += 1
+                return None
+            self.held.add(identity.id)
+            self.acquired += 1
+        identity.lock_file = lock_file
+        os.makedirs(identity.profile_dir, exist_ok=True)
+        # 目录的修改时间作为最近使用时间，供清理时判断
+        os.utime(identity.path)
+        return identity
+
+    def release(self, identity: Identity):
+        if identity is None:
+            return
+        try:
+            os.utime(identity.path)
+        except OSError:
+            pass
+        with self.lock:
+            self._unlock_file(identity.lock_file)
+            identity.lock_file = None
+            self.held.discard(identity.id)
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                try:
+                    entries.append((os.path.getmtime(path), name, _dir_size(path)))
+                except OSError:
+                    pass
+        return sorted(entries)
+
+    def _remove(self, identity_id: str) -> bool:
+        """删除未被使用的身份，正被使用时跳过"""
+        with self.lock:
+            if identity_id in self.held:
+                return False
+            lock_file = self._try_lock_file(identity_id)
+            if lock_file is None:
+                return False
+            try:
+                shutil.rmtree(os.path.join(self.root, identity_id), ignore_errors=True)
+                self.removed += 1
+            finally:
+                self._unlock_file(lock_file)
+        # 锁文件保留不删，删除后其他进程可能锁住已解除链接的旧文件
+        return True
+
+    def gc(self):
+        """清理过期身份，并把总大小控制在上限以内"""
+        self.last_gc = time.time()
+        entries = self._entries()
+        total = sum(size for _, _, size in entries)
+        entries_left = len(entries)
+        for mtime, name, size in entries:
+            if self.last_gc - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            if self._remove(name):
+                total -= size
+                entries_left -= 1
+                logging.info(f"清理浏览器身份: {name}, 释放 {size} 字节")
+        self.total_bytes, self.count = total, entries_left
+
+    def maybe_gc(self):
+        if time.time() - self.last_gc >= self.gc_interval:
+            try:
+                self.gc()
+            except Exception as e:
+                logging.error(f"清理浏览器身份失败: {e}")
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "root": self.root,
+                "identities": self.count,
+                "bytes": self.total_bytes,
+                "in_use": len(self.held),
+                "acquired": self.acquired,
+                "busy": self.busy,
+                "removed": self.removed,
+                "max_age": self.max_age,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+
+from utils import logging
+
+# 当前正在执行的异步任务，工作线程通过复制的上下文拿到它并上报进度
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+def report_progress(event: str, **data):
+    """上报当前异步任务的进度，不在异步任务中时什么也不做；可在任意线程中调用"""
+    job = current_job.get()
+    if job is not None:
+        job.publish(event, data)
+
+
+class Job:
+    def __init__(self, mode: str, url: str, loop: asyncio.AbstractEventLoop):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.url = url
+        self.loop = loop
+        self.status = "pending"  # pending / running / done / failed
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.events = []
+        self.waiters = []
+        self.task = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def publish(self, event: str, data: dict = None):
+        # 进度可能来自工作线程，统一回到事件循环中追加
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._append, event, data or {})
+
+    def _append(self, event: str, data: dict):
+        self.events.append({"event": event, "time": time.time(), **data})
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            waiter.set()
+
+    def finish(self, result=None, error: str = None, status_code: int = None):
+        """在事件循环线程中调用"""
+        self.status = "failed" if error else "done"
+        self.result = result
+        self.error = error
+        self.status_code = status_code
+        self.finished_at = time.time()
+        self._append(self.status, {"error": error} if error else {})
+
+    async def wait_for_update(self, since: int, timeout: float) -> bool:
+        """等待第 since 个之后的新事件，超时返回 False"""
+        if len(self.events) > since:
+            return True
+        waiter = asyncio.Event()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    async def wait_finished(self, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while not self.finished:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not await self.wait_for_update(len(self.events), remaining):
+                break
+        return self.finished
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "mode": self.mode,
+            "url": self.url,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "events": self.events
+        }
+
+
+class JobFull(Exception):
+    """进行中的任务数已达上限"""
+
+
+class JobStore:
+    """
+    异步任务登记表，只在事件循环线程中访问。
+    完成的任务保留 ttl 秒供查询；总数超过上限时优先淘汰最早完成的任务。
+    """
+
+    def __init__(self, max_jobs: int = 1000, ttl: float = 300):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.jobs = OrderedDict()
+        self.submitted = 0
+        self.evicted = 0
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [i for i, job in self.jobs.items() if job.finished and now - job.finished_at > self.ttl]:
+            del self.jobs[job_id]
+        if len(self.jobs) < self.max_jobs:
+            return
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.finished_at)
+        for job in finished[:len(self.jobs) - self.max_jobs + 1]:
+            del self.jobs[job.id]
+            self.evicted += 1
+
+    def submit(self, mode: str, url: str, runner) -> Job:
+        """
+        创建任务并在后台执行。
+        Args:
+            mode: 任务类型
+            url: 目标URL
+            runner: 协程函数，返回结果对象；抛出异常时任务失败
+        Raises:
+            JobFull: 进行中的任务数已达上限
+        """
+        self._prune()
+        if len(self.jobs) >= self.max_jobs:
+            raise JobFull("进行中的任务过多，请稍后重试")
+        job = Job(mode, url, asyncio.get_running_loop())
+        self.jobs[job.id] = job
+        self.submitted += 1
+        job.task = asyncio.ensure_future(self._run(job, runner))
+        return job
+
+    async def _run(self, job: Job, runner):
+        current_job.set(job)
+        job.status = "running"
+        job._append("started", {})
+        try:
+            result = await runner()
+        except asyncio.CancelledError:
+            job.finish(error="任务已取消", status_code=499)
+            raise
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            logging.error(f"异步任务失败: {job.id}, {detail}")
+            job.finish(error=detail, status_code=getattr(e, "status_code", 500))
+            return
+        job.finish(result=result.model_dump() if hasattr(result, "model_dump") else result)
+
+    def get(self, job_id: str) -> Job:
+        self._prune()
+        return self.jobs.get(job_id)
+
+    def get_stats(self):
+        running = sum(1 for job in self.jobs.values() if not job.finished)
+        return {
+            "jobs": len(self.jobs),
+            "running": running,
+            "finished": len(self.jobs) - running,
+            "max_jobs": self.max_jobs,
+            "ttl": self.ttl,
+            "submitted": self.submitted,
+            "evicted": self.evicted
+        }
@@ -0,0 +1,114 @@
+import errno
+import os
+import socket
+import threading
+from collections import deque
+
+from utils import logging, LOG_LANG
+
+
+def parse_port_range(value: str):
+    """
+    解析 "起始-结束" 格式的端口范围，空字符串返回 None。
+    Raises:
+        ValueError: 格式无效
+    """
+    if not value:
+        return None
+    start, _, end = value.partition("-")
+    start, end = int(start), int(end or start)
+    if not 0 < start <= end <= 65535:
+        raise ValueError(f"无效的端口范围: {value}")
+    return start, end
+
+
+class PortAllocator:
+    """
+    本地代理端口分配器，不扫描系统连接表。
+    - 未配置端口范围时由系统分配（绑定 0 端口），绑定本身就是原子的
+    - 配置端口范围时从空闲队列中取端口并尝试绑定，被外部进程占用的端口放回队尾
+    已分配的端口在归还前不会再分配给其他本地代理。
+    """
+
+    def __init__(self, port_range: tuple = None, host: str = "127.0.0.1"):
+        self.host = host
+        self.port_range = port_range
+        self.lock = threading.Lock()
+        self.free = deque(range(port_range[0], port_range[1] + 1)) if port_range else None
+        self.allocated = set()
+        self.bind_conflicts = 0
+
+    def _bind(self, port: int) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if os.name == "posix":
+                # 允许复用 TIME_WAIT 状态的端口，刚关闭的代理端口可以立即再分配
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def allocate_socket(self) -> socket.socket:
+        """
+        返回已绑定到空闲端口的套接字，由调用方继续 listen，避免绑定前的端口被抢占。
+        Raises:
+            RuntimeError: 端口范围内没有可用端口
+        """
+        if self.free is None:
+            while True:
+                sock = self._bind(0)
+                with self.lock:
+                    port = sock.getsockname()[1]
+                    # 通过 allocate_port 分配的端口已关闭套接字，系统可能再次分配，跳过
+                    if port not in self.allocated:
+                        self.allocated.add(port)
+                        return sock
+                    self.bind_conflicts += 1
+                sock.close()
+        with self.lock:
+            # 每个空闲端口最多尝试一次
+            for _ in range(len(self.free)):
+                port = self.free.popleft()
+                try:
+                    sock = self._bind(port)
+                except OSError as e:
+                    if e.errno != errno.EADDRINUSE:
+                        self.free.appendleft(port)
+                        raise
+                    self.bind_conflicts += 1
+                    self.free.append(port)
+                    continue
+                self.allocated.add(port)
+                return sock
+        error_msg = "无法找到可用端口" if LOG_LANG == "zh" else "Could not find available port"
+        logging.error(f"{error_msg}: {self.port_range}")
+        raise RuntimeError(error_msg)
+
+    def allocate_port(self) -> int:
+        """
+        分配一个端口号，供需要自己绑定端口的子进程（如 mitmdump）使用。
+        端口在本进程内独占，直到调用 release。
+        """
+        sock = self.allocate_socket()
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def release(self, port: int):
+        with self.lock:
+            if port not in self.allocated:
+                return
+            self.allocated.discard(port)
+            if self.free is not None:
+                self.free.append(port)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "range": f"{self.port_range[0]}-{self.port_range[1]}" if self.port_range else "auto",
+                "allocated": len(self.allocated),
+                "free": len(self.free) if self.free is not None else None,
+                "bind_conflicts": self.bind_conflicts
+            }
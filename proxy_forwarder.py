@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import threading
+
+from utils import logging, LOG_LANG
+
+# 请求头最大长度，超出视为异常请求
+MAX_HEADER_BYTES = 64 * 1024
+# 单次转发的缓冲区大小
+RELAY_CHUNK_SIZE = 64 * 1024
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """返回转发器共用的后台事件循环，首次调用时在守护线程中启动"""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="proxy-forwarder", daemon=True).start()
+        return _loop
+
+
+def _rewrite_head(head: bytes, auth_header: bytes) -> tuple[bytes, bool]:
+    """
+    替换请求头中的代理认证信息。
+    普通HTTP请求强制短连接，保证同一连接上的每个请求都带有认证头。
+    Returns:
+        tuple[bytes, bool]: 改写后的请求头，是否为 CONNECT 请求
+    """
+    lines = head.split(b"\r\n")
+    request_line = lines[0]
+    is_connect = request_line.split(b" ", 1)[0].upper() == b"CONNECT"
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name = line.split(b":", 1)[0].strip().lower()
+        if name == b"proxy-authorization":
+            continue
+        if not is_connect and name in (b"connection", b"proxy-connection", b"keep-alive"):
+            continue
+        headers.append(line)
+    headers.append(auth_header)
+    if not is_connect:
+        headers.append(b"Connection: close")
+    return b"\r\n".join([request_line] + headers) + b"\r\n\r\n", is_connect
+
+
+class ProxyForwarder:
+    """
+    进程内的无验证本地代理，把浏览器的请求原样转发给带认证的上游代理。
+    只注入 Proxy-Authorization，不解密 TLS：CONNECT 隧道建立后直接双向转发字节流。
+    """
+
+    def __init__(self, upstream_host: str, upstream_port: int, username: str, password: str,
+                 listen_host: str = "127.0.0.1", listen_port: int = 0, sock=None):
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
+        self.auth_header = f"Proxy-Authorization: Basic {credentials}".encode()
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.sock = sock  # 已绑定的监听套接字，传入时忽略 listen_host/listen_port
+        self.server = None
+        self.connections = set()
+        # 统计
+        self.active_connections = 0
+        self.total_connections = 0
+        self.failed_connections = 0
+        self.bytes_upstream = 0
+        self.bytes_downstream = 0
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1] if self.server else self.listen_port
+
+    @property
+    def address(self) -> str:
+        return f"http://{self.listen_host}:{self.port}"
+
+    def start(self, timeout: float = 5) -> str:
+        """
+        在后台事件循环中开始监听。
+        Returns:
+            str: 本地代理地址，例如 "http://127.0.0.1:端口"
+        """
+        future = asyncio.run_coroutine_threadsafe(self._start(), get_loop())
+        future.result(timeout=timeout)
+        return self.address
+
+    async def _start(self):
+        if self.sock is not None:
+            self.server = await asyncio.start_server(self._handle, sock=self.sock)
+        else:
+            self.server = await asyncio.start_server(self._handle, self.listen_host, self.listen_port)
+
+    def stop(self, timeout: float = 5):
+        """停止监听并断开所有进行中的连接"""
+        if self.server is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._stop(), get_loop())
+        future.result(timeout=timeout)
+
+    async def _stop(self):
+        server, self.server = self.server, None
+        server.close()
+        for writer in list(self.connections):
+            writer.close()
+        await server.wait_closed()
+
+    async def _handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        self.total_connections += 1
+        self.active_connections += 1
+        self.connections.add(client_writer)
+        upstream_writer = None
+        try:
+            try:
+                head = await client_reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            if len(head) > MAX_HEADER_BYTES:
+                return
+            head, _ = _rewrite_head(head[:-4], self.auth_header)
+            try:
+                upstream_reader, upstream_writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+            except OSError as e:
+                self.failed_connections += 1
+                log_prefix = "代理转发" if LOG_LANG == "zh" else "Proxy Forwarder"
+                logging.warning(f"{log_prefix}: 连接上游代理失败: {str(e)}" if LOG_LANG == "zh" else
+                                f"{log_prefix}: Failed to connect to upstream proxy: {str(e)}")
+                client_writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await client_writer.drain()
+                return
+            self.connections.add(upstream_writer)
+            upstream_writer.write(head)
+            # 上游的响应（包括 CONNECT 的 200 或 407）直接交给浏览器处理
+            await asyncio.gather(
+                self._relay(client_reader, upstream_writer, upstream=True),
+                self._relay(upstream_reader, client_writer, upstream=False),
+            )
+        except Exception as e:
+            logging.debug(f"代理转发连接异常: {str(e)}")
+        finally:
+            self.active_connections -= 1
+            for writer in (client_writer, upstream_writer):
+                if writer is not None:
+                    self.connections.discard(writer)
+                    writer.close()
+
+    async def _relay(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, upstream: bool):
+        try:
+            while True:
+                data = await reader.read(RELAY_CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+                if upstream:
+                    self.bytes_upstream += len(data)
+                else:
+                    self.bytes_downstream += len(data)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            # 一端结束后半关闭另一端，让对方也能读到结束
+            try:
+                if writer.can_write_eof():
+                    writer.write_eof()
+            except (ConnectionError, OSError):
+                pass
+
+    def get_stats(self):
+        return {
+            "address": self.address,
+            "upstream": f"{self.upstream_host}:{self.upstream_port}",
+            "active_connections": self.active_connections,
+            "total_connections": self.total_connections,
+            "failed_connections": self.failed_connections,
+            "bytes_upstream": self.bytes_upstream,
+            "bytes_downstream": self.bytes_downstream
+        }
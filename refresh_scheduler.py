@@ -0,0 +1,177 @@
+import asyncio
+import math
+import time
+
+from utils import logging
+
+
+class RefreshEntry:
+    def __init__(self, key: tuple, url: str, context: dict):
+        self.key = key  # (可注册域名, 代理, UA)
+        self.url = url  # 最近一次请求的URL，刷新时按它过盾
+        self.context = context  # 刷新时沿用的请求参数，如 retries、block_policy
+        self.score = 0.0  # 指数衰减的请求计数，约等于最近 window 秒内的请求数
+        self.last_seen = time.time()
+        self.expires_at = None
+        self.refreshing = False
+        self.refreshes = 0
+
+    def decayed_score(self, now: float, window: float) -> float:
+        return self.score * math.exp(-(now - self.last_seen) / window)
+
+
+class RefreshScheduler:
+    """
+    热门 clearance 的后台预刷新。
+    按 (域名, 代理, UA) 统计请求频率，最近 window 秒内请求数达到 min_requests 的条目在过期前 lead_time 秒内
+    重新过盾，使客户端请求几乎总能命中缓存。
+    - 只在没有请求排队且有空闲任务槽位时开始刷新，刷新任务本身以低优先级排队，始终让位于实时请求
+    - 同时进行的刷新数不超过 max_concurrent，每小时的刷新次数不超过 budget_per_hour（令牌桶）
+    """
+
+    def __init__(self, refresh, can_start, lead_time: float = 60, window: float = 600, min_requests: float = 3,
+                 budget_per_hour: float = 60, max_concurrent: int = 1, max_tracked: int = 1000,
+                 interval: float = 5):
+        """
+        Args:
+            refresh: 接收 RefreshEntry、返回协程的可调用对象；刷新得到的新过期时间通过 set_expiry 记录
+            can_start: 返回当前是否有空闲资源开始后台刷新的可调用对象
+            lead_time: 过期前多少秒开始刷新
+            window: 请求频率的统计窗口（秒）
+            min_requests: 统计窗口内至少多少次请求才视为热门
+            budget_per_hour: 每小时最多刷新次数
+            max_concurrent: 同时进行的最大刷新数
+            max_tracked: 最多跟踪的条目数，超出时淘汰请求频率最低的
+            interval: 检查间隔（秒）
+        """
+        self.refresh = refresh
+        self.can_start = can_start
+        self.lead_time = lead_time
+        self.window = window
+        self.min_requests = min_requests
+        self.budget_per_hour = budget_per_hour
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_tracked = max_tracked
+        self.interval = interval
+        self.entries = {}
+        self.active = 0
+        self.tokens = budget_per_hour
+        self.tokens_updated = time.time()
+        self.task = None
+        # 统计
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped_budget = 0
+        self.skipped_busy = 0
+
+    def record(self, key: tuple, url: str, **context) -> RefreshEntry:
+        """记录一次客户端请求（无论是否命中缓存）"""
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None:
+            # 先淘汰再加入，否则新条目的分数为 0，会把自己淘汰掉
+            if len(self.entries) >= self.max_tracked:
+                self._evict(now)
+            entry = self.entries[key] = RefreshEntry(key, url, context)
+        entry.score = entry.decayed_score(now, self.window) + 1
+        entry.last_seen = now
+        entry.url = url
+        entry.context = context
+        return entry
+
+    def set_expiry(self, key: tuple, expires_at: float):
+        """记录条目当前 clearance 的过期时间，只跟踪有客户端请求过的条目"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.expires_at = expires_at
+
+    def _is_hot(self, entry: RefreshEntry, now: float) -> bool:
+        # 容忍刚记录完请求后的微小衰减
+        return entry.decayed_score(now, self.window) >= self.min_requests * 0.99
+
+    def _evict(self, now: float):
+        coldest = min((e for e in self.entries.values() if not e.refreshing),
+                      key=lambda e: e.decayed_score(now, self.window), default=None)
+        if coldest is not None:
+            del self.entries[coldest.key]
+
+    def _prune(self, now: float):
+        # 不再热门且已过期的条目不会再被刷新，等下次请求时重新跟踪
+        for key, entry in list(self.entries.items()):
+            if (not entry.refreshing and entry.decayed_score(now, self.window) < 1
+                    and (entry.expires_at is None or entry.expires_at <= now)):
+                del self.entries[key]
+
+    def _take_token(self, now: float) -> bool:
+        self.tokens = min(self.budget_per_hour,
+                          self.tokens + (now - self.tokens_updated) * self.budget_per_hour / 3600)
+        self.tokens_updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def due(self, now: float = None) -> list:
+        """需要刷新的热门条目，最先过期的在前"""
+        now = now or time.time()
+        due = [e for e in self.entries.values()
+               if not e.refreshing and e.expires_at is not None and now < e.expires_at <= now + self.lead_time
+               and self._is_hot(e, now)]
+        return sorted(due, key=lambda e: e.expires_at)
+
+    def tick(self):
+        now = time.time()
+        self._prune(now)
+        for entry in self.due(now):
+            if self.active >= self.max_concurrent:
+                break
+            if not self.can_start():
+                self.skipped_busy += 1
+                break
+            if not self._take_token(now):
+                self.skipped_budget += 1
+                break
+            entry.refreshing = True
+            self.active += 1
+            asyncio.ensure_future(self._run_refresh(entry))
+
+    async def _run_refresh(self, entry: RefreshEntry):
+        logging.info(f"后台刷新clearance: {entry.key[0]}, 剩余有效期 {int(entry.expires_at - time.time())} 秒")
+        try:
+            await self.refresh(entry)
+            entry.refreshes += 1
+            self.refreshed += 1
+        except Exception as e:
+            self.failed += 1
+            # 失败后不再重试本轮，条目过期后由客户端请求重新过盾
+            entry.expires_at = None
+            logging.warning(f"后台刷新clearance失败: {entry.key[0]}, {e}")
+        finally:
+            entry.refreshing = False
+            self.active -= 1
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f"后台刷新调度失败: {e}")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._loop())
+
+    def get_stats(self):
+        now = time.time()
+        return {
+            "tracked": len(self.entries),
+            "hot": sum(1 for e in self.entries.values() if self._is_hot(e, now)),
+            "active": self.active,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "skipped_budget": self.skipped_budget,
+            "skipped_busy": self.skipped_busy,
+            "budget_remaining": int(self.tokens),
+            "budget_per_hour": self.budget_per_hour
+        }
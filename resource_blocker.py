@@ -0,0 +1,142 @@
+import fnmatch
+import threading
+from urllib.parse import urlparse
+
+from DrissionPage._base.driver import Driver
+
+from clearance_cache import registrable_domain
+from utils import logging, stop_cdp_session
+
+# 拦截档位：off 不拦截；light 拦截图片、媒体和字体；strict 额外拦截样式表和第三方请求
+BLOCK_PROFILES = {
+    "off": (frozenset(), False),
+    "light": (frozenset({"Image", "Media", "Font"}), False),
+    "strict": (frozenset({"Image", "Media", "Font", "Stylesheet", "Ping", "CSPViolationReport", "Manifest"}), True),
+}
+
+# Cloudflare 验证相关的请求始终放行（包括 challenges.cloudflare.com 及站点自身的 /cdn-cgi/ 路径）
+CLOUDFLARE_HOSTS = ("cloudflare.com",)
+CLOUDFLARE_PATH = "/cdn-cgi/"
+
+
+def split_patterns(value: str) -> tuple:
+    """把逗号分隔的通配符模式拆成元组"""
+    return tuple(p.strip() for p in (value or "").split(",") if p.strip())
+
+
+class BlockPolicy:
+    """
+    单次任务的资源拦截策略。
+    判断顺序：Cloudflare 验证请求放行 → allow 模式放行 → deny 模式拦截 → 页面文档放行 → 按资源类型和第三方主机拦截。
+    模式为 fnmatch 通配符，匹配完整URL，例如 "*.doubleclick.net/*"、"*://*/ads/*"。
+    """
+
+    def __init__(self, target_url: str, profile: str = "off", allow: tuple = (), deny: tuple = ()):
+        if profile not in BLOCK_PROFILES:
+            raise ValueError(f"无效的拦截档位: {profile}")
+        self.profile = profile
+        self.resource_types, self.block_third_party = BLOCK_PROFILES[profile]
+        self.allow = tuple(allow)
+        self.deny = tuple(deny)
+        self.site = registrable_domain(target_url)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.resource_types or self.block_third_party or self.deny)
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+        if parsed.path.startswith(CLOUDFLARE_PATH) or any(
+                host == h or host.endswith("." + h) for h in CLOUDFLARE_HOSTS):
+            return False
+        if any(fnmatch.fnmatch(url, pattern) for pattern in self.allow):
+            return False
+        if any(fnmatch.fnmatch(url, pattern) for pattern in self.deny):
+            return True
+        if resource_type == "Document" or parsed.scheme not in ("http", "https"):
+            return False
+        if resource_type in self.resource_types:
+            return True
+        return self.block_third_party and registrable_domain(url) != self.site
+
+
+class ResourceBlocker:
+    """
+    通过独立CDP会话的 Fetch 域在请求发出前拦截，并统计本次任务的请求数和接收字节数。
+    Cloudflare 验证 iframe 属于独立的目标，不经过这里，因此不会被拦截。
+    """
+
+    def __init__(self, driver, policy: BlockPolicy):
+        self.driver = driver
+        self.policy = policy
+        self.cdp = None
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.blocked = 0
+        self.blocked_by_type = {}
+        self.bytes_received = 0
+
+    def start(self):
+        try:
+            self.cdp = Driver(self.driver.tab_id, "page", self.driver.browser.address)
+            self.cdp.set_callback("Network.loadingFinished", self._on_loading_finished)
+            self.cdp.run("Network.enable")
+            if self.policy.enabled:
+                self.cdp.set_callback("Fetch.requestPaused", self._on_request_paused)
+                self.cdp.run("Fetch.enable", patterns=[{"urlPattern": "*", "requestStage": "Request"}])
+        except Exception as e:
+            logging.warning(f"无法启用资源拦截: {e}")
+            self.stop()
+        return self
+
+    def stop(self):
+        cdp, self.cdp = self.cdp, None
+        if cdp is None:
+            return
+        # 关闭拦截，让仍处于暂停状态的请求继续
+        try:
+            if self.policy.enabled:
+                cdp.run("Fetch.disable")
+        except Exception:
+            pass
+        stop_cdp_session(cdp)
+
+    def _on_request_paused(self, **kwargs):
+        cdp = self.cdp
+        if cdp is None:
+            return
+        request_id = kwargs.get("requestId")
+        url = (kwargs.get("request") or {}).get("url", "")
+        resource_type = kwargs.get("resourceType", "Other")
+        try:
+            block = self.policy.should_block(url, resource_type)
+        except Exception:
+            block = False
+        with self.lock:
+            if block:
+                self.blocked += 1
+                self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + 1
+            else:
+                self.allowed += 1
+        try:
+            if block:
+                cdp.run("Fetch.failRequest", requestId=request_id, errorReason="BlockedByClient")
+            else:
+                cdp.run("Fetch.continueRequest", requestId=request_id)
+        except Exception as e:
+            logging.debug(f"处理被拦截的请求失败: {e}")
+
+    def _on_loading_finished(self, **kwargs):
+        with self.lock:
+            self.bytes_received += int(kwargs.get("encodedDataLength") or 0)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "profile": self.policy.profile,
+                "allowed": self.allowed,
+                "blocked": self.blocked,
+                "blocked_by_type": dict(self.blocked_by_type),
+                "bytes_received": self.bytes_received
+            }
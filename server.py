@@ -1,37 +1,125 @@
 import re
 import os
+import sys
+import math
+import socket
+import tempfile
 from urllib.parse import urlparse
 import time
 import threading
 import asyncio
-from CloudflareBypasser import CloudflareBypasser
+from CloudflareBypasser import CloudflareBypasser, ChallengeWatcher
 import platform
 from DrissionPage import ChromiumPage, ChromiumOptions
-from fastapi import FastAPI, HTTPException,Depends
+from DrissionPage._pages.chromium_tab import ChromiumTab
+from fastapi import FastAPI, HTTPException,Depends, Request
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, List
+import json
 from starlette.status import HTTP_403_FORBIDDEN
 from pyvirtualdisplay import Display
 import uvicorn
 import atexit
 import argparse
 from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from contextlib import contextmanager
+import contextvars
 
-from utils import get_browser_path, logging, LOG_LANG
-from proxy_manager import start_proxy_with_auth, stop_proxy
+from utils import get_browser_path, logging, LOG_LANG, CancellationToken, BypassCancelled, start_log_context, log_phase, \
+    log_request_id
+from proxy_manager import acquire_proxy, release_proxy, close_all_proxies, get_proxy_stats
+from clearance_cache import ClearanceCache, clearance_expiry, registrable_domain
+from clearance_store import create_clearance_store
+from single_flight import SingleFlight
+from admission_queue import AdmissionQueue, AdmissionRejected
+from compression import negotiate_encoding, iter_encoded
+from functools import partial
+from identity_store import IdentityStore
+from adaptive_concurrency import AdaptiveConcurrency
+from refresh_scheduler import RefreshScheduler
+from circuit_breaker import CircuitBreakerRegistry, CircuitOpen, BypassFailure, TargetBlocked, ChallengeFailed, \
+    classify_net_error, is_block_page
+from browser_watchdog import BrowserWatchdog
+from shared_slots import SharedSlotTable, attach as attach_shared_slots, track_process, untrack_process
+from coordinator import NodeRegistry, HeartbeatSender, forward_request, aiohttp
+from resource_blocker import BlockPolicy, ResourceBlocker, BLOCK_PROFILES, split_patterns
+from job_store import JobStore, JobFull, report_progress
+from metrics import Registry, LabelLimiter, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from fastapi.responses import Response, StreamingResponse, JSONResponse
+
+if __name__ == "__mp_main__":
+    # 多进程模式下 spawn 出的工作进程会先以 __mp_main__ 的名义执行本脚本，随后 uvicorn 再导入 server 模块提供服务。
+    # 让后者直接复用本模块，每个工作进程只有一个浏览器池和共享槽位表
+    sys.modules.setdefault("server", sys.modules[__name__])
 
 # 环境变量配置
 SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
 PASSWORD = os.getenv("PASSWORD", "gua12345")
 MAX_BROWSERS = int(os.getenv("MAX_BROWSERS", 2))
+BROWSER_POOL_MIN_WARM = int(os.getenv("BROWSER_POOL_MIN_WARM", 1))  # 最少保持预热的空闲浏览器数
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", 20))  # 单个浏览器最多复用次数，超过后回收
+BROWSER_IDLE_TIMEOUT = int(os.getenv("BROWSER_IDLE_TIMEOUT", 300))  # 空闲浏览器超时回收（秒）
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", 1024))  # 单个浏览器进程树的常驻内存上限（MB），超过后回收，0 表示不限制
+BROWSER_MAX_LIFETIME = float(os.getenv("BROWSER_MAX_LIFETIME", 3600))  # 单个浏览器的最长存活时间（秒），0 表示不限制
+TABS_PER_BROWSER = int(os.getenv("TABS_PER_BROWSER", 1))  # 单个浏览器进程同时执行的任务（标签页）数
+CLEARANCE_CACHE_MAX_ENTRIES = int(os.getenv("CLEARANCE_CACHE_MAX_ENTRIES", 1000))  # 0 表示关闭缓存
+CLEARANCE_CACHE_MAX_BYTES = int(os.getenv("CLEARANCE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+CLEARANCE_CACHE_DEFAULT_TTL = int(os.getenv("CLEARANCE_CACHE_DEFAULT_TTL", 300))  # 没有cf_clearance时的缓存时间（秒）
+CLEARANCE_CACHE_MAX_TTL = int(os.getenv("CLEARANCE_CACHE_MAX_TTL", 3600))
+CLEARANCE_STORE = os.getenv("CLEARANCE_STORE", "")  # 多实例共享的clearance存储：memory、sqlite://路径 或 redis://主机:端口/库
+REFRESH_BUDGET_PER_HOUR = float(os.getenv("REFRESH_BUDGET_PER_HOUR", 0))  # 每小时最多后台刷新次数，0 表示不启用后台刷新
+REFRESH_LEAD_TIME = float(os.getenv("REFRESH_LEAD_TIME", 60))  # clearance过期前多少秒开始后台刷新
+REFRESH_WINDOW = float(os.getenv("REFRESH_WINDOW", 600))  # 统计请求频率的窗口（秒）
+REFRESH_MIN_REQUESTS = float(os.getenv("REFRESH_MIN_REQUESTS", 3))  # 窗口内请求数达到该值才视为热门
+REFRESH_MAX_CONCURRENT = int(os.getenv("REFRESH_MAX_CONCURRENT", 1))  # 同时进行的最大后台刷新数
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", 100))  # 等待浏览器资源的最大排队数
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 90))  # 默认请求截止时间（秒），包含排队和执行
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", 60))  # 单个过盾任务的最长执行时间（秒）
+BROWSER_HANG_TIMEOUT = float(os.getenv("BROWSER_HANG_TIMEOUT", JOB_TIMEOUT * 3))  # 任务超过该秒数未归还浏览器即视为卡死并强制结束
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", 30))  # 浏览器看门狗检查间隔（秒），0 表示关闭
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 3))  # 同一目标主机或代理连续失败多少次后熔断，0 表示关闭
+CIRCUIT_RECOVERY_TIME = float(os.getenv("CIRCUIT_RECOVERY_TIME", 30))  # 熔断后多少秒放行探测请求
+CIRCUIT_MAX_RECOVERY_TIME = float(os.getenv("CIRCUIT_MAX_RECOVERY_TIME", 600))  # 探测连续失败时熔断时间的上限（秒）
+COOKIES_JOB_WEIGHT = float(os.getenv("COOKIES_JOB_WEIGHT", 1))
+HTML_JOB_WEIGHT = float(os.getenv("HTML_JOB_WEIGHT", 1))
+TURNSTILE_JOB_WEIGHT = float(os.getenv("TURNSTILE_JOB_WEIGHT", 3))  # turnstile任务耗时更长，排队时按更大权重计
+JOB_STORE_MAX = int(os.getenv("JOB_STORE_MAX", 1000))  # 异步任务登记表容量（含进行中和已完成）
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 300))  # 已完成异步任务的结果保留秒数
+BLOCK_PROFILE = os.getenv("BLOCK_PROFILE", "off")  # 默认资源拦截档位 off/light/strict，默认不拦截
+IDENTITY_DIR = os.getenv("IDENTITY_DIR", "")  # 持久化浏览器身份的目录，为空时不启用
+IDENTITY_MAX_AGE = float(os.getenv("IDENTITY_MAX_AGE", 7 * 86400))  # 身份超过该秒数未使用即清理
+IDENTITY_MAX_BYTES = int(os.getenv("IDENTITY_MAX_BYTES", 2 * 1024 ** 3))  # 所有身份目录的总大小上限
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))  # 单个批量请求的最大URL数
+METRICS_MAX_DOMAINS = int(os.getenv("METRICS_MAX_DOMAINS", 0))  # 按域名统计的最大域名数，其余归为 other；默认不输出域名标签
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "false").lower() in ("1", "true", "yes")  # 按主机压力自动调整并发上限
+ADAPTIVE_MIN_JOBS = int(os.getenv("ADAPTIVE_MIN_JOBS", 1))
+ADAPTIVE_MAX_JOBS = int(os.getenv("ADAPTIVE_MAX_JOBS", max(MAX_BROWSERS * TABS_PER_BROWSER, os.cpu_count() or 1)))
+ADAPTIVE_INTERVAL = float(os.getenv("ADAPTIVE_INTERVAL", 5))  # 调整间隔（秒）
+ADAPTIVE_CPU_HIGH = float(os.getenv("ADAPTIVE_CPU_HIGH", 85))  # CPU 使用率超过该百分比时降低上限
+ADAPTIVE_MIN_FREE_MB = int(os.getenv("ADAPTIVE_MIN_FREE_MB", 1024))  # 可用内存低于该值（MB）时降低上限
+ADAPTIVE_LATENCY_TOLERANCE = float(os.getenv("ADAPTIVE_LATENCY_TOLERANCE", 2.0))  # 过盾耗时超过基线的倍数时降低上限
+SERVER_PROCESSES = int(os.getenv("SERVER_PROCESSES", 1))  # API进程数，大于1时各进程共享全局槽位
+SHARED_SLOTS_PATH = os.getenv("SHARED_SLOTS_PATH", "")  # 共享槽位表文件，多进程模式下由主进程设置
+NODE_ROLE = os.getenv("NODE_ROLE", "standalone")  # standalone / worker（向协调节点汇报）/ coordinator（只转发请求）
+COORDINATOR_URL = os.getenv("COORDINATOR_URL", "")  # 工作节点汇报的协调节点地址
+NODE_URL = os.getenv("NODE_URL", f"http://{socket.gethostname()}:{SERVER_PORT}")  # 协调节点访问本节点的地址
+NODE_ID = os.getenv("NODE_ID", "") or f"{socket.gethostname()}:{SERVER_PORT}"
+NODE_HEARTBEAT_INTERVAL = float(os.getenv("NODE_HEARTBEAT_INTERVAL", 5))
+NODE_TTL = float(os.getenv("NODE_TTL", 15))  # 超过该秒数没有心跳的工作节点被移出路由
+NODE_MAX_FAILURES = int(os.getenv("NODE_MAX_FAILURES", 3))  # 连续转发失败该次数后工作节点被移出路由
+ROUTE_LOAD_FACTOR = float(os.getenv("ROUTE_LOAD_FACTOR", 1.25))  # 节点负载超过平均值的倍数后溢出到下一个节点
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
 
 # 日志初始化
 if LOG_LANG == "zh":
     logging.info(f"当前访问密码: {PASSWORD}")
     logging.info(f"最大并发浏览器数量: {MAX_BROWSERS}")
+    logging.info(f"每个浏览器的并发标签页数量: {TABS_PER_BROWSER}")
 else:
     logging.info(f"Current password: {PASSWORD}")
     logging.info(f"Maximum concurrent browsers: {MAX_BROWSERS}")
+    logging.info(f"Concurrent tabs per browser: {TABS_PER_BROWSER}")
 
 # 浏览器参数
 arguments = [
@@ -63,100 +151,806 @@ if not browser_path:
     else:
         logging.info(f"自动定位到浏览器路径: {browser_path}")
 
+# 构造浏览器启动参数
+def build_chromium_options(local_proxy: str = None, user_agent: str = None, profile_dir: str = None) -> ChromiumOptions:
+    options = ChromiumOptions().auto_port()
+    if profile_dir:
+        # 指定用户目录会关闭自动端口，需要自己找一个空闲的调试端口
+        options.set_user_data_path(profile_dir)
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            options.set_local_port(sock.getsockname()[1])
+    for argument in arguments:
+        options.set_argument(argument)
+    options.add_extension("turnstilePatch")
+    options.add_extension("cloudflare_ua_patch")
+    options.set_paths(browser_path=browser_path)
+    options.headless(os.getenv("HEADLESS", False))
+    options.ignore_certificate_errors(on_off=True)
+    options.set_user_agent(user_agent or DEFAULT_USER_AGENT)
+
+    if platform.system() == "Linux":
+        options.set_argument("--no-sandbox")
+        options.set_argument("--disable-dev-shm-usage")
+        options.set_argument("--disable-gpu")
+        options.set_argument("--disable-software-rasterizer")
+
+    if local_proxy:
+        options.set_proxy(local_proxy)
+    return options
+
 app = FastAPI()
 
+# 协调节点转发给工作节点的端点，按目标站点路由
+ROUTED_ENDPOINTS = ("cookies", "turnstile", "html")
+# 协调节点不运行浏览器，也不转发的端点（批量和异步任务），直接拒绝
+COORDINATOR_REJECTED_PATHS = (("cookies", "batch"), ("jobs",))
+node_registry = NodeRegistry(NODE_TTL, ROUTE_LOAD_FACTOR, max_failures=NODE_MAX_FAILURES) if NODE_ROLE == "coordinator" else None
+coordinator_session = None
+
+# 协调节点：把过盾请求转发到目标站点所属的工作节点，节点不可达时本次请求换下一个节点，连续失败多次才移除该节点
+@app.middleware("http")
+async def route_to_worker(request: Request, call_next):
+    parts = request.url.path.strip("/").split("/")
+    if node_registry is not None and parts[0] == PASSWORD and any(
+            tuple(parts[1:len(prefix) + 1]) == prefix for prefix in COORDINATOR_REJECTED_PATHS):
+        return JSONResponse({"detail": "协调节点不运行浏览器，批量和异步任务请直接发给工作节点"}, status_code=400)
+    url = request.query_params.get("url")
+    if (node_registry is None or request.method != "GET" or len(parts) != 2 or parts[0] != PASSWORD
+            or parts[1] not in ROUTED_ENDPOINTS or not url or not is_safe_url(url)):
+        return await call_next(request)
+
+    key = registrable_domain(url)
+    headers = dict(request.headers)
+    headers["X-Request-ID"] = log_request_id.get()
+    failed = []
+    while True:
+        node = node_registry.route(key, failed)
+        if node is None:
+            logging.warning(f"没有可用的工作节点: {key}")
+            return JSONResponse({"detail": "没有可用的工作节点"}, status_code=503, headers={"Retry-After": "5"})
+        try:
+            status, response_headers, chunks, release = await forward_request(
+                coordinator_session, node, request.method, request.url.path, request.url.query, headers, b"")
+            node_registry.record_success(node)
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"转发到工作节点失败: {node.id}, {e}")
+            node_registry.done(node)
+            node_registry.record_failure(node)
+            failed.append(node.id)
+    logging.info(f"转发请求: {key} -> {node.id}")
+    response_headers["X-Routed-Node"] = node.id
+
+    async def stream():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            release()
+            node_registry.done(node)
+
+    return StreamingResponse(stream(), status_code=status, headers=response_headers)
+
+# 为每个请求分配请求ID，写入日志上下文并通过响应头返回
+@app.middleware("http")
+async def bind_request_id(request: Request, call_next):
+    request_id = start_log_context(request.headers.get("x-request-id"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # 线程池
-thread_pool = ThreadPoolExecutor(max_workers=MAX_BROWSERS)
+# 自适应模式下上限可能增长到 ADAPTIVE_MAX_JOBS，线程数按最大值准备
+thread_pool = ThreadPoolExecutor(
+    max_workers=max(ADAPTIVE_MAX_JOBS, MAX_BROWSERS * TABS_PER_BROWSER) if ADAPTIVE_CONCURRENCY
+    else MAX_BROWSERS * TABS_PER_BROWSER)
+# 取消任务时关闭浏览器和代理的回调会阻塞数秒，不能在事件循环中执行；
+# 也不放进 thread_pool，被取消的任务往往正占满它
+teardown_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="teardown")
+
+# Prometheus 指标
+metrics_registry = Registry()
+phase_seconds = metrics_registry.histogram(
+    "cf_phase_duration_seconds", "Duration of each job phase", ["phase"])
+request_outcomes = metrics_registry.counter(
+    "cf_requests_total", "Requests by mode and outcome", ["mode", "outcome"])
+domain_requests = metrics_registry.counter(
+    "cf_domain_requests_total", "Requests by registrable domain, mode and outcome", ["domain", "mode", "outcome"])
+domain_seconds = metrics_registry.histogram(
+    "cf_domain_job_duration_seconds", "End-to-end job duration by registrable domain", ["domain", "mode"])
+domain_label = LabelLimiter(METRICS_MAX_DOMAINS)
+resource_requests = metrics_registry.counter(
+    "cf_resource_requests_total", "Page sub-resource requests by blocking decision", ["action"])
+watchdog_reclaimed = metrics_registry.counter(
+    "cf_watchdog_reclaimed_total", "Browsers and orphan processes reclaimed by the watchdog", ["reason"])
+watchdog_reclaimed_bytes = metrics_registry.counter(
+    "cf_watchdog_reclaimed_bytes_total", "Resident memory of processes reclaimed by the watchdog")
+page_bytes = metrics_registry.histogram(
+    "cf_job_received_bytes", "Bytes received by the page during one job", [],
+    buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6))
+worker_busy = 0  # 正在执行任务的工作线程数
+worker_lock = threading.Lock()
+
+# 任务阶段：同时标记日志上下文中的阶段并统计耗时
+@contextmanager
+def job_phase(phase: str):
+    previous = log_phase.set(phase)
+    try:
+        with phase_seconds.time(phase=phase):
+            yield
+    finally:
+        log_phase.reset(previous)
+
+def record_blocker_stats(stats: dict):
+    resource_requests.inc(stats["allowed"], action="allowed")
+    resource_requests.inc(stats["blocked"], action="blocked")
+    page_bytes.observe(stats["bytes_received"])
+    logging.info(f"资源拦截({stats['profile']}): 放行 {stats['allowed']}, 拦截 {stats['blocked']}, "
+                 f"接收 {stats['bytes_received']} 字节")
+
+def record_outcome(url: str, mode: str, outcome: str, duration: float = None):
+    request_outcomes.inc(mode=mode, outcome=outcome)
+    if METRICS_MAX_DOMAINS <= 0:
+        return
+    domain = domain_label(registrable_domain(url))
+    domain_requests.inc(domain=domain, mode=mode, outcome=outcome)
+    if duration is not None:
+        domain_seconds.observe(duration, domain=domain, mode=mode)
+
+# 一次任务对浏览器的占用：浏览器中一个独立的标签页
+class BrowserLease:
+    def __init__(self, pooled, tab, domain: str = None):
+        self.pooled = pooled
+        self.tab = tab
+        self.domain = domain  # 目标的可注册域名，同一浏览器中不同时运行同一站点的任务
+        self.started_at = time.time()
+
+    def origin(self):
+        try:
+            parsed = urlparse(self.tab.url)
+            if parsed.scheme in ("http", "https") and parsed.netloc:
+                return f"{parsed.scheme}://{parsed.netloc}"
+        except Exception:
+            pass
+        return None
+
+# 池中的预启动浏览器
+class PooledBrowser:
+    def __init__(self, key, page: ChromiumPage, local_proxy: str = None, identity=None):
+        self.key = key  # (proxy, user_agent)，启动参数相同的浏览器才能互相替代
+        self.page = page  # 初始标签页，始终保持打开，保证关闭任务标签页时浏览器不会退出
+        self.browser = page.browser
+        self.local_proxy = local_proxy
+        self.process_id = page.process_id
+        self.identity = identity  # 持久化身份，浏览器存活期间独占
+        self.leases = set()
+        self.uses = 0
+        self.retiring = False
+        self.retired = False
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.cdp_lock = threading.Lock()  # 浏览器级别的CDP连接不是线程安全的
+
+    def domains(self):
+        return {lease.domain for lease in self.leases}
+
+    def is_healthy(self) -> bool:
+        try:
+            with self.cdp_lock:
+                return self.browser.states.is_alive and self.browser.tabs_count > 0
+        except Exception:
+            return False
+
+    def open_tab(self) -> ChromiumTab:
+        with self.cdp_lock:
+            return self.browser.new_tab()
+
+    def close_tab(self, lease: BrowserLease, clear_all: bool = False):
+        """清理任务留下的cookies与存储并关闭任务标签页；持久化身份的浏览器保留cookies供下次使用"""
+        try:
+            origin = lease.origin()
+            if origin and self.identity is None:
+                lease.tab.run_cdp("Storage.clearDataForOrigin", origin=origin, storageTypes="all")
+        finally:
+            with self.cdp_lock:
+                lease.tab.close()
+                if clear_all and self.identity is None:
+                    self.browser.clear_cache(cache=False, cookies=True)
+
+    def restore_cookies(self):
+        cookies = self.identity.load_cookies()
+        if cookies:
+            with self.cdp_lock:
+                self.page.run_cdp("Network.setCookies", cookies=cookies)
+            logging.info(f"恢复身份cookie: {self.identity.id}, {len(cookies)} 个")
+
+    def save_cookies(self):
+        with self.cdp_lock:
+            cookies = self.browser.cookies(all_info=True)
+        self.identity.save_cookies(cookies)
+
+    def quit(self):
+        try:
+            self.browser.quit()
+        except Exception as e:
+            logging.error(f"关闭浏览器失败: {str(e)}")
 
 # 浏览器池管理类
 class BrowserPoolManager:
-    def __init__(self, max_browsers=MAX_BROWSERS):
+    def __init__(self, max_browsers=MAX_BROWSERS, min_warm=BROWSER_POOL_MIN_WARM,
+                 max_uses=BROWSER_MAX_USES, idle_timeout=BROWSER_IDLE_TIMEOUT,
+                 tabs_per_browser=TABS_PER_BROWSER):
         self.max_browsers = max_browsers
+        self.tabs_per_browser = max(tabs_per_browser, 1)
+        self.max_jobs = max_browsers * self.tabs_per_browser
         self.active_browsers = 0
-        self.browser_lock = threading.Lock()
-        self.browser_semaphore = threading.BoundedSemaphore(max_browsers)
-        self.active_proxies = set()
+        self.browser_lock = threading.Lock()  # 保护 active_browsers 与 max_jobs，上限可在运行时调整
+        self.active_proxies = Counter()
         self.proxy_lock = threading.Lock()
+        # 预热浏览器池
+        self.min_warm = min_warm
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self.idle_pool = []  # 没有任务的浏览器，按归还时间排序，末尾最新
+        self.busy_pool = set()  # 至少有一个任务标签页的浏览器
+        self.launching = 0
+        self.pool_lock = threading.Lock()
+        self.pool_changed = threading.Condition(self.pool_lock)  # 浏览器被归还或回收时通知等待中的任务
+        self.warm_event = threading.Event()
+        self.warmer_thread = None
+        self.warmed_up = min_warm <= 0
+        self.last_launch_error = None
+        self.stopped = False
+        self.release_listeners = []  # 释放资源时的回调，例如唤醒排队中的请求
 
     def acquire_browser(self):
-        result = self.browser_semaphore.acquire(blocking=False)
-        if result:
-            with self.browser_lock:
+        with self.browser_lock:
+            # 本进程还有配额时再占用全局槽位，全局槽位可能已被其他进程占满
+            result = self.active_browsers < self.max_jobs and (
+                shared_slot_table is None or shared_slot_table.try_acquire())
+            if result:
                 self.active_browsers += 1
-                logging.info(f"[{time.time()}] 当前活跃浏览器数: {self.active_browsers}/{self.max_browsers}")
-        else:
-            logging.warning(f"[{time.time()}] 浏览器资源已达上限，无法获取新资源")
+                logging.info(f"当前活跃任务数: {self.active_browsers}/{self.max_jobs}")
+        if not result:
+            logging.warning("浏览器资源已达上限，无法获取新资源")
         return result
 
     def release_browser(self):
         with self.browser_lock:
             if self.active_browsers > 0:
                 self.active_browsers -= 1
-                logging.info(f"[{time.time()}] 释放浏览器资源，当前活跃浏览器数: {self.active_browsers}/{self.max_browsers}")
-                self.browser_semaphore.release()
+                logging.info(f"释放浏览器资源，当前活跃任务数: {self.active_browsers}/{self.max_jobs}")
+                if shared_slot_table:
+                    shared_slot_table.release()
             else:
-                logging.warning(f"[{time.time()}] 尝试释放不存在的浏览器资源")
+                logging.warning("尝试释放不存在的浏览器资源")
+                return
+        for listener in self.release_listeners:
+            listener()
 
     def register_proxy(self, proxy):
         if proxy:
             with self.proxy_lock:
-                self.active_proxies.add(proxy)
-                logging.info(f"[{time.time()}] 注册代理: {proxy}, 当前活跃代理数: {len(self.active_proxies)}")
+                # 多个浏览器可能共享同一个本地代理，按引用计数
+                self.active_proxies[proxy] += 1
+                logging.info(f"注册代理: {proxy}, 当前活跃代理数: {len(self.active_proxies)}")
 
     def unregister_proxy(self, proxy):
         if proxy:
             with self.proxy_lock:
                 if proxy in self.active_proxies:
-                    self.active_proxies.remove(proxy)
-                    logging.info(f"[{time.time()}] 注销代理: {proxy}, 当前活跃代理数: {len(self.active_proxies)}")
+                    self.active_proxies[proxy] -= 1
+                    if self.active_proxies[proxy] <= 0:
+                        del self.active_proxies[proxy]
+                    logging.info(f"注销代理: {proxy}, 当前活跃代理数: {len(self.active_proxies)}")
                 else:
-                    logging.warning(f"[{time.time()}] 尝试注销不存在的代理: {proxy}")
+                    logging.warning(f"尝试注销不存在的代理: {proxy}")
+
+    def launch_browser(self, proxy: str = None, user_agent: str = None) -> PooledBrowser:
+        user_agent = user_agent or DEFAULT_USER_AGENT
+        local_proxy = None
+        if proxy:
+            logging.info(f"使用代理: {proxy}")
+            if "@" in proxy:
+                # 相同凭据的浏览器共享同一个本地代理
+                with job_phase("proxy_setup"):
+                    local_proxy = acquire_proxy(proxy)
+            else:
+                local_proxy = proxy
+            self.register_proxy(local_proxy)
+        identity = identity_store.try_acquire(proxy, user_agent) if identity_store else None
+        if identity_store and identity is None:
+            logging.info("身份正被其他浏览器使用，本次使用临时目录")
+        try:
+            with job_phase("launch"):
+                page = ChromiumPage(addr_or_opts=build_chromium_options(
+                    local_proxy, user_agent, identity.profile_dir if identity else None))
+        except Exception as e:
+            self.last_launch_error = str(e)
+            if identity:
+                identity.release()
+            if local_proxy:
+                self.unregister_proxy(local_proxy)
+                if local_proxy != proxy:
+                    release_proxy(local_proxy)
+            raise
+        self.last_launch_error = None
+        logging.info(f"启动新浏览器, 进程ID: {page.process_id}")
+        pooled = PooledBrowser((proxy, user_agent), page, local_proxy, identity)
+        track_process(pooled.process_id, "chrome")
+        if identity:
+            try:
+                pooled.restore_cookies()
+            except Exception as e:
+                logging.warning(f"恢复身份cookie失败: {str(e)}")
+        return pooled
+
+    def retire_browser(self, pooled: PooledBrowser):
+        with self.pool_lock:
+            if pooled.retired:
+                return
+            pooled.retired = True
+            pooled.retiring = True
+            self.pool_changed.notify_all()
+        pooled.quit()
+        untrack_process(pooled.process_id)
+        if pooled.identity:
+            # 浏览器退出后才释放，确保用户目录已写完
+            pooled.identity.release()
+        if pooled.local_proxy:
+            try:
+                self.unregister_proxy(pooled.local_proxy)
+                if pooled.local_proxy != pooled.key[0]:
+                    release_proxy(pooled.local_proxy)
+            except Exception as e:
+                logging.error(f"清理代理资源失败: {str(e)}")
+
+    def _can_host(self, pooled: PooledBrowser, key, domain) -> bool:
+        # 同一浏览器内的标签页共享cookie，同一站点的任务不能同时落在一个浏览器上
+        return (pooled.key == key and not pooled.retiring
+                and len(pooled.leases) < self.tabs_per_browser
+                and domain not in pooled.domains())
+
+    def _reserve_launch(self) -> bool:
+        """多进程模式下在共享表中预留一个浏览器名额，所有服务进程的浏览器总数不超过 max_browsers"""
+        return shared_slot_table is None or shared_slot_table.reserve_process("chrome", self.max_browsers)
+
+    def _attach_lease(self, lease: BrowserLease):
+        """把任务登记到浏览器上，调用方需持有 pool_lock"""
+        pooled = lease.pooled
+        pooled.leases.add(lease)
+        self.busy_pool.add(pooled)
+        pooled.uses += 1
+        pooled.last_used_at = time.time()
+        if pooled.uses >= self.max_uses:
+            pooled.retiring = True
+
+    def _finish_launch(self, pooled, lease: BrowserLease = None):
+        """
+        启动结束（成功或失败）后调用；启动失败或没有进程ID时预留的名额不会被登记填入，在此归还。
+        启动成功的浏览器在清除启动计数的同一加锁区段内放入池中：有任务时登记任务，否则放入空闲池，
+        中间没有不被计数的窗口，其他任务或预热线程不会因此超出 max_browsers 启动。
+        """
+        if shared_slot_table is not None and (pooled is None or not pooled.process_id):
+            shared_slot_table.cancel_reservation("chrome")
+        with self.pool_lock:
+            self.launching -= 1
+            if lease is not None:
+                self._attach_lease(lease)
+            elif pooled is not None:
+                self.idle_pool.append(pooled)
+            self.pool_changed.notify_all()
+
+    def _pick_browser(self, key, domain, cancel_token: CancellationToken = None):
+        """
+        选出可以运行任务的浏览器，都不可用时等待。
+        Returns:
+            tuple: (可用的浏览器, 需要回收以腾出位置的空闲浏览器)；都为 None 时已预留名额，调用方启动新浏览器
+        """
+        waiting = False
+        try:
+            with self.pool_lock:
+                while True:
+                    if self.stopped:
+                        raise RuntimeError("浏览器池已停止")
+                    # 优先填满已在工作的浏览器，让空闲浏览器尽早被回收
+                    shared = [b for b in self.busy_pool if self._can_host(b, key, domain)]
+                    if shared:
+                        return max(shared, key=lambda b: len(b.leases)), None
+                    for candidate in reversed(self.idle_pool):
+                        if self._can_host(candidate, key, domain):
+                            self.idle_pool.remove(candidate)
+                            return candidate, None
+                    total = len(self.idle_pool) + len(self.busy_pool) + self.launching
+                    if total < self.max_browsers:
+                        if self._reserve_launch():
+                            self.launching += 1
+                            return None, None
+                        if not self.idle_pool and not waiting and shared_slot_table is not None:
+                            # 名额被其他进程占满，登记等待，其他进程会回收自己的空闲浏览器
+                            waiting = shared_slot_table.reserve_process("waiting")
+                    if self.idle_pool:
+                        # 腾出位置：回收最久未用的其他配置浏览器，退出后再重新选择
+                        return None, self.idle_pool.pop(0)
+                    # 所有浏览器都在运行无法共享的任务（配置不同或同一站点），等待归还
+                    self.pool_changed.wait(timeout=1)
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+        finally:
+            if waiting:
+                shared_slot_table.cancel_reservation("waiting")
+
+    def checkout_browser(self, proxy: str = None, user_agent: str = None, domain: str = None,
+                         cancel_token: CancellationToken = None) -> BrowserLease:
+        """
+        在启动参数匹配的浏览器中打开一个任务标签页，没有可用浏览器时启动新的。
+        浏览器数量已达上限且没有可回收的空闲浏览器时，等待其他任务归还浏览器，不会超出上限启动。
+        Raises:
+            BypassCancelled: 等待期间任务被取消
+            RuntimeError: 浏览器池已停止
+        """
+        key = (proxy, user_agent or DEFAULT_USER_AGENT)
+        while True:
+            pooled, evicted = self._pick_browser(key, domain, cancel_token)
+            if evicted:
+                logging.info(f"回收空闲浏览器以腾出位置, 配置: {evicted.key[0]}")
+                self.retire_browser(evicted)
+                continue
+            if pooled is None:
+                lease = None
+                try:
+                    pooled = self.launch_browser(proxy, user_agent)
+                    lease = BrowserLease(pooled, None, domain)
+                finally:
+                    self._finish_launch(pooled, lease)
+            elif not pooled.leases and not pooled.is_healthy():
+                logging.warning("空闲浏览器健康检查失败，重新获取")
+                self.retire_browser(pooled)
+                continue
+            else:
+                logging.info(f"复用预热浏览器, 已使用次数: {pooled.uses}, 当前标签页数: {len(pooled.leases)}")
+                lease = BrowserLease(pooled, None, domain)
+                with self.pool_lock:
+                    self._attach_lease(lease)
+            try:
+                lease.tab = pooled.open_tab()
+            except Exception:
+                self.checkin_browser(lease, reusable=False)
+                raise
+            return lease
+
+    def abort_lease(self, lease: BrowserLease):
+        """任务被取消时立即释放它占用的浏览器：独占时直接关闭浏览器和代理，共享时只关闭任务标签页"""
+        pooled = lease.pooled
+        with self.pool_lock:
+            if lease not in pooled.leases:
+                # 已经归还，浏览器可能正被其他任务使用
+                return
+            exclusive = len(pooled.leases) == 1
+            if exclusive:
+                pooled.retiring = True
+        if exclusive:
+            logging.warning("任务已取消，立即关闭浏览器")
+            self.retire_browser(pooled)
+        elif lease.tab is not None:
+            logging.warning("任务已取消，立即关闭任务标签页")
+            try:
+                with pooled.cdp_lock:
+                    lease.tab.close()
+            except Exception as e:
+                logging.error(f"关闭任务标签页失败: {str(e)}")
+            lease.tab = None
+
+    def checkin_browser(self, lease: BrowserLease, reusable: bool = True):
+        """归还任务标签页：清理后关闭；浏览器没有任务后放回空闲池，或在达到复用上限/不健康时回收"""
+        if lease is None:
+            return
+        pooled = lease.pooled
+        with self.pool_lock:
+            if not reusable:
+                pooled.retiring = True
+            last_lease = len(pooled.leases) == 1
+        if pooled.identity is not None and lease.tab is not None:
+            try:
+                pooled.save_cookies()
+            except Exception as e:
+                logging.error(f"保存身份cookie失败: {str(e)}")
+        if lease.tab is not None and not (pooled.retiring and last_lease):
+            try:
+                pooled.close_tab(lease, clear_all=last_lease)
+            except Exception as e:
+                logging.error(f"重置浏览器失败: {str(e)}")
+                pooled.retiring = True
+        with self.pool_lock:
+            pooled.leases.discard(lease)
+            self.pool_changed.notify_all()
+            if pooled.leases:
+                return
+            self.busy_pool.discard(pooled)
+            keep = not pooled.retiring and not self.stopped
+        if keep and pooled.is_healthy():
+            pooled.last_used_at = time.time()
+            with self.pool_lock:
+                self.idle_pool.append(pooled)
+                self.pool_changed.notify_all()
+            logging.info(f"浏览器已重置并放回池中, 空闲浏览器数: {len(self.idle_pool)}")
+            return
+        logging.info(f"回收浏览器, 已使用次数: {pooled.uses}")
+        self.retire_browser(pooled)
+        self.warm_event.set()
+
+    def _warm_up_once(self):
+        now = time.time()
+        expired = []
+        with self.pool_lock:
+            default_idle = [b for b in self.idle_pool if b.key == (None, DEFAULT_USER_AGENT)]
+            keep = set(default_idle[-self.min_warm:]) if self.min_warm > 0 else set()
+            for pooled in list(self.idle_pool):
+                if pooled not in keep and now - pooled.last_used_at > self.idle_timeout:
+                    self.idle_pool.remove(pooled)
+                    expired.append(pooled)
+            total = len(self.idle_pool) + len(self.busy_pool) + self.launching
+            missing = min(self.min_warm - len(default_idle), self.max_browsers - total)
+            missing = max(missing, 0)
+            if shared_slot_table is not None:
+                # 其他进程有任务在等待浏览器名额时，让出本进程最久未用的空闲浏览器，也暂不预热
+                if shared_slot_table.count_processes("waiting", others_only=True):
+                    if self.idle_pool:
+                        expired.append(self.idle_pool.pop(0))
+                    missing = 0
+                reserved = 0
+                while reserved < missing and self._reserve_launch():
+                    reserved += 1
+                missing = reserved
+            self.launching += missing
+        for pooled in expired:
+            logging.info("回收超时空闲浏览器")
+            self.retire_browser(pooled)
+        if identity_store:
+            identity_store.maybe_gc()
+        if shared_slot_table:
+            shared_slot_table.reap()
+        for _ in range(missing):
+            pooled = None
+            try:
+                pooled = self.launch_browser()
+            except Exception as e:
+                logging.error(f"预热浏览器失败: {str(e)}")
+            finally:
+                self._finish_launch(pooled)
+            if pooled is not None:
+                logging.info(f"预热浏览器就绪, 空闲浏览器数: {len(self.idle_pool)}")
+        with self.pool_lock:
+            default_idle = sum(1 for b in self.idle_pool if b.key == (None, DEFAULT_USER_AGENT))
+            if default_idle >= min(self.min_warm, self.max_browsers) or self.busy_pool:
+                self.warmed_up = True
+
+    def _warmer_loop(self):
+        while not self.stopped:
+            try:
+                self._warm_up_once()
+            except Exception as e:
+                logging.error(f"浏览器池维护失败: {str(e)}")
+            self.warm_event.wait(timeout=5)
+            self.warm_event.clear()
+
+    def start_warmer(self):
+        if self.warmer_thread is None:
+            self.warmer_thread = threading.Thread(target=self._warmer_loop, name="browser-pool-warmer", daemon=True)
+            self.warmer_thread.start()
+
+    def is_ready(self):
+        return self.warmed_up and self.last_launch_error is None
 
     def cleanup(self):
-        logging.info(f"[{time.time()}] 执行浏览器池清理...")
+        logging.info("执行浏览器池清理...")
+        self.stopped = True
+        self.warm_event.set()
+        with self.pool_lock:
+            browsers = self.idle_pool + list(self.busy_pool)
+            self.idle_pool = []
+            self.busy_pool.clear()
+        for pooled in browsers:
+            self.retire_browser(pooled)
         with self.proxy_lock:
-            for proxy in list(self.active_proxies):
-                try:
-                    stop_proxy(proxy)
-                    self.active_proxies.remove(proxy)
-                    logging.info(f"[{time.time()}] 清理代理: {proxy}")
-                except Exception as e:
-                    logging.error(f"[{time.time()}] 清理代理失败: {proxy}, 错误: {str(e)}")
+            self.active_proxies.clear()
+        try:
+            close_all_proxies()
+            logging.info("清理本地代理")
+        except Exception as e:
+            logging.error(f"清理本地代理失败: {str(e)}")
 
     def get_status(self):
         with self.browser_lock:
-            return {
+            status = {
                 "active_browsers": self.active_browsers,
                 "max_browsers": self.max_browsers,
-                "available_slots": self.max_browsers - self.active_browsers
+                "available_slots": self.max_jobs - self.active_browsers,
+                "tabs_per_browser": self.tabs_per_browser,
+                "max_jobs": self.max_jobs
             }
+        with self.pool_lock:
+            status.update({
+                "idle_browsers": len(self.idle_pool),
+                "busy_browsers": len(self.busy_pool),
+                "launching_browsers": self.launching,
+                "min_warm": self.min_warm,
+                "ready": self.is_ready()
+            })
+        return status
+
+    def configure(self, max_browsers: int, tabs_per_browser: int):
+        """调整浏览器数量与每个浏览器的标签页数量"""
+        self.tabs_per_browser = max(tabs_per_browser, 1)
+        self.resize(max_browsers * self.tabs_per_browser)
+
+    def resize(self, max_jobs: int):
+        """
+        在运行时调整并发任务上限，浏览器数量上限随之调整。
+        缩小时不中断进行中的任务，只是在任务数降到新上限以下前不再分配；多出的空闲浏览器按空闲超时回收。
+        """
+        with self.browser_lock:
+            grown = max_jobs > self.max_jobs
+            self.max_jobs = max(max_jobs, 1)
+            self.max_browsers = math.ceil(self.max_jobs / self.tabs_per_browser)
+        if grown:
+            for listener in self.release_listeners:
+                listener()
 
     def can_acquire_browser(self):
         with self.browser_lock:
-            return self.active_browsers < self.max_browsers
+            return self.active_browsers < self.max_jobs
 
+identity_store = IdentityStore(IDENTITY_DIR, IDENTITY_MAX_AGE, IDENTITY_MAX_BYTES) if IDENTITY_DIR else None
 browser_pool = BrowserPoolManager()
 
+# 并发任务上限可能达到的最大值，用于分配线程和共享槽位
+def max_job_capacity() -> int:
+    return max(ADAPTIVE_MAX_JOBS, browser_pool.max_jobs) if ADAPTIVE_CONCURRENCY else browser_pool.max_jobs
+
+shared_slot_table = SharedSlotTable(SHARED_SLOTS_PATH, max_job_capacity()) if SHARED_SLOTS_PATH else None
+attach_shared_slots(shared_slot_table)
+clearance_cache = ClearanceCache(CLEARANCE_CACHE_MAX_ENTRIES, CLEARANCE_CACHE_MAX_BYTES)
+clearance_store = create_clearance_store(CLEARANCE_STORE)
+circuit_breakers = CircuitBreakerRegistry(
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RECOVERY_TIME,
+    CIRCUIT_MAX_RECOVERY_TIME,
+    probe_timeout=REQUEST_DEADLINE + JOB_TIMEOUT
+) if CIRCUIT_FAILURE_THRESHOLD > 0 else None
+single_flight = SingleFlight()
+job_store = JobStore(JOB_STORE_MAX, JOB_RESULT_TTL)
+admission_queue = AdmissionQueue(
+    browser_pool.acquire_browser,
+    browser_pool.release_browser,
+    QUEUE_MAX_DEPTH,
+    capacity=lambda: browser_pool.max_jobs
+)
+browser_pool.release_listeners.append(admission_queue.notify)
+# 后台刷新只用空闲槽位，有请求排队时不开始
+refresh_scheduler = RefreshScheduler(
+    lambda entry: refresh_clearance(entry),
+    lambda: admission_queue.depth == 0 and browser_pool.can_acquire_browser(),
+    lead_time=REFRESH_LEAD_TIME,
+    window=REFRESH_WINDOW,
+    min_requests=REFRESH_MIN_REQUESTS,
+    budget_per_hour=REFRESH_BUDGET_PER_HOUR,
+    max_concurrent=REFRESH_MAX_CONCURRENT
+) if REFRESH_BUDGET_PER_HOUR > 0 and CLEARANCE_CACHE_MAX_ENTRIES > 0 else None
+
+def _record_reclaimed(reason: str, rss: int):
+    watchdog_reclaimed.inc(reason=reason)
+    watchdog_reclaimed_bytes.inc(rss)
+
+browser_watchdog = BrowserWatchdog(
+    browser_pool,
+    max_rss=BROWSER_MAX_RSS_MB * 1024 ** 2,
+    max_lifetime=BROWSER_MAX_LIFETIME,
+    hang_timeout=BROWSER_HANG_TIMEOUT,
+    interval=WATCHDOG_INTERVAL
+) if WATCHDOG_INTERVAL > 0 else None
+if browser_watchdog:
+    browser_watchdog.listeners.append(_record_reclaimed)
+
+def _node_status():
+    with browser_pool.browser_lock:
+        free_slots = browser_pool.max_jobs - browser_pool.active_browsers
+    return {"max_jobs": browser_pool.max_jobs, "free_slots": free_slots, "queue_depth": admission_queue.depth}
+
+heartbeat_sender = HeartbeatSender(COORDINATOR_URL, PASSWORD, NODE_ID, NODE_URL, _node_status,
+                                   NODE_HEARTBEAT_INTERVAL) if NODE_ROLE == "worker" and COORDINATOR_URL else None
+
+def _pool_saturated() -> bool:
+    with browser_pool.browser_lock:
+        return browser_pool.active_browsers >= browser_pool.max_jobs or admission_queue.depth > 0
+
+concurrency_controller = AdaptiveConcurrency(
+    lambda: browser_pool.max_jobs,
+    browser_pool.resize,
+    _pool_saturated,
+    floor=ADAPTIVE_MIN_JOBS,
+    ceiling=ADAPTIVE_MAX_JOBS,
+    interval=ADAPTIVE_INTERVAL,
+    cpu_high=ADAPTIVE_CPU_HIGH,
+    min_free_bytes=ADAPTIVE_MIN_FREE_MB * 1024 ** 2,
+    latency_tolerance=ADAPTIVE_LATENCY_TOLERANCE
+) if ADAPTIVE_CONCURRENCY else None
+
+def _pool_occupancy():
+    status = browser_pool.get_status()
+    return {
+        ("jobs_active",): status["active_browsers"],
+        ("jobs_max",): status["max_jobs"],
+        ("browsers_idle",): status["idle_browsers"],
+        ("browsers_busy",): status["busy_browsers"],
+        ("browsers_launching",): status["launching_browsers"],
+        ("browsers_max",): status["max_browsers"]
+    }
+
+def _thread_pool_saturation():
+    return {
+        ("busy",): worker_busy,
+        ("max",): thread_pool._max_workers,
+        ("queued",): thread_pool._work_queue.qsize()
+    }
+
+metrics_registry.gauge("cf_pool", "Browser pool occupancy", _pool_occupancy, ["state"])
+metrics_registry.gauge("cf_thread_pool_workers", "Worker thread pool saturation", _thread_pool_saturation, ["state"])
+metrics_registry.gauge("cf_queue_depth", "Requests waiting for a browser slot", lambda: admission_queue.depth)
+metrics_registry.gauge("cf_clearance_cache_entries", "Cached clearance entries", lambda: len(clearance_cache.entries))
+metrics_registry.gauge("cf_single_flight_in_flight", "Coalesced jobs in flight", lambda: len(single_flight.calls))
+if circuit_breakers:
+    metrics_registry.gauge("cf_circuit_open", "Open or half-open circuit breakers by scope",
+                           lambda: {(scope,): count for scope, count in circuit_breakers.open_count().items()}, ["scope"])
+if refresh_scheduler:
+    metrics_registry.gauge("cf_refresh_tracked", "Clearance entries tracked for background refresh",
+                           lambda: len(refresh_scheduler.entries))
+if browser_watchdog:
+    metrics_registry.gauge("cf_browser_rss_bytes", "Resident memory of pooled browser process trees at the last check",
+                           lambda: sum(browser_watchdog.last_rss.values()))
+if node_registry is not None:
+    metrics_registry.gauge("cf_coordinator_nodes", "Registered worker nodes", lambda: len(node_registry.nodes))
+    metrics_registry.gauge("cf_coordinator_inflight", "Requests forwarded and not yet finished, by node",
+                           lambda: {(n.id,): n.inflight for n in list(node_registry.nodes.values())}, ["node"])
+
 # 请求结果类
 class RequestResult:
     def __init__(self):
         self.result = None
         self.error = None
+        self.expires_at = None
         self.event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.cancel_token = CancellationToken()
+
+    # 结果由工作线程写入，asyncio.Event 不是线程安全的，需要回到事件循环中设置
+    def _notify(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.event.set)
 
     def set_result(self, result):
         self.result = result
-        self.event.set()
+        self._notify()
 
     def set_error(self, error):
         self.error = error
-        self.event.set()
+        self._notify()
 
 # 清理资源
 def cleanup_resources():
-    logging.info(f"[{time.time()}] 程序退出，清理资源...")
+    logging.info("程序退出，清理资源...")
     browser_pool.cleanup()
+    if browser_watchdog:
+        # quit 失败遗留的浏览器进程不会随本进程退出，立即结束
+        browser_watchdog.stop()
+        browser_watchdog.reap_orphans(grace=0)
     thread_pool.shutdown(wait=False)
+    teardown_pool.shutdown(wait=False)
+    if shared_slot_table:
+        shared_slot_table.release_owned()
+    if clearance_store:
+        clearance_store.close()
 
 atexit.register(cleanup_resources)
 
@@ -165,15 +959,59 @@ class CookieResponse(BaseModel):
     cookies: Dict[str, str]
     user_agent: str
 
+class BatchItem(BaseModel):
+    url: str
+    proxy: str = None
+    user_agent: str = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    retries: int = 5
+    force_refresh: bool = False
+    priority: str = "normal"
+    client_id: str = None
+    deadline: float = None
+    block: str = None
+    allow: str = None
+    deny: str = None
+
+class JobSubmit(BaseModel):
+    url: str
+    mode: str = "cookies"  # cookies / turnstile
+    retries: int = 5
+    proxy: str = None
+    user_agent: str = None
+    force_refresh: bool = False
+    priority: str = "normal"
+    client_id: str = None
+    deadline: float = None
+    block: str = None
+    allow: str = None
+    deny: str = None
+
+class NodeHeartbeat(BaseModel):
+    node_id: str
+    url: str
+    max_jobs: int
+    free_slots: int
+    queue_depth: int = 0
+
 class PoolStatus(BaseModel):
     active_browsers: int
     max_browsers: int
     available_slots: int
+    idle_browsers: int = 0
+    busy_browsers: int = 0
+    launching_browsers: int = 0
+    min_warm: int = 0
+    tabs_per_browser: int = 1
+    max_jobs: int = 0
+    ready: bool = False
 
 # 密码验证
 async def verify_password(password: str):
     if password != PASSWORD:
-        logging.warning(f"[{time.time()}] 密码验证失败: {password}")
+        logging.warning(f"密码验证失败: {password}")
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Invalid password")
     return password
 
@@ -195,61 +1033,71 @@ def bypass_cloudflare(
         log: bool,
         turnstile: bool = False,
         proxy: str = None,
-        user_agent: str = None
-) -> tuple[ChromiumPage, str | None]:
-    logging.info(f"[{time.time()}] 开始绕过Cloudflare验证: {url}")
-    options = ChromiumOptions().auto_port()
-    for argument in arguments:
-        options.set_argument(argument)
-    options.add_extension("turnstilePatch")
-    options.add_extension("cloudflare_ua_patch")
-    options.set_paths(browser_path=browser_path)
-    options.headless(os.getenv("HEADLESS", False))
-    options.ignore_certificate_errors(on_off=True)
-    if user_agent:
-        options.set_user_agent(user_agent)
-    else:
-        options.set_user_agent(
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
-        )
-
-    if platform.system() == "Linux":
-        logging.info(f"[{time.time()}] 检测到Linux系统，应用特殊配置")
-        options.set_argument("--no-sandbox")
-        options.set_argument("--disable-dev-shm-usage")
-        options.set_argument("--disable-gpu")
-        options.set_argument("--disable-software-rasterizer")
-
-    no_auth_proxy = None
-    if proxy:
-        logging.info(f"[{time.time()}] 使用代理: {proxy}")
-        if "@" in proxy:
-            no_auth_proxy = start_proxy_with_auth(proxy)
-        else:
-            no_auth_proxy = proxy
-        options.set_proxy(no_auth_proxy)
-        browser_pool.register_proxy(no_auth_proxy)
-
-    driver = None
+        user_agent: str = None,
+        cancel_token: CancellationToken = None,
+        block_policy: BlockPolicy = None
+) -> tuple[ChromiumTab, BrowserLease, str]:
+    logging.info(f"开始绕过Cloudflare验证: {url}")
+    cancel_token = cancel_token or CancellationToken()
+    cancel_token.raise_if_cancelled()
+    started_at = time.time()
+    lease = browser_pool.checkout_browser(proxy, user_agent, registrable_domain(url), cancel_token)
+    # 取消时立即关闭浏览器（或标签页）和代理，正在进行的浏览器调用会随之失败返回
+    abort = lambda: browser_pool.abort_lease(lease)
+    cancel_token.add_callback(abort)
+    driver = lease.tab
+    report_progress("launched")
+    # 在导航前开始监听，避免错过页面加载期间写入的 cf_clearance
+    watcher = ChallengeWatcher(driver).start()
+    blocker = ResourceBlocker(driver, block_policy or BlockPolicy(url, "off")).start()
+    cf_bypasser = None
+    host = urlparse(url).hostname
     try:
-        driver = ChromiumPage(addr_or_opts=options)
-        driver.get(url)
-        cf_bypasser = CloudflareBypasser(driver, retries, log)
+        with job_phase("navigation"):
+            driver.get(url)
+        cancel_token.raise_if_cancelled()
+        if driver.url.startswith("chrome-error://"):
+            # 代理或目标站点无法连接，Chromium 显示的是本地错误页
+            raise classify_net_error(driver.html)
+        report_progress("navigated")
+        # 给读取cookies和归还浏览器留出余量
+        timeout = max(JOB_TIMEOUT - (time.time() - started_at) - 5, 1)
+        cf_bypasser = CloudflareBypasser(driver, retries, log, timeout=timeout, watcher=watcher,
+                                         cancel_token=cancel_token, progress=report_progress)
+        turnstile_token = ""
+        log_phase.set("challenge_solve")
         if turnstile:
-            logging.info(f"[{time.time()}] 开始绕过turnstile验证")
-            cf_bypasser.bypass_turnstile()
+            logging.info("开始绕过turnstile验证")
+            turnstile_token = cf_bypasser.bypass_turnstile()
+            solved = True  # 没有5秒盾时也可能拿到token，是否失败由token决定
         else:
-            logging.info(f"[{time.time()}] 开始绕过普通验证")
-            cf_bypasser.bypass()
-        return driver, no_auth_proxy
+            logging.info("开始绕过普通验证")
+            solved = cf_bypasser.bypass()
+        cancel_token.raise_if_cancelled()
+        if is_block_page(driver.title):
+            raise TargetBlocked(f"目标站点拒绝访问: {driver.title}")
+        if not solved:
+            raise ChallengeFailed("超过重试次数或超时仍未通过验证")
+        if circuit_breakers:
+            circuit_breakers.record_success(host, proxy)
+        return driver, lease, turnstile_token
     except Exception as e:
-        logging.error(f"[{time.time()}] 绕过Cloudflare验证失败: {str(e)}")
-        if driver:
-            driver.quit()
-        if no_auth_proxy:
-            browser_pool.unregister_proxy(no_auth_proxy)
-            stop_proxy(no_auth_proxy)
+        if cancel_token.cancelled:
+            e = BypassCancelled(cancel_token.reason or "任务已取消")
+        elif circuit_breakers and isinstance(e, BypassFailure):
+            circuit_breakers.record_failure(host, proxy, e)
+        logging.error(f"绕过Cloudflare验证失败: {str(e)}")
+        cancel_token.remove_callback(abort)
+        with job_phase("teardown"):
+            browser_pool.checkin_browser(lease, reusable=not cancel_token.cancelled)
         raise e
+    finally:
+        watcher.stop()
+        blocker.stop()
+        record_blocker_stats(blocker.get_stats())
+        if cf_bypasser is not None:
+            for phase, duration in cf_bypasser.timings.items():
+                phase_seconds.observe(duration, phase=phase)
 
 # 处理 cookies 请求
 def process_cookies_request(
@@ -257,39 +1105,91 @@ def process_cookies_request(
         retries: int,
         proxy: str,
         user_agent: str,
-        result_obj: RequestResult
+        result_obj: RequestResult,
+        block_policy: BlockPolicy = None
 ):
-    logging.info(f"[{time.time()}] 任务开始执行")
-    no_auth_proxy = None
-    driver = None
+    logging.info("任务开始执行")
+    lease = None
 
     try:
-        driver, no_auth_proxy = bypass_cloudflare(url, retries, True, False, proxy, user_agent)
-        cookies = {cookie.get("name", ""): cookie.get("value", " ") for cookie in driver.cookies()}
-        user_agent_value = driver.user_agent
-        driver.quit()
-        driver = None
-        logging.info(f"[{time.time()}] 成功获取cookies")
+        driver, lease, _ = bypass_cloudflare(url, retries, True, False, proxy, user_agent, result_obj.cancel_token,
+                                             block_policy)
+        with job_phase("cookie_extraction"):
+            cookies_info = driver.cookies(all_info=True)
+            cookies = {cookie.get("name", ""): cookie.get("value", " ") for cookie in cookies_info}
+            user_agent_value = driver.user_agent
+        result_obj.expires_at = clearance_expiry(cookies_info, CLEARANCE_CACHE_DEFAULT_TTL, CLEARANCE_CACHE_MAX_TTL)
+        logging.info("成功获取cookies")
         result_obj.set_result(CookieResponse(cookies=cookies, user_agent=user_agent_value))
     except Exception as e:
-        logging.error(f"[{time.time()}] 获取cookies失败: {str(e)}")
+        logging.error(f"获取cookies失败: {str(e)}")
         result_obj.set_error(str(e))
     finally:
-        if driver:
-            try:
-                driver.quit()
-            except Exception as e:
-                logging.error(f"[{time.time()}] 关闭浏览器失败: {str(e)}")
+        # 浏览器资源由工作线程独占释放，且只释放一次
+        if lease is not None:
+            with job_phase("teardown"):
+                browser_pool.checkin_browser(lease, reusable=not result_obj.cancel_token.cancelled)
+        browser_pool.release_browser()
+
+# 页面在 idle_ms 毫秒内没有新完成的资源请求即视为网络空闲，超时也返回
+NETWORK_IDLE_JS = """
+const idleMs = arguments[0], timeoutMs = arguments[1];
+return new Promise(resolve => {
+    const started = Date.now();
+    let count = performance.getEntriesByType('resource').length, quietSince = Date.now();
+    const timer = setInterval(() => {
+        const current = performance.getEntriesByType('resource').length;
+        if (current !== count || document.readyState !== 'complete') {
+            count = current;
+            quietSince = Date.now();
+        }
+        const now = Date.now();
+        if (now - quietSince >= idleMs || now - started >= timeoutMs) {
+            clearInterval(timer);
+            resolve(now - quietSince >= idleMs);
+        }
+    }, 100);
+});
+"""
+
+# 处理 html 请求：过盾后在同一会话中等待页面就绪并读取页面源码
+def process_html_request(
+        url: str,
+        retries: int,
+        proxy: str,
+        user_agent: str,
+        result_obj: RequestResult,
+        block_policy: BlockPolicy = None,
+        wait_selector: str = None,
+        network_idle: bool = False,
+        wait_timeout: float = 10
+):
+    logging.info("任务开始执行")
+    lease = None
+
+    try:
+        driver, lease, _ = bypass_cloudflare(url, retries, True, False, proxy, user_agent, result_obj.cancel_token,
+                                             block_policy)
+        with job_phase("page_ready"):
+            if wait_selector:
+                if not driver.wait.eles_loaded(f"css:{wait_selector}", timeout=wait_timeout):
+                    logging.warning(f"等待元素超时: {wait_selector}")
+            if network_idle:
+                if not driver.run_js(NETWORK_IDLE_JS, 500, int(wait_timeout * 1000), timeout=wait_timeout + 5):
+                    logging.warning("等待网络空闲超时")
+        result_obj.cancel_token.raise_if_cancelled()
+        with job_phase("html_capture"):
+            result_obj.set_result({"html": driver.html, "url": driver.url, "user_agent": driver.user_agent})
+        logging.info("成功获取html")
+    except Exception as e:
+        logging.error(f"获取html失败: {str(e)}")
+        result_obj.set_error(str(e))
+    finally:
+        # 浏览器资源由工作线程独占释放，且只释放一次
+        if lease is not None:
+            with job_phase("teardown"):
+                browser_pool.checkin_browser(lease, reusable=not result_obj.cancel_token.cancelled)
         browser_pool.release_browser()
-        if no_auth_proxy:
-            try:
-                browser_pool.unregister_proxy(no_auth_proxy)
-                if stop_proxy(no_auth_proxy):
-                    logging.info(f"[{time.time()}] 成功结束本地代理")
-                else:
-                    logging.error(f"[{time.time()}] 结束本地代理失败")
-            except Exception as e:
-                logging.error(f"[{time.time()}] 清理代理资源失败: {str(e)}")
 
 # 处理 turnstile 请求
 def process_turnstile_request(
@@ -297,94 +1197,205 @@ def process_turnstile_request(
         retries: int,
         proxy: str,
         user_agent: str,
-        result_obj: RequestResult
+        result_obj: RequestResult,
+        block_policy: BlockPolicy = None
 ):
-    logging.info(f"[{time.time()}] 任务开始执行")
-    no_auth_proxy = None
-    driver = None
+    logging.info("任务开始执行")
+    lease = None
 
     try:
-        driver, no_auth_proxy = bypass_cloudflare(url, retries, True, True, proxy, user_agent)
-        retry_interval = 2
-        cf_clearance = None
-        retry_count = 0
-        turnstile_token = ""
-        while retry_count < retries:
-            cookies = driver.cookies()
-            for cookie in cookies:
-                if cookie["name"] == "cf_clearance":
-                    cf_clearance = cookie["value"]
-                    break
-            try:
-                turnstile = driver.ele("tag:input@name=cf-turnstile-response")
-                turnstile_token = turnstile.value
-            except Exception as e:
-                logging.error(f"[{time.time()}] 获取turnstile_token时出错: {e}")
-            # 修改：只要有 turnstile_token 就可以（某些网站没有 5秒盾，所以没有 cf_clearance）
-            if turnstile_token:
-                logging.info(f"[{time.time()}] 成功获取到turnstile_token")
-                if cf_clearance:
-                    logging.info(f"[{time.time()}] 同时也获取到cf_clearance")
-                else:
-                    logging.info(f"[{time.time()}] 注意：未获取到cf_clearance（网站可能没有5秒盾）")
-                break
-            retry_count += 1
-            time.sleep(retry_interval)
-            logging.info(f"[{time.time()}] 正在第{retry_count}次尝试获取turnstile_token...")
+        # bypass_turnstile 在页面内监听token写入，拿到token后直接读取cookies，无需再轮询
+        driver, lease, turnstile_token = bypass_cloudflare(url, retries, True, True, proxy, user_agent,
+                                                           result_obj.cancel_token, block_policy)
         if not turnstile_token:
-            logging.error(f"[{time.time()}] 未能获取到turnstile_token")
+            logging.error("未能获取到turnstile_token")
             result_obj.set_error("未能获取到turnstile_token")
             return
-        cookies = {cookie.get("name", ""): cookie.get("value", " ") for cookie in driver.cookies()}
+        with job_phase("cookie_extraction"):
+            cookies = {cookie.get("name", ""): cookie.get("value", " ") for cookie in driver.cookies()}
+            user_agent_value = driver.user_agent
+        if "cf_clearance" in cookies:
+            logging.info("同时也获取到cf_clearance")
+        else:
+            logging.info("注意：未获取到cf_clearance（网站可能没有5秒盾）")
         cookies["turnstile_token"] = turnstile_token
-        user_agent_value = driver.user_agent
-        driver.quit()
-        driver = None
-        logging.info(f"[{time.time()}] 成功获取turnstile cookies")
+        logging.info("成功获取turnstile cookies")
         result_obj.set_result(CookieResponse(cookies=cookies, user_agent=user_agent_value))
     except Exception as e:
-        logging.error(f"[{time.time()}] 获取turnstile cookies失败: {str(e)}")
+        logging.error(f"获取turnstile cookies失败: {str(e)}")
         result_obj.set_error(str(e))
     finally:
-        if driver:
-            try:
-                driver.quit()
-            except Exception as e:
-                logging.error(f"[{time.time()}] 关闭浏览器失败: {str(e)}")
+        # 浏览器资源由工作线程独占释放，且只释放一次
+        if lease is not None:
+            with job_phase("teardown"):
+                browser_pool.checkin_browser(lease, reusable=not result_obj.cancel_token.cancelled)
         browser_pool.release_browser()
-        if no_auth_proxy:
-            try:
-                browser_pool.unregister_proxy(no_auth_proxy)
-                if stop_proxy(no_auth_proxy):
-                    logging.info(f"[{time.time()}] 成功结束本地代理")
-                else:
-                    logging.error(f"[{time.time()}] 结束本地代理失败")
-            except Exception as e:
-                logging.error(f"[{time.time()}] 清理代理资源失败: {str(e)}")
 
-# Cookies 端点（异步优化）
-@app.get("/{password}/cookies", response_model=CookieResponse)
-async def get_cookies(
-        password: str = Depends(verify_password),
-        url: str = None,
-        retries: int = 5,
-        proxy: str = None,
-        user_agent: str = None
-) -> CookieResponse:
-    logging.info(f"[{time.time()}] 收到cookies请求: {url}")
-    if not is_safe_url(url):
-        logging.warning(f"[{time.time()}] 不安全的URL: {url}")
-        raise HTTPException(status_code=400, detail="Invalid URL")
+# 其他进程释放的全局槽位不会触发本进程的释放回调，排队时定期重新尝试分配
+async def poll_shared_slots():
+    while True:
+        await asyncio.sleep(0.5)
+        if admission_queue.depth:
+            admission_queue.notify()
+
+# 启动时预热浏览器池
+@app.on_event("startup")
+async def start_browser_pool():
+    global coordinator_session
+    if NODE_ROLE == "coordinator":
+        # 协调节点不启动浏览器，过盾请求全部转发给工作节点
+        if aiohttp is None:
+            raise RuntimeError("协调节点需要安装 aiohttp")
+        coordinator_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=REQUEST_DEADLINE + JOB_TIMEOUT), auto_decompress=False)
+        logging.info("以协调节点模式运行")
+        return
+    browser_pool.start_warmer()
+    if browser_watchdog:
+        browser_watchdog.start()
+    if refresh_scheduler:
+        refresh_scheduler.start()
+        logging.info(f"启用热门clearance后台刷新, 每小时预算: {REFRESH_BUDGET_PER_HOUR:g} 次")
+    if concurrency_controller:
+        concurrency_controller.start()
+        logging.info(f"启用自适应并发上限: {concurrency_controller.floor}-{concurrency_controller.ceiling}")
+    if shared_slot_table:
+        asyncio.ensure_future(poll_shared_slots())
+    if heartbeat_sender:
+        heartbeat_sender.start()
+        logging.info(f"向协调节点汇报: {COORDINATOR_URL}, 本节点: {NODE_ID}")
 
-    # 在提交任务前尝试获取浏览器资源
-    if not browser_pool.acquire_browser():
-        logging.warning(f"[{time.time()}] 浏览器资源已达上限，拒绝新请求")
-        raise HTTPException(status_code=503, detail="浏览器资源已达上限，无法处理请求")
+@app.on_event("shutdown")
+async def stop_node():
+    if heartbeat_sender:
+        await heartbeat_sender.stop()
+    if coordinator_session:
+        await coordinator_session.close()
+
+# 缓存状态
+@app.get("/{password}/cache")
+async def get_cache_status(password: str = Depends(verify_password)):
+    stats = clearance_cache.get_stats()
+    stats["shared_store"] = clearance_store.get_stats() if clearance_store else None
+    return stats
+
+# 服务运行状态汇总
+@app.get("/{password}/stats")
+async def get_stats(password: str = Depends(verify_password)):
+    return {
+        "pool": browser_pool.get_status(),
+        "cache": clearance_cache.get_stats(),
+        "clearance_store": clearance_store.get_stats() if clearance_store else None,
+        "single_flight": single_flight.get_stats(),
+        "queue": admission_queue.get_stats(),
+        "proxies": get_proxy_stats(),
+        "jobs": job_store.get_stats(),
+        "identities": identity_store.get_stats() if identity_store else None,
+        "shared_slots": shared_slot_table.get_stats() if shared_slot_table else None,
+        "concurrency": concurrency_controller.get_stats() if concurrency_controller else None,
+        "watchdog": browser_watchdog.get_stats() if browser_watchdog else None,
+        "refresh": refresh_scheduler.get_stats() if refresh_scheduler else None,
+        "circuits": circuit_breakers.get_stats() if circuit_breakers else None
+    }
+
+# Prometheus 指标，指标中含有目标站点等信息，与其他状态接口一样需要密码
+@app.get("/{password}/metrics")
+async def get_metrics(password: str = Depends(verify_password)):
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+# 就绪探针：预热完成且浏览器可以正常启动时返回200
+@app.get("/ready")
+async def get_ready():
+    if node_registry is not None:
+        nodes = node_registry.get_stats()["nodes"]
+        if not nodes:
+            raise HTTPException(status_code=503, detail="没有可用的工作节点")
+        return {"nodes": len(nodes)}
+    status = browser_pool.get_status()
+    if not status["ready"]:
+        raise HTTPException(status_code=503, detail="浏览器池尚未就绪")
+    return status
+
+# 浏览器池状态
+@app.get("/{password}/pool", response_model=PoolStatus)
+async def get_pool_status(password: str = Depends(verify_password)) -> PoolStatus:
+    return PoolStatus(**browser_pool.get_status())
+
+# 请求在准入队列中的身份与优先级
+class JobTicket:
+    def __init__(self, client: str, priority: str = "normal", weight: float = 1.0, deadline: float = REQUEST_DEADLINE,
+                 mode: str = "cookies"):
+        self.client = client
+        self.priority = priority
+        self.weight = weight
+        self.deadline = deadline
+        self.expires_at = time.time() + deadline  # 截止时间戳，排队和执行共用同一个截止时间
+        self.mode = mode
+
+def make_ticket(request: Request, client_id: str, priority: str, weight: float, deadline: float,
+                mode: str = "cookies") -> JobTicket:
+    client = client_id or (request.client.host if request.client else "unknown")
+    return JobTicket(client, priority, weight, deadline or REQUEST_DEADLINE, mode)
+
+# 在工作线程中执行任务，并统计正在执行任务的线程数
+def run_in_worker(process_func, *args):
+    global worker_busy
+    with worker_lock:
+        worker_busy += 1
+    try:
+        process_func(*args)
+    finally:
+        with worker_lock:
+            worker_busy -= 1
+
+# 排队获取浏览器资源，提交任务到线程池并等待结果
+async def run_bypass_job(process_func, url: str, retries: int, proxy: str, user_agent: str,
+                         ticket: JobTicket) -> RequestResult:
+    host = urlparse(url).hostname
+    probe = False
+    if circuit_breakers:
+        # 熔断中的目标主机或代理直接失败，不占用排队和浏览器槽位
+        try:
+            probe = circuit_breakers.before_request(host, proxy)
+        except CircuitOpen as e:
+            record_outcome(url, ticket.mode, "circuit_open")
+            raise HTTPException(status_code=503, detail=str(e),
+                                headers={"Retry-After": str(math.ceil(e.retry_after))})
+    queued_at = time.time()
+    # 排队可用的是剩余时间：合并等待、批量限流等已经用掉了一部分截止时间
+    remaining = ticket.expires_at - queued_at
+    if remaining <= 0:
+        if probe:
+            circuit_breakers.cancel_probe(host, proxy)
+        logging.error("排队前已超过截止时间，不再执行任务")
+        record_outcome(url, ticket.mode, "timeout")
+        raise HTTPException(status_code=504, detail="请求超时")
+    try:
+        await admission_queue.admit(ticket.client, ticket.priority, ticket.weight, remaining)
+    except AdmissionRejected as e:
+        if probe:
+            circuit_breakers.cancel_probe(host, proxy)
+        record_outcome(url, ticket.mode, "rejected")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(int(e.retry_after), 1))})
+    phase_seconds.observe(time.time() - queued_at, phase="queue_wait")
+    # 执行时间不超过 JOB_TIMEOUT，也不超过排队后剩余的截止时间
+    timeout = min(JOB_TIMEOUT, ticket.expires_at - time.time())
+    if timeout <= 0:
+        browser_pool.release_browser()
+        if probe:
+            circuit_breakers.cancel_probe(host, proxy)
+        logging.error("排队后已超过截止时间，不再执行任务")
+        record_outcome(url, ticket.mode, "timeout")
+        raise HTTPException(status_code=504, detail="请求超时")
 
     result = RequestResult()
-    logging.info(f"[{time.time()}] 提交任务到线程池")
+    started_at = time.time()
+    logging.info("提交任务到线程池")
+    # 工作线程沿用当前请求的日志上下文（请求ID等）
     future = thread_pool.submit(
-        process_cookies_request,
+        contextvars.copy_context().run,
+        run_in_worker,
+        process_func,
         url,
         retries,
         proxy,
@@ -392,17 +1403,199 @@ async def get_cookies(
         result
     )
     try:
-        await asyncio.wait_for(result.event.wait(), timeout=60)
+        await asyncio.wait_for(result.event.wait(), timeout=timeout)
+        duration = time.time() - started_at
+        admission_queue.record_service_time(duration, ticket.weight)
+        if concurrency_controller and not result.error:
+            concurrency_controller.record_latency(duration, ticket.weight)
         if result.error:
+            record_outcome(url, ticket.mode, "error", duration)
             raise HTTPException(status_code=503, detail=result.error)
-        return result.result
+        record_outcome(url, ticket.mode, "success", duration)
+        return result
     except asyncio.TimeoutError:
-        logging.error(f"[{time.time()}] 请求超时")
+        logging.error("请求超时，取消任务")
+        result.cancel_token.cancel("请求超时", teardown_pool)
+        record_outcome(url, ticket.mode, "timeout", time.time() - started_at)
         raise HTTPException(status_code=504, detail="请求超时")
+    except asyncio.CancelledError:
+        logging.warning("请求被中断，取消任务")
+        result.cancel_token.cancel("请求被中断", teardown_pool)
+        record_outcome(url, ticket.mode, "cancelled")
+        raise
     finally:
-        # 如果任务未完成，释放资源
-        if not result.event.is_set():
+        # 任务还没开始执行时由这里释放资源；一旦开始执行，资源只由工作线程释放
+        if future.cancel():
             browser_pool.release_browser()
+        # 探测请求成功或可归因地失败时熔断器已经关闭或重新打开，其余情况（超时、取消等）归还探测名额
+        if probe:
+            circuit_breakers.cancel_probe(host, proxy)
+
+# 解析资源拦截参数，block 为空时使用默认档位；allow/deny 为逗号分隔的URL通配符
+def make_block_policy(url: str, block: str = None, allow: str = None, deny: str = None) -> BlockPolicy:
+    try:
+        return BlockPolicy(url, block or BLOCK_PROFILE, split_patterns(allow), split_patterns(deny))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"block 只能是 {'、'.join(BLOCK_PROFILES)}")
+
+# 合并键：同一主机、代理、UA和模式的并发请求共用一次过盾
+def single_flight_key(url: str, proxy: str, user_agent: str, mode: str) -> tuple:
+    return urlparse(url).hostname or "", proxy or "", user_agent or "", mode
+
+# 过盾（并发的相同请求合并为一次），结果写入本地缓存和共享存储
+async def solve_cookies(url: str, retries: int, proxy: str, user_agent: str, ticket: JobTicket,
+                        block_policy: BlockPolicy = None) -> CookieResponse:
+    cache_key = clearance_cache.make_key(url, proxy, user_agent)
+
+    async def solve():
+        process_func = partial(process_cookies_request, block_policy=block_policy)
+        result = await run_bypass_job(process_func, url, retries, proxy, user_agent, ticket)
+        if CLEARANCE_CACHE_MAX_ENTRIES > 0 and result.expires_at:
+            clearance_cache.put(cache_key, result.result, result.expires_at)
+        if refresh_scheduler and result.expires_at:
+            refresh_scheduler.set_expiry(cache_key, result.expires_at)
+        if clearance_store and result.expires_at:
+            await asyncio.to_thread(clearance_store.call, "put", cache_key, result.result.model_dump(),
+                                    result.expires_at)
+        return result.result
+
+    return await single_flight.do(single_flight_key(url, proxy, user_agent, "cookies"), solve)
+
+# 查询缓存，未命中时过盾，结果写入缓存
+async def resolve_cookies(url: str, retries: int, proxy: str, user_agent: str, force_refresh: bool,
+                          ticket: JobTicket, block_policy: BlockPolicy = None) -> CookieResponse:
+    cache_key = clearance_cache.make_key(url, proxy, user_agent)
+    if refresh_scheduler:
+        refresh_scheduler.record(cache_key, url, retries=retries, block_policy=block_policy)
+    if force_refresh:
+        clearance_cache.invalidate(cache_key)
+        if clearance_store:
+            await asyncio.to_thread(clearance_store.call, "delete", cache_key)
+    else:
+        if CLEARANCE_CACHE_MAX_ENTRIES > 0:
+            cached = clearance_cache.get(cache_key)
+            if cached is not None:
+                logging.info(f"命中clearance缓存: {cache_key[0]}")
+                record_outcome(url, "cookies", "cache_hit")
+                return cached
+        if clearance_store:
+            # 其他实例已经过盾的结果，取回后放入本地缓存
+            shared = await asyncio.to_thread(clearance_store.call, "get", cache_key)
+            if shared is not None:
+                value, expires_at = shared
+                cached = CookieResponse(**value)
+                if CLEARANCE_CACHE_MAX_ENTRIES > 0:
+                    clearance_cache.put(cache_key, cached, expires_at)
+                if refresh_scheduler:
+                    refresh_scheduler.set_expiry(cache_key, expires_at)
+                logging.info(f"命中共享clearance存储: {cache_key[0]}")
+                record_outcome(url, "cookies", "shared_hit")
+                return cached
+
+    return await solve_cookies(url, retries, proxy, user_agent, ticket, block_policy)
+
+# 后台刷新热门clearance：先看其他实例是否已经刷新过，否则以低优先级重新过盾
+async def refresh_clearance(entry):
+    domain, proxy, user_agent = entry.key
+    if clearance_store:
+        shared = await asyncio.to_thread(clearance_store.call, "get", entry.key)
+        if shared is not None and shared[1] > time.time() + REFRESH_LEAD_TIME:
+            value, expires_at = shared
+            clearance_cache.put(entry.key, CookieResponse(**value), expires_at)
+            refresh_scheduler.set_expiry(entry.key, expires_at)
+            return
+    ticket = JobTicket("refresh", "low", COOKIES_JOB_WEIGHT, REQUEST_DEADLINE, "refresh")
+    await solve_cookies(entry.url, entry.context["retries"], proxy or None, user_agent or None, ticket,
+                        entry.context["block_policy"])
+
+# Cookies 端点（异步优化）
+@app.get("/{password}/cookies", response_model=CookieResponse)
+async def get_cookies(
+        password: str = Depends(verify_password),
+        url: str = None,
+        retries: int = 5,
+        proxy: str = None,
+        user_agent: str = None,
+        force_refresh: bool = False,
+        priority: str = "normal",
+        client_id: str = None,
+        deadline: float = None,
+        block: str = None,
+        allow: str = None,
+        deny: str = None,
+        request: Request = None
+) -> CookieResponse:
+    logging.info(f"收到cookies请求: {url}")
+    if not is_safe_url(url):
+        logging.warning(f"不安全的URL: {url}")
+        raise HTTPException(status_code=400, detail="Invalid URL")
+
+    block_policy = make_block_policy(url, block, allow, deny)
+    ticket = make_ticket(request, client_id, priority, COOKIES_JOB_WEIGHT, deadline)
+    return await resolve_cookies(url, retries, proxy, user_agent, force_refresh, ticket, block_policy)
+
+# 批量获取cookies：同一主机、代理和UA的URL只过一次盾，每完成一项就输出一行NDJSON
+@app.post("/{password}/cookies/batch")
+async def get_cookies_batch(
+        batch: BatchRequest,
+        password: str = Depends(verify_password),
+        request: Request = None
+) -> StreamingResponse:
+    logging.info(f"收到批量cookies请求: {len(batch.items)} 个URL")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"批量请求最多 {BATCH_MAX_ITEMS} 个URL")
+
+    make_block_policy("", batch.block, batch.allow, batch.deny)  # 提前校验拦截参数
+    groups = {}
+    invalid = []
+    for index, item in enumerate(batch.items):
+        if not is_safe_url(item.url):
+            invalid.append(index)
+            continue
+        # 与clearance缓存同一个键：同一可注册域名、代理和UA的clearance通用
+        key = clearance_cache.make_key(item.url, item.proxy, item.user_agent)
+        groups.setdefault(key, []).append(index)
+    logging.info(f"批量请求去重后共 {len(groups)} 个过盾任务")
+
+    # 同时进行的任务数与浏览器池容量一致，既能占满浏览器，又不会把准入队列挤满
+    limiter = asyncio.Semaphore(max(browser_pool.max_jobs, 1))
+
+    async def solve_group(indexes: list) -> tuple:
+        item = batch.items[indexes[0]]
+        async with limiter:
+            try:
+                # 截止时间从该项开始排队时算起，不与整个批量共用，否则排在后面的项全部超时
+                ticket = make_ticket(request, batch.client_id, batch.priority, COOKIES_JOB_WEIGHT, batch.deadline)
+                block_policy = make_block_policy(item.url, batch.block, batch.allow, batch.deny)
+                result = await resolve_cookies(item.url, batch.retries, item.proxy, item.user_agent,
+                                               batch.force_refresh, ticket, block_policy)
+                return indexes, {"status": "ok", "cookies": result.cookies, "user_agent": result.user_agent}
+            except HTTPException as e:
+                return indexes, {"status": "error", "status_code": e.status_code, "error": e.detail}
+            except Exception as e:
+                return indexes, {"status": "error", "status_code": 500, "error": str(e)}
+
+    def lines(indexes: list, outcome: dict):
+        for index in indexes:
+            entry = {"index": index, "url": batch.items[index].url}
+            entry.update(outcome)
+            yield json.dumps(entry, ensure_ascii=False) + "\n"
+
+    async def stream():
+        for line in lines(invalid, {"status": "error", "status_code": 400, "error": "Invalid URL"}):
+            yield line
+        tasks = [asyncio.ensure_future(solve_group(indexes)) for indexes in groups.values()]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                indexes, outcome = await finished
+                for line in lines(indexes, outcome):
+                    yield line
+        finally:
+            # 客户端提前断开时取消尚未完成的任务
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 # Turnstile 端点（异步优化）
 @app.get("/{password}/turnstile", response_model=CookieResponse)
@@ -411,71 +1604,206 @@ async def get_turnstile_cookies(
         url: str = None,
         retries: int = 5,
         proxy: str = None,
-        user_agent: str = None
+        user_agent: str = None,
+        priority: str = "normal",
+        client_id: str = None,
+        deadline: float = None,
+        block: str = None,
+        allow: str = None,
+        deny: str = None,
+        request: Request = None
 ) -> CookieResponse:
-    logging.info(f"[{time.time()}] 收到turnstile请求: {url}")
+    logging.info(f"收到turnstile请求: {url}")
     if not is_safe_url(url):
-        logging.warning(f"[{time.time()}] 不安全的URL: {url}")
+        logging.warning(f"不安全的URL: {url}")
         raise HTTPException(status_code=400, detail="Invalid URL")
 
-    # 在提交任务前尝试获取浏览器资源
-    if not browser_pool.acquire_browser():
-        logging.warning(f"[{time.time()}] 浏览器资源已达上限，拒绝新请求")
-        raise HTTPException(status_code=503, detail="浏览器资源已达上限，无法处理请求")
+    # turnstile_token 只能使用一次，不能把同一个结果分给多个请求，因此不做合并
+    block_policy = make_block_policy(url, block, allow, deny)
+    ticket = make_ticket(request, client_id, priority, TURNSTILE_JOB_WEIGHT, deadline, "turnstile")
+    process_func = partial(process_turnstile_request, block_policy=block_policy)
+    result = await run_bypass_job(process_func, url, retries, proxy, user_agent, ticket)
+    return result.result
+
+# HTML 端点：返回过盾后的页面源码，按 Accept-Encoding 分块压缩并流式输出
+@app.get("/{password}/html")
+async def get_html(
+        password: str = Depends(verify_password),
+        url: str = None,
+        retries: int = 5,
+        proxy: str = None,
+        user_agent: str = None,
+        wait_selector: str = None,
+        network_idle: bool = False,
+        wait_timeout: float = 10,
+        priority: str = "normal",
+        client_id: str = None,
+        deadline: float = None,
+        block: str = None,
+        allow: str = None,
+        deny: str = None,
+        request: Request = None
+) -> StreamingResponse:
+    logging.info(f"收到html请求: {url}")
+    if not is_safe_url(url):
+        logging.warning(f"不安全的URL: {url}")
+        raise HTTPException(status_code=400, detail="Invalid URL")
+
+    wait_timeout = min(max(wait_timeout, 0), JOB_TIMEOUT / 2)
+    block_policy = make_block_policy(url, block, allow, deny)
+    ticket = make_ticket(request, client_id, priority, HTML_JOB_WEIGHT, deadline, "html")
+    process_func = partial(process_html_request, block_policy=block_policy, wait_selector=wait_selector,
+                           network_idle=network_idle, wait_timeout=wait_timeout)
+    result = await run_bypass_job(process_func, url, retries, proxy, user_agent, ticket)
+    page = result.result
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    headers = {"X-Final-URL": page["url"], "X-User-Agent": page["user_agent"], "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(iter_encoded(page["html"], encoding), media_type="text/html; charset=utf-8",
+                             headers=headers)
+
+# 提交异步任务，立即返回任务ID，不占用HTTP连接等待过盾
+@app.post("/{password}/jobs", status_code=202)
+async def submit_job(
+        job: JobSubmit,
+        password: str = Depends(verify_password),
+        request: Request = None
+):
+    logging.info(f"收到异步任务: {job.mode}, {job.url}")
+    if job.mode not in ("cookies", "turnstile"):
+        raise HTTPException(status_code=400, detail="mode 只能是 cookies 或 turnstile")
+    if not is_safe_url(job.url):
+        logging.warning(f"不安全的URL: {job.url}")
+        raise HTTPException(status_code=400, detail="Invalid URL")
+
+    block_policy = make_block_policy(job.url, job.block, job.allow, job.deny)
+    if job.mode == "cookies":
+        ticket = make_ticket(request, job.client_id, job.priority, COOKIES_JOB_WEIGHT, job.deadline)
+
+        async def runner():
+            return await resolve_cookies(job.url, job.retries, job.proxy, job.user_agent, job.force_refresh, ticket,
+                                         block_policy)
+    else:
+        ticket = make_ticket(request, job.client_id, job.priority, TURNSTILE_JOB_WEIGHT, job.deadline, "turnstile")
+
+        async def runner():
+            process_func = partial(process_turnstile_request, block_policy=block_policy)
+            result = await run_bypass_job(process_func, job.url, job.retries, job.proxy, job.user_agent, ticket)
+            return result.result
 
-    result = RequestResult()
-    logging.info(f"[{time.time()}] 提交任务到线程池")
-    future = thread_pool.submit(
-        process_turnstile_request,
-        url,
-        retries,
-        proxy,
-        user_agent,
-        result
-    )
     try:
-        await asyncio.wait_for(result.event.wait(), timeout=60)
-        if result.error:
-            raise HTTPException(status_code=503, detail=result.error)
-        return result.result
-    except asyncio.TimeoutError:
-        logging.error(f"[{time.time()}] 请求超时")
-        raise HTTPException(status_code=504, detail="请求超时")
-    finally:
-        # 如果任务未完成，释放资源
-        if not result.event.is_set():
-            browser_pool.release_browser()
+        submitted = job_store.submit(job.mode, job.url, runner)
+    except JobFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return {"job_id": submitted.id, "status": submitted.status}
+
+def get_job_or_404(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+# 查询异步任务；wait 大于 0 时长轮询，最多等待 wait 秒直到任务完成
+@app.get("/{password}/jobs/{job_id}")
+async def get_job(job_id: str, password: str = Depends(verify_password), wait: float = 0):
+    job = get_job_or_404(job_id)
+    if wait > 0 and not job.finished:
+        await job.wait_finished(min(wait, REQUEST_DEADLINE))
+    return job.to_dict()
+
+# 以 Server-Sent Events 推送异步任务的进度，任务结束后推送结果并关闭
+@app.get("/{password}/jobs/{job_id}/events")
+async def get_job_events(job_id: str, password: str = Depends(verify_password)):
+    job = get_job_or_404(job_id)
+
+    async def stream():
+        sent = 0
+        while True:
+            while sent < len(job.events):
+                event = job.events[sent]
+                sent += 1
+                yield f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if job.finished:
+                yield f"event: result\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                return
+            if not await job.wait_for_update(sent, 15):
+                # 保持连接，防止代理或负载均衡因空闲断开
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def get_registry_or_404():
+    if node_registry is None:
+        raise HTTPException(status_code=404, detail="未以协调节点模式运行")
+    return node_registry
+
+# 工作节点心跳：首次心跳即加入路由
+@app.post("/{password}/nodes/heartbeat")
+async def node_heartbeat(heartbeat: NodeHeartbeat, password: str = Depends(verify_password)):
+    node = get_registry_or_404().heartbeat(heartbeat.node_id, heartbeat.url, heartbeat.max_jobs,
+                                           heartbeat.free_slots, heartbeat.queue_depth)
+    return node.to_dict()
+
+# 工作节点下线
+@app.delete("/{password}/nodes/{node_id:path}")
+async def node_leave(node_id: str, password: str = Depends(verify_password)):
+    get_registry_or_404().remove(node_id)
+    return {"node_id": node_id}
+
+# 工作节点列表与路由统计
+@app.get("/{password}/nodes")
+async def get_nodes(password: str = Depends(verify_password)):
+    return get_registry_or_404().get_stats()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Cloudflare bypass API")
     parser.add_argument("--nolog", action="store_true", help="禁用日志")
     parser.add_argument("--headless", action="store_true", help="以无头模式运行")
     parser.add_argument("--max-browsers", type=int, default=MAX_BROWSERS, help="最大并发浏览器数量")
-    parser.add_argument("--max-workers", type=int, default=MAX_BROWSERS, help="最大工作线程数量")
+    parser.add_argument("--tabs-per-browser", type=int, default=TABS_PER_BROWSER, help="每个浏览器的并发标签页数量")
+    parser.add_argument("--max-workers", type=int, default=None, help="最大工作线程数量，默认为浏览器数量×标签页数量")
+    parser.add_argument("--processes", type=int, default=SERVER_PROCESSES, help="API进程数，各进程共享全局任务槽位")
     args = parser.parse_args()
 
-    browser_pool.max_browsers = args.max_browsers
+    browser_pool.configure(args.max_browsers, args.tabs_per_browser)
+    if args.max_workers is None:
+        args.max_workers = max_job_capacity()
     thread_pool.shutdown(wait=True)
     thread_pool = ThreadPoolExecutor(max_workers=args.max_workers)
 
     display = None
     if args.headless:
-        logging.info(f"[{time.time()}] 启用无头模式")
+        logging.info("启用无头模式")
         display = Display(visible=0, size=(1920, 1080))
         display.start()
 
         def cleanup_display():
             if display:
-                logging.info(f"[{time.time()}] 清理Display资源")
+                logging.info("清理Display资源")
                 display.stop()
 
         atexit.register(cleanup_display)
 
     log = not args.nolog
     if args.nolog:
-        logging.info(f"[{time.time()}] 禁用日志")
+        logging.info("禁用日志")
 
     logging.info(
-        f"[{time.time()}] 启动服务器，端口: {SERVER_PORT}, 最大并发浏览器数: {browser_pool.max_browsers}, 最大工作线程数: {args.max_workers}"
+        f"启动服务器，端口: {SERVER_PORT}, 最大并发浏览器数: {browser_pool.max_browsers}, 每个浏览器标签页数: {browser_pool.tabs_per_browser}, 最大工作线程数: {args.max_workers}"
     )
-    uvicorn.run(app, host="0.0.0.0", port=SERVER_PORT)
+    if args.processes <= 1:
+        uvicorn.run(app, host="0.0.0.0", port=SERVER_PORT)
+    else:
+        # 子进程重新导入本模块，配置通过环境变量传递
+        os.environ["MAX_BROWSERS"] = str(args.max_browsers)
+        os.environ["TABS_PER_BROWSER"] = str(args.tabs_per_browser)
+        os.environ["SHARED_SLOTS_PATH"] = SHARED_SLOTS_PATH or os.path.join(
+            "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), f"cf_bypass_slots_{SERVER_PORT}")
+        if args.max_workers != max_job_capacity():
+            logging.warning("多进程模式下 --max-workers 不生效，每个进程使用浏览器数量×标签页数量个工作线程")
+        # 主进程不执行任务，启动前清理上次运行遗留的浏览器和代理进程
+        SharedSlotTable(os.environ["SHARED_SLOTS_PATH"], max_job_capacity()).reap()
+        logging.info(f"以多进程模式运行, 进程数: {args.processes}, 共享槽位表: {os.environ['SHARED_SLOTS_PATH']}")
+        uvicorn.run("server:app", host="0.0.0.0", port=SERVER_PORT, workers=args.processes)
@@ -0,0 +1,293 @@
+import mmap
+import os
+import signal
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # 多进程模式只支持 POSIX 系统
+    fcntl = None
+
+import psutil
+
+from utils import logging
+
+MAGIC = b"CFSL"
+HEADER = struct.Struct("<4sII")  # 魔数, 槽位数, 进程表容量
+SLOT = struct.Struct("<id")  # 占用进程PID, 占用时间
+PROCESS = struct.Struct("<iid8s")  # 所属进程PID, 子进程PID, 子进程启动时间, 类型
+
+
+def _alive(pid: int) -> bool:
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
+
+
+def _create_time(pid: int) -> float:
+    try:
+        return psutil.Process(pid).create_time()
+    except psutil.Error:
+        return 0.0
+
+
+class SharedSlotTable:
+    """
+    同一台机器上多个服务进程共享的任务槽位表和子进程登记表，保存在内存映射文件中，用文件锁互斥。
+    - 槽位总数即全局并发任务上限，每个进程获取槽位前不再只看自己的配额
+    - 浏览器和 mitmdump 进程登记在所属服务进程名下，服务进程异常退出后由其他进程清理
+    """
+
+    def __init__(self, path: str, slots: int, max_processes: int = 256):
+        if fcntl is None:
+            raise RuntimeError("多进程模式需要 POSIX 系统")
+        self.path = path
+        self.slots = slots
+        self.max_processes = max_processes
+        self.size = HEADER.size + SLOT.size * slots + PROCESS.size * max_processes
+        self.pid = os.getpid()
+        self.lock = threading.Lock()  # flock 只在进程之间互斥，同一进程的线程还需要线程锁
+        self.reaped_slots = 0
+        self.reaped_processes = 0
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked(init=True):
+            pass
+
+    @contextmanager
+    def _locked(self, init: bool = False):
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                if init:
+                    self._ensure_layout()
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _ensure_layout(self):
+        """文件不存在或布局与配置不一致时重新初始化；重建前先清理旧表中已失去所属进程的子进程"""
+        if os.fstat(self.fd).st_size >= HEADER.size:
+            with mmap.mmap(self.fd, HEADER.size) as header:
+                magic, slots, max_processes = HEADER.unpack_from(header, 0)
+            if magic == MAGIC and slots == self.slots and max_processes == self.max_processes:
+                self.map = mmap.mmap(self.fd, self.size)
+                return
+            if magic == MAGIC:
+                old_size = HEADER.size + SLOT.size * slots + PROCESS.size * max_processes
+                if os.fstat(self.fd).st_size >= old_size:
+                    with mmap.mmap(self.fd, old_size) as old:
+                        self._reap_processes(old, HEADER.size + SLOT.size * slots, max_processes)
+        os.ftruncate(self.fd, 0)
+        os.ftruncate(self.fd, self.size)
+        self.map = mmap.mmap(self.fd, self.size)
+        HEADER.pack_into(self.map, 0, MAGIC, self.slots, self.max_processes)
+        logging.info(f"初始化共享槽位表: {self.path}, 槽位数: {self.slots}")
+
+    def _slot_offset(self, index: int) -> int:
+        return HEADER.size + SLOT.size * index
+
+    def _process_offset(self, index: int) -> int:
+        return HEADER.size + SLOT.size * self.slots + PROCESS.size * index
+
+    def try_acquire(self) -> bool:
+        """非阻塞地占用一个全局槽位；占用者已退出的槽位会被回收再分配"""
+        with self._locked():
+            free = None
+            for index in range(self.slots):
+                owner, _ = SLOT.unpack_from(self.map, self._slot_offset(index))
+                if owner == 0 or (owner != self.pid and not _alive(owner)):
+                    if owner:
+                        self.reaped_slots += 1
+                        logging.warning(f"回收已退出进程 {owner} 占用的槽位")
+                    free = index
+                    break
+            if free is None:
+                return False
+            SLOT.pack_into(self.map, self._slot_offset(free), self.pid, time.time())
+            return True
+
+    def release(self):
+        with self._locked():
+            for index in range(self.slots):
+                owner, _ = SLOT.unpack_from(self.map, self._slot_offset(index))
+                if owner == self.pid:
+                    SLOT.pack_into(self.map, self._slot_offset(index), 0, 0.0)
+                    return
+        logging.warning("尝试释放不属于本进程的共享槽位")
+
+    def release_owned(self):
+        """进程退出前释放自己占用的所有槽位"""
+        with self._locked():
+            for index in range(self.slots):
+                owner, _ = SLOT.unpack_from(self.map, self._slot_offset(index))
+                if owner == self.pid:
+                    SLOT.pack_into(self.map, self._slot_offset(index), 0, 0.0)
+
+    def reserve_process(self, kind: str, limit: int = None) -> bool:
+        """
+        为即将启动的子进程预留一个登记项（子进程PID为0），启动后由 track_process 填入。
+        Args:
+            kind: 子进程类型
+            limit: 所有服务进程中该类型的登记项（含预留）总数上限，达到上限时不预留
+        Returns:
+            bool: 是否预留成功；启动失败时需调用 cancel_reservation 归还
+        """
+        name = kind.encode("ascii")[:8]
+        with self._locked():
+            free = None
+            count = 0
+            for index in range(self.max_processes):
+                owner, _, _, entry_kind = PROCESS.unpack_from(self.map, self._process_offset(index))
+                if owner == 0:
+                    if free is None:
+                        free = index
+                elif entry_kind.rstrip(b"\0") == name and (owner == self.pid or _alive(owner)):
+                    count += 1
+            if free is None or (limit is not None and count >= limit):
+                return False
+            PROCESS.pack_into(self.map, self._process_offset(free), self.pid, 0, 0.0, name)
+            return True
+
+    def cancel_reservation(self, kind: str):
+        """归还本进程一个尚未填入子进程的预留项"""
+        name = kind.encode("ascii")[:8]
+        with self._locked():
+            for index in range(self.max_processes):
+                owner, child, _, entry_kind = PROCESS.unpack_from(self.map, self._process_offset(index))
+                if owner == self.pid and child == 0 and entry_kind.rstrip(b"\0") == name:
+                    PROCESS.pack_into(self.map, self._process_offset(index), 0, 0, 0.0, b"")
+                    return
+
+    def count_processes(self, kind: str, others_only: bool = False) -> int:
+        """所有（或除本进程外的）存活服务进程登记的该类型子进程数，含预留项"""
+        name = kind.encode("ascii")[:8]
+        with self._locked():
+            count = 0
+            for index in range(self.max_processes):
+                owner, _, _, entry_kind = PROCESS.unpack_from(self.map, self._process_offset(index))
+                if owner == 0 or entry_kind.rstrip(b"\0") != name:
+                    continue
+                if owner == self.pid:
+                    count += not others_only
+                elif _alive(owner):
+                    count += 1
+            return count
+
+    def track_process(self, pid: int, kind: str):
+        """登记本进程启动的浏览器或代理进程，优先填入本进程为其预留的登记项"""
+        name = kind.encode("ascii")[:8]
+        with self._locked():
+            for index in range(self.max_processes):
+                owner, child, _, entry_kind = PROCESS.unpack_from(self.map, self._process_offset(index))
+                if owner == self.pid and child == 0 and entry_kind.rstrip(b"\0") == name:
+                    PROCESS.pack_into(self.map, self._process_offset(index), self.pid, pid, _create_time(pid), name)
+                    return
+            for index in range(self.max_processes):
+                owner, _, _, _ = PROCESS.unpack_from(self.map, self._process_offset(index))
+                if owner == 0:
+                    PROCESS.pack_into(self.map, self._process_offset(index), self.pid, pid, _create_time(pid),
+                                      kind.encode("ascii")[:8])
+                    return
+        logging.warning(f"子进程登记表已满，无法登记 {kind} 进程 {pid}")
+
+    def untrack_process(self, pid: int):
+        with self._locked():
+            for index in range(self.max_processes):
+                owner, child, _, _ = PROCESS.unpack_from(self.map, self._process_offset(index))
+                if owner == self.pid and child == pid:
+                    PROCESS.pack_into(self.map, self._process_offset(index), 0, 0, 0.0, b"")
+                    return
+
+    def _reap_processes(self, buffer, base: int, count: int) -> int:
+        """结束所属服务进程已退出的子进程，按启动时间核对，避免误杀复用了PID的进程"""
+        killed = 0
+        for index in range(count):
+            offset = base + PROCESS.size * index
+            owner, child, created_at, kind = PROCESS.unpack_from(buffer, offset)
+            if owner == 0 or owner == self.pid or _alive(owner):
+                continue
+            kind = kind.rstrip(b"\0").decode("ascii", "replace")
+            if child and _alive(child) and abs(_create_time(child) - created_at) < 1:
+                try:
+                    process = psutil.Process(child)
+                    for sub in process.children(recursive=True):
+                        sub.kill()
+                    process.send_signal(signal.SIGKILL)
+                    killed += 1
+                    logging.warning(f"清理孤儿{kind}进程: {child}（所属进程 {owner} 已退出）")
+                except psutil.Error as e:
+                    logging.error(f"清理孤儿{kind}进程失败: {child}, {e}")
+            PROCESS.pack_into(buffer, offset, 0, 0, 0.0, b"")
+        return killed
+
+    def reap(self):
+        """回收已退出进程占用的槽位，结束它们遗留的浏览器和代理进程"""
+        with self._locked():
+            for index in range(self.slots):
+                owner, _ = SLOT.unpack_from(self.map, self._slot_offset(index))
+                if owner and owner != self.pid and not _alive(owner):
+                    SLOT.pack_into(self.map, self._slot_offset(index), 0, 0.0)
+                    self.reaped_slots += 1
+                    logging.warning(f"回收已退出进程 {owner} 占用的槽位")
+            self.reaped_processes += self._reap_processes(self.map, self._process_offset(0), self.max_processes)
+
+    def get_stats(self):
+        with self._locked():
+            owners = {}
+            for index in range(self.slots):
+                owner, _ = SLOT.unpack_from(self.map, self._slot_offset(index))
+                if owner:
+                    owners[owner] = owners.get(owner, 0) + 1
+            entries = [PROCESS.unpack_from(self.map, self._process_offset(index))
+                       for index in range(self.max_processes)]
+        tracked = sum(1 for owner, child, _, _ in entries if owner and child)
+        browsers = sum(1 for owner, _, _, kind in entries if owner and kind.rstrip(b"\0") == b"chrome")
+        return {
+            "path": self.path,
+            "slots": self.slots,
+            "in_use": sum(owners.values()),
+            "in_use_by_pid": owners,
+            "tracked_processes": tracked,
+            "browsers": browsers,
+            "reaped_slots": self.reaped_slots,
+            "reaped_processes": self.reaped_processes
+        }
+
+
+# 当前进程使用的槽位表，单进程模式下为 None
+_table = None
+# 本进程登记的子进程 PID -> 类型，单进程模式下也维护，供看门狗识别不再被跟踪的孤儿进程
+_tracked = {}
+_tracked_lock = threading.Lock()
+
+
+def attach(table: SharedSlotTable):
+    global _table
+    _table = table
+
+
+def track_process(pid: int, kind: str):
+    if not pid:
+        return
+    with _tracked_lock:
+        _tracked[pid] = kind
+    if _table is not None:
+        _table.track_process(pid, kind)
+
+
+def untrack_process(pid: int):
+    if not pid:
+        return
+    with _tracked_lock:
+        _tracked.pop(pid, None)
+    if _table is not None:
+        _table.untrack_process(pid)
+
+
+def tracked_processes() -> dict:
+    with _tracked_lock:
+        return dict(_tracked)
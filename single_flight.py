@@ -0,0 +1,60 @@
+import asyncio
+
+from utils import logging
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同键的并发任务：同一时刻每个键只执行一个底层任务，
+    其余请求等待该任务并获得相同的结果（或异常）。
+    底层任务独立于发起它的请求运行，发起者断开连接不会影响其他等待者。
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """
+        Args:
+            key: 合并键
+            func: 无参数、返回协程的可调用对象，只在没有进行中的同键任务时调用
+        Returns:
+            底层任务的结果
+        """
+        call = self.calls.get(key)
+        if call is not None:
+            self.coalesced += 1
+            logging.info(f"合并到进行中的任务: {key[0]}, 等待者数: {call.waiters}")
+        else:
+            self.leaders += 1
+            call = _Call(asyncio.ensure_future(func()))
+            self.calls[key] = call
+            call.task.add_done_callback(lambda t: self._finish(key, call))
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+
+    def _finish(self, key, call: _Call):
+        task = call.task
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        # 即使所有等待者都已离开，也要取走异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self):
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# 测试中不写入仓库目录下的日志文件，也不需要真实的浏览器
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "cloudflare_bypass_test.log"))
+os.environ.setdefault("CHROME_PATH", "/bin/true")
@@ -0,0 +1,109 @@
+import pytest
+
+import adaptive_concurrency
+from adaptive_concurrency import AdaptiveConcurrency
+
+GB = 1024 ** 3
+
+
+class Host:
+    """可控的 CPU 和内存读数"""
+
+    def __init__(self):
+        self.cpu = 10.0
+        self.available = 8 * GB
+
+    def cpu_percent(self, interval=None):
+        return self.cpu
+
+    def virtual_memory(self):
+        return type("Memory", (), {"available": self.available})()
+
+
+@pytest.fixture
+def host(monkeypatch):
+    host = Host()
+    monkeypatch.setattr(adaptive_concurrency.psutil, "cpu_percent", host.cpu_percent)
+    monkeypatch.setattr(adaptive_concurrency.psutil, "virtual_memory", host.virtual_memory)
+    return host
+
+
+class Limit:
+    def __init__(self, value: int, saturated: bool = True):
+        self.value = value
+        self.is_saturated = saturated
+
+    def controller(self, **kwargs) -> AdaptiveConcurrency:
+        options = dict(floor=1, ceiling=8, cpu_high=85, min_free_bytes=GB)
+        options.update(kwargs)
+        return AdaptiveConcurrency(lambda: self.value, self.set, lambda: self.is_saturated, **options)
+
+    def set(self, value: int):
+        self.value = value
+
+
+def test_increases_when_saturated_without_pressure(host):
+    limit = Limit(2)
+    controller = limit.controller()
+    assert controller.step() == 3
+    assert controller.step() == 4
+    assert controller.increases == 2
+
+
+def test_holds_when_not_saturated(host):
+    limit = Limit(2, saturated=False)
+    assert limit.controller().step() == 2
+
+
+def test_increase_stops_at_ceiling(host):
+    limit = Limit(8)
+    assert limit.controller().step() == 8
+
+
+def test_decreases_on_cpu_pressure(host):
+    host.cpu = 95
+    limit = Limit(8)
+    controller = limit.controller()
+    assert controller.step() == 6
+    assert controller.step() == 4
+    assert controller.decreases == 2
+
+
+def test_decreases_on_low_memory_but_not_below_floor(host):
+    host.available = GB // 2
+    limit = Limit(2)
+    controller = limit.controller(floor=2)
+    assert controller.step() == 2
+    assert controller.decreases == 0
+
+
+def test_high_cpu_below_threshold_blocks_increase(host):
+    # 超过阈值的 80% 时不再增加，但还不算压力
+    host.cpu = 75
+    limit = Limit(4)
+    assert limit.controller().step() == 4
+
+
+def test_decreases_when_latency_exceeds_baseline(host):
+    limit = Limit(4, saturated=False)
+    controller = limit.controller(latency_tolerance=2.0)
+    controller.record_latency(10)
+    assert controller.step() == 4
+    for _ in range(5):
+        controller.record_latency(100)
+    assert controller.step() == 3
+    assert controller.last_sample["latency_ratio"] > 2
+
+
+def test_latency_is_normalised_by_weight(host):
+    limit = Limit(4, saturated=False)
+    controller = limit.controller()
+    controller.record_latency(10, weight=1)
+    controller.record_latency(30, weight=3)
+    assert controller.latency == pytest.approx(10)
+    assert controller.step() == 4
+
+
+def test_limit_out_of_range_is_clamped(host):
+    limit = Limit(20, saturated=False)
+    assert limit.controller().step() == 8
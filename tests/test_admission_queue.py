@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from admission_queue import AdmissionQueue, AdmissionRejected
+
+
+class Slots:
+    def __init__(self, count: int):
+        self.free = count
+
+    def try_acquire(self) -> bool:
+        if self.free <= 0:
+            return False
+        self.free -= 1
+        return True
+
+    def release(self):
+        self.free += 1
+
+
+def make_queue(slots: Slots, **kwargs) -> AdmissionQueue:
+    queue = AdmissionQueue(slots.try_acquire, slots.release, capacity=lambda: 1, **kwargs)
+    queue.service_time_per_weight = 0.01
+    return queue
+
+
+async def finish_one(queue: AdmissionQueue, slots: Slots):
+    slots.release()
+    queue.notify()
+    await asyncio.sleep(0.01)
+
+
+def test_admits_immediately_when_free():
+    slots = Slots(1)
+    queue = make_queue(slots)
+    assert asyncio.run(queue.admit("a")) == 0.0
+    assert slots.free == 0
+    assert queue.get_stats()["admitted"] == 1
+
+
+def test_rejects_when_full():
+    async def main():
+        slots = Slots(0)
+        queue = make_queue(slots, max_depth=1)
+        waiter = asyncio.ensure_future(queue.admit("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await queue.admit("b")
+        waiter.cancel()
+        return queue
+
+    queue = asyncio.run(main())
+    assert queue.rejected_full == 1
+    assert queue.depth == 0
+
+
+def test_rejects_when_deadline_cannot_be_met():
+    slots = Slots(0)
+    queue = make_queue(slots)
+    queue.service_time_per_weight = 30
+    with pytest.raises(AdmissionRejected) as e:
+        asyncio.run(queue.admit("a", deadline=10))
+    assert "截止时间" in str(e.value)
+    assert queue.rejected_deadline == 1
+
+
+def test_expires_in_queue():
+    slots = Slots(0)
+    queue = make_queue(slots)
+    with pytest.raises(AdmissionRejected):
+        asyncio.run(queue.admit("a", deadline=0.1))
+    assert queue.expired == 1
+    assert queue.depth == 0
+
+
+def test_priority_and_fair_order():
+    async def main():
+        slots = Slots(0)
+        queue = make_queue(slots)
+        order = []
+
+        async def admit(client, priority="normal"):
+            await queue.admit(client, priority)
+            order.append(f"{client}/{priority}")
+
+        # 客户端 a 先排入三个请求，b 后排入一个；同一优先级内 b 不必等 a 的全部请求
+        tasks = [asyncio.ensure_future(admit("a")) for _ in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(admit("b")))
+        tasks.append(asyncio.ensure_future(admit("c", "low")))
+        tasks.append(asyncio.ensure_future(admit("d", "high")))
+        await asyncio.sleep(0)
+        for _ in tasks:
+            await finish_one(queue, slots)
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(main())
+    assert order[0] == "d/high"
+    assert order[-1] == "c/low"
+    assert order.index("b/normal") < 3
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def main():
+        slots = Slots(0)
+        queue = make_queue(slots)
+        cancelled = asyncio.ensure_future(queue.admit("a"))
+        waiting = asyncio.ensure_future(queue.admit("b"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert queue.depth == 1
+        # 释放的资源分配给仍在排队的请求
+        await finish_one(queue, slots)
+        await waiting
+        return slots, queue
+
+    slots, queue = asyncio.run(main())
+    assert slots.free == 0
+    assert queue.depth == 0
+    assert queue.admitted == 1
+
+
+def test_estimate_wait_uses_pending_weight():
+    async def main():
+        slots = Slots(0)
+        queue = make_queue(slots)
+        queue.service_time_per_weight = 1
+        tasks = [asyncio.ensure_future(queue.admit("a", weight=2)) for _ in range(2)]
+        await asyncio.sleep(0)
+        estimate = queue.estimate_wait("normal"), queue.estimate_wait("high")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return estimate
+
+    assert asyncio.run(main()) == (4.0, 0.0)
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+import pytest
+
+import server
+from server import BrowserPoolManager, PooledBrowser
+from shared_slots import SharedSlotTable
+from utils import CancellationToken, BypassCancelled
+
+
+class FakeBrowser(PooledBrowser):
+    """不启动 Chrome 的池中浏览器"""
+
+    def __init__(self, key):
+        self.key = key
+        self.page = None
+        self.browser = None
+        self.local_proxy = None
+        self.process_id = None
+        self.identity = None
+        self.leases = set()
+        self.uses = 0
+        self.retiring = False
+        self.retired = False
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.cdp_lock = threading.Lock()
+        self.quit_called = False
+
+    def is_healthy(self):
+        return not self.retired
+
+    def open_tab(self):
+        return object()
+
+    def close_tab(self, lease, clear_all=False):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+def make_pool(monkeypatch, table: SharedSlotTable = None):
+    pool = BrowserPoolManager(max_browsers=1, min_warm=0, tabs_per_browser=2)
+    pool.launched = []
+
+    def launch_browser(proxy=None, user_agent=None):
+        browser = FakeBrowser((proxy, user_agent or server.DEFAULT_USER_AGENT))
+        if table is not None:
+            browser.process_id = os.getpid()
+            table.track_process(browser.process_id, "chrome")
+        pool.launched.append(browser)
+        return browser
+
+    monkeypatch.setattr(pool, "launch_browser", launch_browser)
+    return pool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    return make_pool(monkeypatch)
+
+
+def test_shares_browser_between_different_sites(pool):
+    first = pool.checkout_browser(domain="example.com")
+    second = pool.checkout_browser(domain="example.org")
+    assert first.pooled is second.pooled
+    assert len(pool.launched) == 1
+
+
+def test_waits_instead_of_launching_past_limit(pool):
+    first = pool.checkout_browser(domain="example.com")
+    result = {}
+
+    def checkout():
+        # 同一可注册域名的不同子域名不能共享浏览器
+        result["lease"] = pool.checkout_browser(domain=server.registrable_domain("https://www.example.com/"))
+
+    thread = threading.Thread(target=checkout)
+    thread.start()
+    time.sleep(0.2)
+    assert thread.is_alive()
+    assert len(pool.launched) == 1
+
+    pool.checkin_browser(first)
+    thread.join(2)
+    assert not thread.is_alive()
+    assert result["lease"].pooled is first.pooled
+    assert len(pool.launched) == 1
+
+
+def test_waits_for_browser_with_other_proxy(pool):
+    first = pool.checkout_browser(domain="example.com")
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(lease=pool.checkout_browser("http://proxy:8080")))
+    thread.start()
+    time.sleep(0.2)
+    assert len(pool.launched) == 1
+
+    # 归还后空闲浏览器配置不同，被回收后才启动新的
+    pool.checkin_browser(first)
+    thread.join(2)
+    assert result["lease"].pooled.key[0] == "http://proxy:8080"
+    assert first.pooled.quit_called
+    assert len(pool.launched) == 2
+
+
+def test_cancel_while_waiting(pool):
+    pool.checkout_browser(domain="example.com")
+    token = CancellationToken()
+    errors = []
+
+    def checkout():
+        try:
+            pool.checkout_browser(domain="example.com", cancel_token=token)
+        except BypassCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=checkout)
+    thread.start()
+    token.cancel("客户端断开")
+    thread.join(3)
+    assert not thread.is_alive()
+    assert errors
+    assert len(pool.launched) == 1
+
+
+def test_browser_budget_is_shared_between_processes(monkeypatch, tmp_path):
+    table = SharedSlotTable(str(tmp_path / "slots"), 4)
+    monkeypatch.setattr(server, "shared_slot_table", table)
+    other = SharedSlotTable(table.path, 4)
+    other.pid = os.getppid()
+    # 另一个服务进程已占用唯一的浏览器名额
+    assert other.reserve_process("chrome", 1)
+    pool = make_pool(monkeypatch, table)
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(lease=pool.checkout_browser(domain="example.com")))
+    thread.start()
+    time.sleep(0.2)
+    assert not pool.launched
+    assert other.count_processes("waiting", others_only=True) == 1
+
+    other.cancel_reservation("chrome")
+    thread.join(3)
+    assert len(pool.launched) == 1
+    assert table.count_processes("chrome") == 1
+    assert table.count_processes("waiting") == 0
+
+
+@pytest.mark.parametrize("warm", [False, True])
+def test_launched_browser_is_always_counted(pool, warm):
+    # 每次状态变化（都在 pool_lock 内通知）时，已启动且未回收的浏览器都应计入池中或启动中
+    gaps = []
+    notify_all = pool.pool_changed.notify_all
+
+    def check_and_notify():
+        live = sum(1 for browser in pool.launched if not browser.retired)
+        if len(pool.idle_pool) + len(pool.busy_pool) + pool.launching < live:
+            gaps.append(live)
+        notify_all()
+
+    pool.pool_changed.notify_all = check_and_notify
+    if warm:
+        pool.min_warm = 1
+        pool._warm_up_once()
+        assert len(pool.idle_pool) == 1
+    lease = pool.checkout_browser(domain="example.com")
+    assert lease.pooled in pool.busy_pool
+    pool.checkin_browser(lease)
+    assert not gaps
+    assert len(pool.launched) == 1
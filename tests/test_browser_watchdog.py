@@ -0,0 +1,136 @@
+import os
+import subprocess
+import time
+
+import psutil
+import pytest
+
+from browser_watchdog import BrowserWatchdog
+from tests.test_browser_pool import make_pool
+
+
+class FakeTab:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def wait_until(predicate, timeout: float = 3):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def fake_chrome(tmp_path):
+    """名为 chrome 的长时间运行进程"""
+    path = tmp_path / "chrome"
+    path.symlink_to("/bin/sleep")
+    processes = []
+
+    def spawn(*args):
+        process = subprocess.Popen([str(path), *args] if args else [str(path), "30"])
+        processes.append(process)
+        return process
+
+    yield spawn
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+def checkout(pool, domain: str):
+    lease = pool.checkout_browser(domain=domain)
+    lease.tab = FakeTab()
+    return lease
+
+
+def test_hung_lease_on_shared_browser_closes_only_its_tab(monkeypatch):
+    pool = make_pool(monkeypatch)
+    hung, healthy = checkout(pool, "example.com"), checkout(pool, "example.org")
+    assert hung.pooled is healthy.pooled
+    hung.started_at -= 100
+    tab = hung.tab
+    watchdog = BrowserWatchdog(pool, max_rss=0, max_lifetime=0, hang_timeout=10)
+    watchdog.check_browsers()
+
+    assert wait_until(lambda: tab.closed)
+    assert not healthy.tab.closed
+    pooled = healthy.pooled
+    assert not pooled.quit_called
+    # 不再接收新任务，排空后回收
+    assert pooled.retiring
+    assert not pool._can_host(pooled, pooled.key, "example.net")
+    assert watchdog.reclaimed["hung"] == 1
+    # 同一个卡死任务不会被重复处理
+    watchdog.check_browsers()
+    assert watchdog.reclaimed["hung"] == 1
+    pool.checkin_browser(hung, reusable=False)
+    pool.checkin_browser(healthy)
+    assert pooled.quit_called and pooled.retired
+
+
+def test_hung_exclusive_browser_is_killed(monkeypatch, fake_chrome):
+    pool = make_pool(monkeypatch)
+    lease = checkout(pool, "example.com")
+    process = fake_chrome()
+    lease.pooled.process_id = process.pid
+    lease.started_at -= 100
+    watchdog = BrowserWatchdog(pool, max_rss=0, max_lifetime=0, hang_timeout=10)
+    watchdog.check_browsers()
+    assert process.poll() is not None
+    assert lease.pooled.retired
+    assert lease.pooled not in pool.busy_pool
+    assert watchdog.reclaimed["hung"] == 1
+
+
+def test_reap_orphans_keeps_pool_browsers_behind_wrappers(monkeypatch, fake_chrome, tmp_path):
+    pool = make_pool(monkeypatch)
+    lease = checkout(pool, "example.com")
+    # 浏览器由包装脚本启动：本进程的直接子进程是包装脚本，池中记录的是它的子进程
+    wrapper = tmp_path / "chrome-wrapper"
+    wrapper.write_text(f"#!/bin/sh\n{tmp_path / 'chrome'} 30\n")
+    wrapper.chmod(0o755)
+    wrapped = subprocess.Popen([str(wrapper)])
+    try:
+        assert wait_until(lambda: psutil.Process(wrapped.pid).children())
+        lease.pooled.process_id = psutil.Process(wrapped.pid).children()[0].pid
+        orphan = fake_chrome()
+        watchdog = BrowserWatchdog(pool, max_rss=0, max_lifetime=0, hang_timeout=0)
+        assert watchdog.reap_orphans(grace=0) == 1
+        assert orphan.poll() is not None
+        assert wrapped.poll() is None
+        assert watchdog.reclaimed["orphan"] == 1
+    finally:
+        for process in psutil.Process(wrapped.pid).children(recursive=True):
+            process.kill()
+        wrapped.kill()
+        wrapped.wait()
+
+
+def test_reap_orphans_spares_browsers_when_a_pid_is_unknown(monkeypatch, fake_chrome):
+    pool = make_pool(monkeypatch)
+    lease = checkout(pool, "example.com")
+    assert lease.pooled.process_id is None
+    process = fake_chrome()
+    watchdog = BrowserWatchdog(pool, max_rss=0, max_lifetime=0, hang_timeout=0)
+    assert watchdog.reap_orphans(grace=0) == 0
+    assert process.poll() is None
+    # 浏览器归还回收后即可判定
+    pool.checkin_browser(lease, reusable=False)
+    assert watchdog.reap_orphans(grace=0) == 1
+    assert wait_until(lambda: process.poll() is not None)
+
+
+def test_reap_orphans_respects_grace(monkeypatch, fake_chrome):
+    pool = make_pool(monkeypatch)
+    process = fake_chrome()
+    watchdog = BrowserWatchdog(pool, max_rss=0, max_lifetime=0, hang_timeout=0)
+    assert watchdog.reap_orphans(grace=60) == 0
+    assert process.poll() is None
+    assert os.getpid() == psutil.Process(process.pid).ppid()
@@ -0,0 +1,60 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import BypassCancelled, CancellationToken
+
+
+def test_cancel_runs_callbacks_inline_by_default():
+    token = CancellationToken()
+    calls = []
+    token.add_callback(lambda: calls.append(threading.current_thread()))
+    token.cancel("done")
+    assert calls == [threading.current_thread()]
+    assert token.cancelled and token.reason == "done"
+    with pytest.raises(BypassCancelled):
+        token.raise_if_cancelled()
+
+
+def test_cancel_with_executor_does_not_block_caller():
+    token = CancellationToken()
+    release = threading.Event()
+    finished = threading.Event()
+
+    def slow_teardown():
+        release.wait(5)
+        finished.set()
+
+    token.add_callback(slow_teardown)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        started = time.time()
+        token.cancel("timeout", executor)
+        assert time.time() - started < 0.5
+        assert token.cancelled  # 标志立即生效
+        assert not finished.is_set()
+        release.set()
+    assert finished.is_set()
+
+
+def test_callbacks_run_once_and_late_callbacks_run_immediately():
+    token = CancellationToken()
+    calls = []
+    token.add_callback(lambda: calls.append("early"))
+    removed = lambda: calls.append("removed")
+    token.add_callback(removed)
+    token.remove_callback(removed)
+    token.cancel()
+    token.cancel()
+    token.add_callback(lambda: calls.append("late"))
+    assert calls == ["early", "late"]
+
+
+def test_callback_errors_do_not_stop_others():
+    token = CancellationToken()
+    calls = []
+    token.add_callback(lambda: 1 / 0)
+    token.add_callback(lambda: calls.append("ok"))
+    token.cancel()
+    assert calls == ["ok"]
@@ -0,0 +1,78 @@
+import socket
+import time
+
+import pytest
+
+from clearance_cache import ClearanceCache, clearance_expiry, registrable_domain
+
+
+def test_registrable_domain_works_offline(monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("不应联网")
+
+    monkeypatch.setattr(socket, "create_connection", no_network)
+    monkeypatch.setattr(socket.socket, "connect", no_network)
+    assert registrable_domain("https://a.b.example.co.uk/x") == "example.co.uk"
+    assert registrable_domain("https://www.Example.com:8443/") == "example.com"
+    assert registrable_domain("http://127.0.0.1:8000/") == "127.0.0.1"
+    assert registrable_domain("http://localhost/") == "localhost"
+
+
+def test_clearance_expiry_uses_cookie_expiry():
+    now = time.time()
+    cookies = [{"name": "other", "expires": now + 10}, {"name": "cf_clearance", "expires": now + 1000}]
+    assert clearance_expiry(cookies, 300, 3600) == pytest.approx(now + 970, abs=2)
+    # 上限
+    assert clearance_expiry(cookies, 300, 100) == pytest.approx(now + 100, abs=2)
+    # 会话cookie或没有cf_clearance时使用默认TTL
+    assert clearance_expiry([{"name": "cf_clearance", "expires": -1}], 300, 3600) == pytest.approx(now + 300, abs=2)
+    assert clearance_expiry([], 300, 3600) == pytest.approx(now + 300, abs=2)
+
+
+def test_make_key_groups_by_registrable_domain():
+    key = ClearanceCache.make_key("https://a.example.com/x", None, None)
+    assert key == ("example.com", "", "")
+    assert ClearanceCache.make_key("https://b.example.com/", "", "") == key
+
+
+def test_get_put_and_expiry():
+    cache = ClearanceCache()
+    key = ("example.com", "", "")
+    assert cache.get(key) is None
+    cache.put(key, {"cookies": {"cf_clearance": "x"}}, time.time() + 60)
+    assert cache.get(key) == {"cookies": {"cf_clearance": "x"}}
+    cache.put(key, {"cookies": {}}, time.time() - 1)  # 已过期的值不写入
+    assert cache.get(key) == {"cookies": {"cf_clearance": "x"}}
+    cache.entries[key].expires_at = time.time() - 1
+    assert cache.get(key) is None
+    stats = cache.get_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["expirations"] == 1 and stats["entries"] == 0
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = ClearanceCache(max_entries=2)
+    expires = time.time() + 60
+    for name in ("a", "b"):
+        cache.put((name, "", ""), {"v": name}, expires)
+    cache.get(("a", "", ""))  # a 最近使用
+    cache.put(("c", "", ""), {"v": "c"}, expires)
+    assert cache.get(("b", "", "")) is None
+    assert cache.get(("a", "", "")) is not None
+    assert cache.evictions == 1
+
+    small = ClearanceCache(max_entries=100, max_bytes=30)
+    small.put(("a", "", ""), {"v": "x" * 10}, expires)
+    small.put(("b", "", ""), {"v": "y" * 10}, expires)
+    assert list(small.entries) == [("b", "", "")]
+    assert small.total_bytes <= 30
+    small.put(("c", "", ""), {"v": "z" * 100}, expires)  # 单个条目超过上限时跳过
+    assert ("c", "", "") not in small.entries
+
+
+def test_invalidate():
+    cache = ClearanceCache()
+    key = ("example.com", "", "")
+    cache.put(key, {"v": 1}, time.time() + 60)
+    cache.invalidate(key)
+    assert cache.get(key) is None
+    assert cache.total_bytes == 0
@@ -0,0 +1,261 @@
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from clearance_store import ClearanceStore, MemoryClearanceStore, SQLiteClearanceStore, RedisClearanceStore, \
+    RedisError, create_clearance_store
+
+KEY = ("example.com", None, "UA")
+VALUE = {"cookies": {"cf_clearance": "abc"}, "user_agent": "UA"}
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """进程内的最小 RESP 服务，支持 AUTH、SELECT、GET、SET PX 和 DEL"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password: str = None, username: str = None, port: int = 0):
+        super().__init__(("127.0.0.1", port), RespHandler)
+        self.password = password
+        self.username = username
+        self.databases = {}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.commands = []
+        self.clients = set()
+
+    @property
+    def url(self) -> str:
+        return f"127.0.0.1:{self.server_address[1]}"
+
+    def db(self, index: int) -> dict:
+        return self.databases.setdefault(index, {})
+
+    def drop_clients(self):
+        """断开所有客户端连接，模拟 Redis 重启"""
+        for client in list(self.clients):
+            client.request.shutdown(socket.SHUT_RDWR)
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        server.clients.add(self)
+        server.connections += 1
+        authed = server.password is None
+        db = 0
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                name = args[0].upper()
+                server.commands.append(name)
+                if name == "AUTH":
+                    user = args[1] if len(args) == 3 else "default"
+                    expected_user = server.username or "default"
+                    if args[-1] == server.password and user == expected_user:
+                        authed = True
+                        self.reply("+OK")
+                    else:
+                        self.reply("-WRONGPASS invalid username-password pair")
+                elif not authed:
+                    self.reply("-NOAUTH Authentication required.")
+                elif name == "SELECT":
+                    db = int(args[1])
+                    self.reply("+OK")
+                elif name == "GET":
+                    with server.lock:
+                        entry = server.db(db).get(args[1])
+                        if entry and entry[1] is not None and entry[1] <= time.time():
+                            del server.db(db)[args[1]]
+                            entry = None
+                    self.reply_bulk(entry[0] if entry else None)
+                elif name == "SET":
+                    expires_at = None
+                    if len(args) == 5 and args[3].upper() == "PX":
+                        expires_at = time.time() + int(args[4]) / 1000
+                    with server.lock:
+                        server.db(db)[args[1]] = (args[2], expires_at)
+                    self.reply("+OK")
+                elif name == "DEL":
+                    with server.lock:
+                        removed = server.db(db).pop(args[1], None)
+                    self.reply(f":{int(removed is not None)}")
+                else:
+                    self.reply(f"-ERR unknown command '{name}'")
+        except OSError:
+            return
+        finally:
+            server.clients.discard(self)
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    def reply(self, line: str):
+        self.wfile.write(line.encode("utf-8") + b"\r\n")
+
+    def reply_bulk(self, data: str):
+        if data is None:
+            self.wfile.write(b"$-1\r\n")
+        else:
+            body = data.encode("utf-8")
+            self.wfile.write(f"${len(body)}\r\n".encode() + body + b"\r\n")
+
+
+def start_resp_server(**kwargs) -> RespServer:
+    server = RespServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def resp_server():
+    servers = []
+
+    def start(**kwargs):
+        server = start_resp_server(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_store_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ClearanceStore()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path, resp_server):
+    if request.param == "memory":
+        store = MemoryClearanceStore()
+    elif request.param == "sqlite":
+        store = SQLiteClearanceStore(str(tmp_path / "clearance.db"))
+    else:
+        store = RedisClearanceStore(f"redis://{resp_server().url}")
+    yield store
+    store.close()
+
+
+def test_get_put_delete(store):
+    assert store.get(KEY) is None
+    expires_at = time.time() + 60
+    store.put(KEY, VALUE, expires_at)
+    value, stored_expiry = store.get(KEY)
+    assert value == VALUE
+    assert stored_expiry == pytest.approx(expires_at)
+    # 代理或UA不同的条目互不影响
+    assert store.get(("example.com", "http://proxy:8080", "UA")) is None
+    store.delete(KEY)
+    assert store.get(KEY) is None
+    stats = store.get_stats()
+    assert stats["hits"] == 1
+    assert stats["writes"] == 1
+
+
+def test_expired_entries_are_not_returned(store):
+    store.put(KEY, VALUE, time.time() + 0.2)
+    assert store.get(KEY) is not None
+    time.sleep(0.3)
+    assert store.get(KEY) is None
+
+
+def test_call_swallows_errors(tmp_path):
+    store = RedisClearanceStore("redis://127.0.0.1:1")
+    assert store.call("get", KEY) is None
+    assert store.get_stats()["errors"] == 1
+
+
+def test_redis_reconnects_after_disconnect(resp_server):
+    server = resp_server()
+    store = RedisClearanceStore(f"redis://{server.url}")
+    store.put(KEY, VALUE, time.time() + 60)
+    server.drop_clients()
+    # 复用的连接已断开时自动重连
+    assert store.get(KEY)[0] == VALUE
+    assert server.connections == 2
+    store.close()
+
+
+def test_redis_down_then_back(resp_server):
+    server = resp_server()
+    port = server.server_address[1]
+    store = RedisClearanceStore(f"redis://{server.url}")
+    store.put(KEY, VALUE, time.time() + 60)
+    server.shutdown()
+    server.drop_clients()
+    server.server_close()
+    assert store.call("get", KEY) is None
+    assert store.get_stats()["errors"] == 1
+
+    # Redis 重启后数据为空，客户端自动重连
+    resp_server(port=port)
+    assert store.get(KEY) is None
+    store.put(KEY, VALUE, time.time() + 60)
+    assert store.get(KEY)[0] == VALUE
+    store.close()
+
+
+def test_redis_auth_and_select(resp_server):
+    server = resp_server(password="p@ss")
+    store = create_clearance_store(f"redis://:p%40ss@{server.url}/2")
+    store.put(KEY, VALUE, time.time() + 60)
+    assert store.get(KEY)[0] == VALUE
+    assert server.commands[:2] == ["AUTH", "SELECT"]
+    assert server.databases[2] and not server.databases.get(0)
+    store.close()
+
+    with pytest.raises(RedisError):
+        RedisClearanceStore(f"redis://:wrong@{server.url}").get(KEY)
+    with pytest.raises(RedisError):
+        RedisClearanceStore(f"redis://{server.url}").get(KEY)
+
+
+def test_redis_acl_username(resp_server):
+    server = resp_server(password="secret", username="bypass")
+    store = RedisClearanceStore(f"redis://bypass:secret@{server.url}")
+    store.put(KEY, VALUE, time.time() + 60)
+    assert store.get(KEY)[0] == VALUE
+    store.close()
+
+
+def test_sqlite_close_closes_every_thread_connection(tmp_path):
+    store = SQLiteClearanceStore(str(tmp_path / "clearance.db"))
+    store.put(KEY, VALUE, time.time() + 60)
+    thread = threading.Thread(target=store.get, args=(KEY,))
+    thread.start()
+    thread.join()
+    connections = list(store.connections)
+    assert len(connections) == 2
+    store.close()
+    for conn in connections:
+        with pytest.raises(Exception):
+            conn.execute("SELECT 1")
+    # 关闭后再次使用时重新打开连接
+    assert store.get(KEY)[0] == VALUE
+    store.close()
+
+
+def test_sqlite_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "clearance.db")
+    first, second = SQLiteClearanceStore(path), SQLiteClearanceStore(path)
+    first.put(KEY, VALUE, time.time() + 60)
+    assert second.get(KEY)[0] == VALUE
+    first.close()
+    second.close()
@@ -0,0 +1,87 @@
+import threading
+
+from CloudflareBypasser import CloudflareBypasser, ChallengeWatcher
+from utils import CancellationToken
+
+
+class FakeDriver:
+    def __init__(self):
+        self.title = "Just a moment..."
+
+
+class FakeButton:
+    def __init__(self, driver, watcher):
+        self.driver = driver
+        self.watcher = watcher
+        self.clicks = 0
+
+    def click(self):
+        self.clicks += 1
+        self.driver.title = "Example Domain"
+        self.watcher.changed.set()  # 页面跳转事件
+
+
+class FakeWatcher(ChallengeWatcher):
+    """不连接CDP，只用事件对象模拟页面变化"""
+
+    def start(self):
+        self.cdp = object()
+        return self
+
+    def stop(self):
+        self.cdp = None
+
+
+def make_bypasser(driver, progress, **kwargs):
+    bypasser = CloudflareBypasser(driver, max_retries=3, log=False, watcher=FakeWatcher(driver).start(),
+                                  progress=progress, **kwargs)
+    button = FakeButton(driver, bypasser.watcher)
+    bypasser.locate_cf_button = lambda turnstile=False: button
+    return bypasser, button
+
+
+def test_solve_challenge_reports_progress():
+    driver = FakeDriver()
+    events = []
+    bypasser, button = make_bypasser(driver, lambda event, **data: events.append((event, data)))
+
+    assert bypasser._solve_challenge() is True
+    assert button.clicks == 1
+    assert [event for event, _ in events] == ["challenge_detected", "clicked", "cleared"]
+    assert events[-1][1] == {"attempts": 1}
+    assert "challenge_solve" in bypasser.timings
+
+
+def test_solve_challenge_gives_up_after_retries():
+    driver = FakeDriver()
+    events = []
+    bypasser, button = make_bypasser(driver, lambda event, **data: events.append(event))
+    button.click = lambda: bypasser.watcher.changed.set()  # 点击无效，始终停留在验证页
+
+    assert bypasser._solve_challenge() is False
+    assert bypasser.bypass() is False
+    assert "cleared" not in events
+
+
+def test_progress_callback_errors_are_ignored():
+    driver = FakeDriver()
+
+    def progress(event, **data):
+        raise RuntimeError("boom")
+
+    bypasser, _ = make_bypasser(driver, progress)
+    assert bypasser._solve_challenge() is True
+
+
+def test_cancel_wakes_caller_watcher():
+    driver = FakeDriver()
+    token = CancellationToken()
+    watcher = FakeWatcher(driver).start()
+    CloudflareBypasser(driver, log=False, watcher=watcher, cancel_token=token)
+
+    woke = threading.Event()
+    thread = threading.Thread(target=lambda: watcher.wait(5) and woke.set())
+    thread.start()
+    token.cancel("test")
+    thread.join(2)
+    assert woke.is_set()
@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+import compression
+from compression import iter_encoded, negotiate_encoding
+
+TEXT = "<html>" + "验证通过 " * 50000 + "</html>"
+
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate_encoding("") == "identity"
+    assert negotiate_encoding(None) == "identity"
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("gzip;q=0, deflate") == "identity"
+    assert negotiate_encoding("*") == "gzip"
+    assert negotiate_encoding("*, gzip;q=0") == "identity"
+    assert negotiate_encoding("gzip;q=abc") == "identity"
+
+
+def test_negotiate_prefers_brotli_when_available(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+    assert negotiate_encoding("gzip, br") == "br"
+    assert negotiate_encoding("gzip, br;q=0") == "gzip"
+    # 客户端更偏好 gzip 时不选 br，q 值相同时才按服务端偏好
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5") == "gzip"
+    assert negotiate_encoding("br;q=0.8, gzip;q=0.8") == "br"
+    assert negotiate_encoding("*;q=0.5, gzip") == "gzip"
+
+
+def test_identity_is_chunked_utf8():
+    chunks = list(iter_encoded(TEXT, "identity", chunk_size=1000))
+    assert len(chunks) > 1
+    assert b"".join(chunks).decode("utf-8") == TEXT
+    assert list(iter_encoded("", "identity")) == []
+
+
+def test_gzip_round_trip():
+    chunks = list(iter_encoded(TEXT, "gzip", chunk_size=4096))
+    body = b"".join(chunks)
+    assert gzip.decompress(body).decode("utf-8") == TEXT
+    assert len(body) < len(TEXT.encode("utf-8")) // 10
+    # 空文本也要输出合法的 gzip 流
+    assert gzip.decompress(b"".join(iter_encoded("", "gzip"))) == b""
+
+
+def test_brotli_round_trip():
+    brotli = pytest.importorskip("brotli")
+    body = b"".join(iter_encoded(TEXT, "br", chunk_size=4096))
+    assert brotli.decompress(body).decode("utf-8") == TEXT
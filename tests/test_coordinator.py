@@ -0,0 +1,114 @@
+import coordinator
+from coordinator import HashRing, NodeRegistry
+
+KEYS = [f"site{i}.com" for i in range(200)]
+
+
+def owners(ring: HashRing) -> dict:
+    return {key: next(ring.walk(key)) for key in KEYS}
+
+
+def test_ring_walk_yields_each_node_once():
+    ring = HashRing(vnodes=16)
+    assert list(ring.walk("example.com")) == []
+    for node_id in ("a", "b", "c"):
+        ring.add(node_id)
+    assert sorted(ring.walk("example.com")) == ["a", "b", "c"]
+
+
+def test_ring_only_moves_keys_of_removed_node():
+    ring = HashRing()
+    for node_id in ("a", "b", "c"):
+        ring.add(node_id)
+    before = owners(ring)
+    assert set(before.values()) == {"a", "b", "c"}
+    ring.remove("b")
+    after = owners(ring)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(before[key] == "b" for key in moved)
+
+
+def make_registry(**kwargs) -> NodeRegistry:
+    registry = NodeRegistry(**kwargs)
+    for node_id in ("a", "b", "c"):
+        registry.heartbeat(node_id, f"http://{node_id}:8000/", max_jobs=2, free_slots=2)
+    return registry
+
+
+def test_route_is_stable_and_spills_over_load_bound():
+    registry = make_registry()
+    key = "example.com"
+    order = list(registry.ring.walk(key))
+    first = registry.route(key)
+    assert first.id == order[0] and first.url == f"http://{order[0]}:8000"
+    registry.done(first)
+    assert registry.route(key).id == order[0]
+    # 主节点已超过平均负载的 load_factor 倍，溢出到环上的下一个节点
+    assert registry.route(key).id == order[1]
+    stats = registry.get_stats()
+    assert stats["primary"] == 2 and stats["spilled"] == 1
+
+
+def test_full_nodes_queue_on_least_loaded():
+    registry = make_registry()
+    for node_id in ("a", "b", "c"):
+        registry.heartbeat(node_id, f"http://{node_id}:8000", max_jobs=2, free_slots=0)
+    registry.nodes["a"].inflight = 4
+    registry.nodes["b"].inflight = 3
+    # 全部满载时交给相对负载最低的节点排队
+    assert registry.route("example.com").id == "c"
+
+
+def test_route_excludes_failed_nodes_and_reports_unavailable():
+    registry = make_registry()
+    key = "example.com"
+    order = list(registry.ring.walk(key))
+    assert registry.route(key, exclude=order[:1]).id == order[1]
+    assert registry.route(key, exclude=order) is None
+    assert registry.get_stats()["unavailable"] == 1
+
+
+def test_transient_failure_does_not_evict_node():
+    registry = make_registry(max_failures=3)
+    node = registry.route("example.com")
+    registry.done(node)
+    assert registry.record_failure(node) is False
+    assert registry.record_failure(node) is False
+    # 转发成功后连续失败次数清零
+    registry.record_success(node)
+    assert registry.record_failure(node) is False
+    assert node.id in registry.nodes
+    assert registry.route("example.com").id == node.id
+
+
+def test_repeated_failures_evict_node():
+    registry = make_registry(max_failures=2)
+    node = registry.route("example.com")
+    registry.done(node)
+    registry.record_failure(node)
+    assert registry.record_failure(node) is True
+    assert node.id not in registry.nodes
+    assert node.id not in registry.ring.owners.values()
+    assert registry.route("example.com").id != node.id
+    # 节点恢复心跳后重新加入
+    registry.heartbeat(node.id, node.url, max_jobs=2, free_slots=2)
+    assert registry.nodes[node.id].failures == 0
+
+
+def test_nodes_without_heartbeat_expire(monkeypatch):
+    registry = make_registry(node_ttl=15)
+    registry.nodes["a"].last_seen -= 16
+    registry.prune()
+    assert sorted(registry.nodes) == ["b", "c"]
+
+
+def test_heartbeat_sender_requires_aiohttp(monkeypatch):
+    monkeypatch.setattr(coordinator, "aiohttp", None)
+    sender = coordinator.HeartbeatSender("http://coordinator/", "pw", "a", "http://a:8000", dict)
+    assert sender.base_url == "http://coordinator/pw/nodes"
+    try:
+        sender.start()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("未安装 aiohttp 时应拒绝启动")
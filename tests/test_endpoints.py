@@ -0,0 +1,198 @@
+import gzip
+import json
+import time
+from urllib.parse import urlparse
+
+import pytest
+from fastapi.testclient import TestClient
+
+import compression
+import server
+from coordinator import NodeRegistry
+from server import CookieResponse
+
+
+@pytest.fixture
+def client():
+    # 不进入 with 块，不触发启动事件，也就不会预热浏览器
+    return TestClient(server.app)
+
+
+class FakeBypass(list):
+    """记录被调用的URL；delays 按主机设置耗时（秒），errors 中的主机过盾失败"""
+
+    def __init__(self):
+        super().__init__()
+        self.delays = {}
+        self.errors = set()
+
+    def __call__(self, url, retries, proxy, user_agent, result, block_policy=None):
+        self.append(url)
+        host = urlparse(url).hostname
+        try:
+            time.sleep(self.delays.get(host, 0))
+            if host in self.errors:
+                result.set_error("过盾失败")
+                return
+            result.expires_at = time.time() + 60
+            result.set_result(CookieResponse(cookies={"cf_clearance": "token"}, user_agent=user_agent or "fake"))
+        finally:
+            server.browser_pool.release_browser()
+
+
+@pytest.fixture
+def fake_bypass(monkeypatch):
+    """用假的过盾函数替换浏览器"""
+    fake = FakeBypass()
+    monkeypatch.setattr(server, "process_cookies_request", fake)
+    return fake
+
+
+def post_batch(client, urls, **options) -> list:
+    response = client.post(f"/{server.PASSWORD}/cookies/batch", json={"items": [{"url": u} for u in urls], **options})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_cookies_endpoint_solves_once_then_hits_cache(client, fake_bypass):
+    url = "https://endpoint-cache.com/"
+    first = client.get(f"/{server.PASSWORD}/cookies", params={"url": url})
+    assert first.status_code == 200
+    assert first.json()["cookies"] == {"cf_clearance": "token"}
+    assert first.headers["X-Request-ID"]
+    second = client.get(f"/{server.PASSWORD}/cookies", params={"url": "https://www.endpoint-cache.com/a"})
+    assert second.json() == first.json()
+    assert fake_bypass == [url]
+    assert server.browser_pool.active_browsers == 0
+
+
+def test_endpoints_require_password(client, fake_bypass):
+    assert client.get("/wrong/cookies", params={"url": "https://example.com/"}).status_code == 403
+    assert client.get("/wrong/metrics").status_code == 403
+    assert client.get("/metrics").status_code == 404
+    assert fake_bypass == []
+
+
+def test_unsafe_url_is_rejected(client, fake_bypass):
+    response = client.get(f"/{server.PASSWORD}/cookies", params={"url": "http://127.0.0.1/"})
+    assert response.status_code == 400
+    assert fake_bypass == []
+
+
+def test_metrics_omit_domains_by_default(client, fake_bypass):
+    client.get(f"/{server.PASSWORD}/cookies", params={"url": "https://endpoint-metrics.com/"})
+    response = client.get(f"/{server.PASSWORD}/metrics")
+    assert response.status_code == 200
+    assert "cf_requests_total" in response.text
+    assert "endpoint-metrics" not in response.text
+
+
+def test_domain_labels_are_opt_in(client, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_MAX_DOMAINS", 10)
+    monkeypatch.setattr(server, "domain_label", server.LabelLimiter(10))
+    server.record_outcome("https://opt-in.example.org/", "cookies", "success", 1.5)
+    response = client.get(f"/{server.PASSWORD}/metrics")
+    assert 'domain="example.org"' in response.text
+
+
+def test_batch_dedups_by_registrable_domain(client, fake_bypass):
+    urls = ["https://a.batch-dedup.com/", "https://b.batch-dedup.com/x",
+            "https://batch-dedup.com/", "https://batch-dedup.net/"]
+    lines = post_batch(client, urls)
+    assert sorted(line["index"] for line in lines) == [0, 1, 2, 3]
+    assert all(line["status"] == "ok" for line in lines)
+    # 同一可注册域名只过一次盾
+    assert len(fake_bypass) == 2
+    assert {line["url"] for line in lines} == set(urls)
+
+
+def test_batch_streams_in_finish_order_with_per_item_errors(client, fake_bypass):
+    fake_bypass.delays = {"slow.batch-order.com": 0.3}
+    fake_bypass.errors = {"broken.batch-order.org"}
+    urls = ["https://slow.batch-order.com/", "http://127.0.0.1/",
+            "https://broken.batch-order.org/", "https://fast.batch-order.net/"]
+    lines = post_batch(client, urls)
+    # 非法URL最先返回，最慢的一项最后返回
+    assert lines[0] == {"index": 1, "url": "http://127.0.0.1/", "status": "error", "status_code": 400,
+                        "error": "Invalid URL"}
+    assert lines[-1]["index"] == 0 and lines[-1]["status"] == "ok"
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[2]["status"] == "error" and by_index[2]["status_code"] == 503
+    assert by_index[3]["status"] == "ok"
+
+
+def test_batch_deadline_applies_per_item(client, fake_bypass, monkeypatch):
+    # 每次只执行一项，整个批量耗时远超 deadline，但每一项本身都来得及
+    monkeypatch.setattr(server.browser_pool, "max_jobs", 1)
+    hosts = [f"item.batch-deadline{i}.com" for i in range(4)]
+    fake_bypass.delays = {host: 0.3 for host in hosts}
+    lines = post_batch(client, [f"https://{host}/" for host in hosts], deadline=0.8)
+    assert [line["status"] for line in lines] == ["ok"] * 4
+
+
+def test_batch_rejects_too_many_items(client, fake_bypass, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_MAX_ITEMS", 1)
+    response = client.post(f"/{server.PASSWORD}/cookies/batch",
+                           json={"items": [{"url": "https://a.com/"}, {"url": "https://b.com/"}]})
+    assert response.status_code == 400
+    assert fake_bypass == []
+
+
+def test_coordinator_does_not_run_browsers(client, fake_bypass, monkeypatch):
+    monkeypatch.setattr(server, "node_registry", NodeRegistry())
+    batch = client.post(f"/{server.PASSWORD}/cookies/batch", json={"items": [{"url": "https://coordinator.com/"}]})
+    assert batch.status_code == 400
+    job = client.post(f"/{server.PASSWORD}/jobs", json={"url": "https://coordinator.com/"})
+    assert job.status_code == 400
+    assert client.get(f"/{server.PASSWORD}/jobs/abc").status_code == 400
+    # 没有工作节点时路由端点返回503，不在本地过盾
+    cookies = client.get(f"/{server.PASSWORD}/cookies", params={"url": "https://coordinator.com/"})
+    assert cookies.status_code == 503
+    assert fake_bypass == []
+
+
+@pytest.fixture
+def fake_html(monkeypatch):
+    html = "<html>" + "验证通过 " * 40000 + "</html>"
+
+    def process(url, retries, proxy, user_agent, result, **options):
+        try:
+            result.set_result({"html": html, "url": url + "final", "user_agent": "fake"})
+        finally:
+            server.browser_pool.release_browser()
+
+    monkeypatch.setattr(server, "process_html_request", process)
+    return html
+
+
+def get_html_raw(client, accept_encoding: str):
+    with client.stream("GET", f"/{server.PASSWORD}/html", params={"url": "https://html.com/"},
+                       headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_html_is_streamed_with_negotiated_encoding(client, fake_html, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    response, body = get_html_raw(client, "br;q=1.0, gzip;q=0.5")
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    # 流式输出，不预先计算长度
+    assert "content-length" not in response.headers
+    assert response.headers["x-final-url"] == "https://html.com/final"
+    assert gzip.decompress(body).decode("utf-8") == fake_html
+    assert len(body) < len(fake_html.encode("utf-8")) // 10
+
+
+def test_html_without_accepted_encoding_is_plain(client, fake_html):
+    response, body = get_html_raw(client, "gzip;q=0")
+    assert "content-encoding" not in response.headers
+    assert body.decode("utf-8") == fake_html
+
+
+def test_html_uses_brotli_when_preferred(client, fake_html):
+    brotli = pytest.importorskip("brotli")
+    response, body = get_html_raw(client, "gzip, br")
+    assert response.headers["content-encoding"] == "br"
+    assert brotli.decompress(body).decode("utf-8") == fake_html
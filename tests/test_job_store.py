@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from job_store import JobFull, JobStore, current_job, report_progress
+
+
+class Failure(Exception):
+    def __init__(self, detail: str, status_code: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def test_job_runs_and_reports_progress():
+    async def main():
+        store = JobStore()
+
+        async def runner():
+            report_progress("browser", proxy=None)
+            # 工作线程复制上下文后同样能上报
+            await asyncio.get_running_loop().run_in_executor(
+                None, contextvars.copy_context().run, report_progress, "challenge")
+            return {"cookies": {}}
+
+        job = store.submit("cookies", "https://example.com", runner)
+        assert await job.wait_finished(1)
+        await asyncio.sleep(0)
+        return job
+
+    job = asyncio.run(main())
+    assert job.status == "done"
+    assert job.result == {"cookies": {}}
+    events = [event["event"] for event in job.events]
+    assert events == ["started", "browser", "challenge", "done"]
+    assert job.to_dict()["job_id"] == job.id
+
+
+def test_report_progress_outside_job_is_noop():
+    assert current_job.get() is None
+    report_progress("ignored")
+
+
+def test_failure_keeps_detail_and_status_code():
+    async def main():
+        store = JobStore()
+
+        async def runner():
+            raise Failure("过盾失败", 502)
+
+        job = store.submit("cookies", "https://example.com", runner)
+        await job.wait_finished(1)
+        return job
+
+    job = asyncio.run(main())
+    assert job.status == "failed"
+    assert (job.error, job.status_code) == ("过盾失败", 502)
+
+
+def test_cancelled_job_is_marked_failed():
+    async def main():
+        store = JobStore()
+        job = store.submit("cookies", "https://example.com", lambda: asyncio.sleep(10))
+        await asyncio.sleep(0)
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        return job
+
+    job = asyncio.run(main())
+    assert job.status == "failed" and job.status_code == 499
+
+
+def test_wait_for_update_times_out():
+    async def main():
+        store = JobStore()
+        job = store.submit("cookies", "https://example.com", lambda: asyncio.sleep(10))
+        await asyncio.sleep(0)
+        seen = len(job.events)
+        updated = await job.wait_for_update(seen, 0.05)
+        finished = await job.wait_finished(0.05)
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        return updated, finished, job.waiters
+
+    assert asyncio.run(main()) == (False, False, [])
+
+
+def test_full_store_rejects_and_evicts_oldest_finished():
+    async def main():
+        store = JobStore(max_jobs=2)
+        done = store.submit("cookies", "https://a.com", lambda: asyncio.sleep(0, result=1))
+        await done.wait_finished(1)
+        running = store.submit("cookies", "https://b.com", lambda: asyncio.sleep(10))
+        # 已完成的任务被淘汰，为新任务让出位置
+        third = store.submit("cookies", "https://c.com", lambda: asyncio.sleep(10))
+        assert store.get(done.id) is None
+        with pytest.raises(JobFull):
+            store.submit("cookies", "https://d.com", lambda: asyncio.sleep(10))
+        stats = store.get_stats()
+        for job in (running, third):
+            job.task.cancel()
+        await asyncio.gather(running.task, third.task, return_exceptions=True)
+        return stats
+
+    stats = asyncio.run(main())
+    assert stats["evicted"] == 1
+    assert stats["running"] == 2
+    assert stats["submitted"] == 3
+
+
+def test_finished_jobs_expire_after_ttl():
+    async def main():
+        store = JobStore(ttl=0.05)
+        job = store.submit("cookies", "https://a.com", lambda: asyncio.sleep(0, result=1))
+        await job.wait_finished(1)
+        assert store.get(job.id) is job
+        await asyncio.sleep(0.1)
+        return store.get(job.id)
+
+    assert asyncio.run(main()) is None
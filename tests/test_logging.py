@@ -0,0 +1,134 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+import pytest
+
+import utils
+from utils import ContextFilter, DeferredQueueHandler, JsonFormatter, LazyMessage, log_phase, start_log_context
+
+
+class Capture(logging.Handler):
+    """在写日志的线程中格式化，记录格式化结果和所在线程"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.setFormatter(JsonFormatter())
+        self.lines = []
+        self.threads = []
+
+    def emit(self, record):
+        self.lines.append(json.loads(self.format(record)))
+        self.threads.append(threading.current_thread())
+
+
+@pytest.fixture
+def pipeline():
+    """与 utils 相同结构的独立日志管道：调用方放入队列，flush 时由后台线程格式化"""
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    # 不挂在根日志器下，避免 pytest 的日志捕获在调用线程中提前格式化消息
+    logger = logging.Logger("tests.logging", logging.DEBUG)
+    logger.addHandler(handler)
+    capture = Capture()
+    listener = logging.handlers.QueueListener(log_queue, capture)
+
+    def flush():
+        # 后台线程在此才启动，处理完队列中已有的记录后退出
+        listener.start()
+        listener.stop()
+        return capture
+
+    logger.flush = flush
+    return logger
+
+
+def in_new_context(func, *args):
+    return contextvars.Context().run(func, *args)
+
+
+def test_json_fields(pipeline):
+    def log():
+        start_log_context("req-1")
+        log_phase.set("launch")
+        pipeline.info("浏览器已启动")
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            pipeline.exception("出错")
+
+    in_new_context(log)
+    first, second = pipeline.flush().lines
+    assert set(first) == {"ts", "level", "msg", "request_id", "phase", "thread"}
+    assert (first["level"], first["msg"], first["request_id"], first["phase"]) == ("INFO", "浏览器已启动", "req-1",
+                                                                                   "launch")
+    assert first["thread"] == threading.current_thread().name
+    assert second["level"] == "ERROR" and "ValueError: bad" in second["exc"]
+
+
+def test_context_follows_copied_context_into_threads(pipeline):
+    def log():
+        start_log_context("req-2")
+        log_phase.set("navigation")
+        # 工作线程通过复制的上下文沿用请求ID，没有复制上下文的线程使用默认值
+        context = contextvars.copy_context()
+        worker = threading.Thread(target=context.run, args=(pipeline.info, "worker"))
+        other = threading.Thread(target=pipeline.info, args=("other",))
+        for thread in (worker, other):
+            thread.start()
+            thread.join()
+
+    in_new_context(log)
+    lines = {line["msg"]: line for line in pipeline.flush().lines}
+    assert (lines["worker"]["request_id"], lines["worker"]["phase"]) == ("req-2", "navigation")
+    assert (lines["other"]["request_id"], lines["other"]["phase"]) == ("-", "-")
+
+
+def test_request_id_is_generated():
+    request_id = in_new_context(start_log_context)
+    assert len(request_id) == 12
+
+
+@pytest.mark.parametrize("rate, draw, kept", [(0, 0.0, False), (1, 0.99, True), (0.5, 0.2, True), (0.5, 0.7, False)])
+def test_debug_is_sampled_per_request(pipeline, monkeypatch, rate, draw, kept):
+    monkeypatch.setattr(utils, "LOG_DEBUG_SAMPLE_RATE", rate)
+    monkeypatch.setattr(utils.random, "random", lambda: draw)
+
+    def log():
+        start_log_context()
+        pipeline.debug("调试")
+        pipeline.info("信息")
+
+    in_new_context(log)
+    messages = [line["msg"] for line in pipeline.flush().lines]
+    assert messages == (["调试", "信息"] if kept else ["信息"])
+
+
+def test_lazy_message_is_formatted_on_listener_thread(pipeline):
+    formatted_in = []
+
+    class Value:
+        def __format__(self, spec):
+            formatted_in.append(threading.current_thread())
+            return "value"
+
+    pipeline.info(LazyMessage("结果: {}", Value()))
+    # 放入队列时还没有格式化
+    assert formatted_in == []
+    capture = pipeline.flush()
+    assert capture.lines[0]["msg"] == "结果: value"
+    assert formatted_in == capture.threads
+    assert formatted_in[0] is not threading.current_thread()
+    assert str(LazyMessage("无参数 {}")) == "无参数 {}"
+
+
+def test_module_pipeline_is_queued_and_rotating():
+    assert isinstance(utils.queue_handler, DeferredQueueHandler)
+    assert any(isinstance(f, ContextFilter) for f in utils.queue_handler.filters)
+    assert utils.log_listener.handlers == (utils.console_handler, utils.file_handler)
+    assert utils.file_handler.maxBytes == utils.LOG_MAX_BYTES
+    assert utils.file_handler.backupCount == utils.LOG_BACKUP_COUNT
@@ -0,0 +1,42 @@
+import pytest
+
+from metrics import LabelLimiter, Registry, _Metric
+
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric("cf_test", "help")
+
+
+def test_render_counter_gauge_and_histogram():
+    registry = Registry()
+    counter = registry.counter("cf_requests_total", "Requests", ["mode"])
+    counter.inc(mode="cookies")
+    counter.inc(2, mode='a"b')
+    registry.gauge("cf_pool", "Pool", lambda: {("idle",): 1, ("busy",): 2.5}, ["state"])
+    registry.gauge("cf_broken", "Broken", lambda: 1 / 0)
+    histogram = registry.histogram("cf_seconds", "Seconds", [], buckets=(1, 5))
+    histogram.observe(0.5)
+    histogram.observe(3)
+    histogram.observe(10)
+    lines = registry.render().splitlines()
+    assert lines[:4] == ["# HELP cf_requests_total Requests", "# TYPE cf_requests_total counter",
+                         'cf_requests_total{mode="a\\"b"} 2', 'cf_requests_total{mode="cookies"} 1']
+    assert 'cf_pool{state="busy"} 2.5' in lines and 'cf_pool{state="idle"} 1' in lines
+    # 回调出错时只输出元数据
+    assert lines[lines.index("# TYPE cf_broken gauge") + 1].startswith("# HELP cf_seconds")
+    assert lines[-5:] == ['cf_seconds_bucket{le="1"} 1', 'cf_seconds_bucket{le="5"} 2',
+                          'cf_seconds_bucket{le="+Inf"} 3', "cf_seconds_sum 13.5", "cf_seconds_count 3"]
+
+
+def test_histogram_time_records_on_error():
+    histogram = Registry().histogram("cf_seconds", "Seconds", ["phase"])
+    with pytest.raises(RuntimeError):
+        with histogram.time(phase="launch"):
+            raise RuntimeError("启动失败")
+    assert histogram.values[("launch",)][2] == 1
+
+
+def test_label_limiter():
+    limiter = LabelLimiter(2)
+    assert [limiter(v) for v in ("a.com", "b.com", "c.com", "a.com")] == ["a.com", "b.com", "other", "a.com"]
@@ -0,0 +1,89 @@
+import socket
+
+import pytest
+
+from port_allocator import PortAllocator, parse_port_range
+
+
+def free_port_range(size: int) -> tuple:
+    """找一段当前没有被占用的连续端口"""
+    for start in range(41000, 60000, 50):
+        sockets = []
+        try:
+            for port in range(start, start + size):
+                sock = socket.socket()
+                sock.bind(("127.0.0.1", port))
+                sockets.append(sock)
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+        return start, start + size - 1
+    pytest.skip("没有可用的连续端口")
+
+
+def test_parse_port_range():
+    assert parse_port_range("") is None
+    assert parse_port_range("20000-20010") == (20000, 20010)
+    assert parse_port_range("20000") == (20000, 20000)
+    for value in ("20010-20000", "0-10", "1-70000", "abc"):
+        with pytest.raises(ValueError):
+            parse_port_range(value)
+
+
+def test_auto_ports_are_unique():
+    allocator = PortAllocator()
+    sockets = [allocator.allocate_socket() for _ in range(5)]
+    ports = {sock.getsockname()[1] for sock in sockets}
+    assert len(ports) == 5
+    assert allocator.get_stats()["allocated"] == 5
+    for sock in sockets:
+        allocator.release(sock.getsockname()[1])
+        sock.close()
+    assert allocator.get_stats()["allocated"] == 0
+
+
+def test_range_is_exhausted_and_released_ports_are_reused():
+    port_range = free_port_range(2)
+    allocator = PortAllocator(port_range)
+    first = allocator.allocate_socket()
+    second = allocator.allocate_socket()
+    assert {first.getsockname()[1], second.getsockname()[1]} == set(range(port_range[0], port_range[1] + 1))
+    with pytest.raises(RuntimeError):
+        allocator.allocate_socket()
+    port = first.getsockname()[1]
+    first.close()
+    allocator.release(port)
+    third = allocator.allocate_socket()
+    assert third.getsockname()[1] == port
+    second.close()
+    third.close()
+
+
+def test_ports_held_by_other_processes_are_skipped():
+    port_range = free_port_range(2)
+    busy = socket.socket()
+    busy.bind(("127.0.0.1", port_range[0]))
+    busy.listen()
+    try:
+        allocator = PortAllocator(port_range)
+        sock = allocator.allocate_socket()
+        assert sock.getsockname()[1] == port_range[1]
+        assert allocator.get_stats()["bind_conflicts"] == 1
+        sock.close()
+    finally:
+        busy.close()
+
+
+def test_allocate_port_is_exclusive_until_released():
+    allocator = PortAllocator()
+    port = allocator.allocate_port()
+    others = [allocator.allocate_socket() for _ in range(3)]
+    assert port not in {sock.getsockname()[1] for sock in others}
+    allocator.release(port)
+    # 重复归还被忽略
+    allocator.release(port)
+    assert allocator.get_stats()["allocated"] == 3
+    for sock in others:
+        sock.close()
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+import refresh_scheduler
+from refresh_scheduler import RefreshScheduler
+
+KEY = ("example.com", "", "")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(refresh_scheduler.time, "time", clock.time)
+    return clock
+
+
+class Refresher:
+    """记录被刷新的条目；free 为 False 时模拟实时请求占满资源"""
+
+    def __init__(self, fail: bool = False):
+        self.refreshed = []
+        self.free = True
+        self.fail = fail
+
+    async def __call__(self, entry):
+        self.refreshed.append(entry.key)
+        if self.fail:
+            raise RuntimeError("过盾失败")
+
+    def scheduler(self, **kwargs) -> RefreshScheduler:
+        options = dict(lead_time=60, window=600, min_requests=3, budget_per_hour=60)
+        options.update(kwargs)
+        return RefreshScheduler(self, lambda: self.free, **options)
+
+
+def make_hot(scheduler: RefreshScheduler, key=KEY, requests: int = 3, expires_at: float = None):
+    for _ in range(requests):
+        scheduler.record(key, f"https://{key[0]}/", retries=5)
+    if expires_at is not None:
+        scheduler.set_expiry(key, expires_at)
+
+
+def run_tick(scheduler: RefreshScheduler):
+    async def main():
+        scheduler.tick()
+        # 让刷新任务执行完
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+
+def test_hotness_decays_over_window(clock):
+    scheduler = Refresher().scheduler()
+    make_hot(scheduler)
+    assert scheduler.get_stats()["hot"] == 1
+    clock.now += 600
+    # 一个窗口后衰减到约 3/e
+    assert scheduler.entries[KEY].decayed_score(clock.now, 600) == pytest.approx(3 / 2.71828, rel=1e-3)
+    assert scheduler.get_stats()["hot"] == 0
+    # 新请求在衰减后的分数上累加
+    scheduler.record(KEY, "https://example.com/")
+    assert scheduler.entries[KEY].score == pytest.approx(3 / 2.71828 + 1, rel=1e-3)
+
+
+def test_only_hot_entries_within_lead_time_are_due(clock):
+    scheduler = Refresher().scheduler()
+    make_hot(scheduler, ("hot.com", "", ""), expires_at=clock.now + 30)
+    make_hot(scheduler, ("cold.com", "", ""), requests=1, expires_at=clock.now + 30)
+    make_hot(scheduler, ("later.com", "", ""), expires_at=clock.now + 120)
+    make_hot(scheduler, ("expired.com", "", ""), expires_at=clock.now - 1)
+    make_hot(scheduler, ("unknown.com", "", ""))
+    assert [e.key[0] for e in scheduler.due()] == ["hot.com"]
+    clock.now += 61
+    make_hot(scheduler, ("later.com", "", ""), requests=1)
+    assert [e.key[0] for e in scheduler.due()] == ["later.com"]
+
+
+def test_due_is_ordered_by_expiry(clock):
+    scheduler = Refresher().scheduler()
+    for name, remaining in (("b.com", 40), ("a.com", 10), ("c.com", 50)):
+        make_hot(scheduler, (name, "", ""), expires_at=clock.now + remaining)
+    assert [e.key[0] for e in scheduler.due()] == ["a.com", "b.com", "c.com"]
+
+
+def test_refreshes_earliest_first_up_to_max_concurrent(clock):
+    refresher = Refresher()
+    scheduler = refresher.scheduler(max_concurrent=2)
+    for name, remaining in (("b.com", 40), ("a.com", 10), ("c.com", 50)):
+        make_hot(scheduler, (name, "", ""), expires_at=clock.now + remaining)
+    run_tick(scheduler)
+    assert [key[0] for key in refresher.refreshed] == ["a.com", "b.com"]
+    assert scheduler.active == 0
+    assert scheduler.get_stats()["refreshed"] == 2
+
+
+def test_yields_to_live_traffic(clock):
+    refresher = Refresher()
+    refresher.free = False
+    scheduler = refresher.scheduler()
+    make_hot(scheduler, expires_at=clock.now + 30)
+    run_tick(scheduler)
+    assert refresher.refreshed == []
+    assert scheduler.skipped_busy == 1
+    refresher.free = True
+    run_tick(scheduler)
+    assert refresher.refreshed == [KEY]
+
+
+def test_token_bucket_limits_refreshes(clock):
+    refresher = Refresher()
+    scheduler = refresher.scheduler(budget_per_hour=2, max_concurrent=3)
+    for i in range(3):
+        make_hot(scheduler, (f"site{i}.com", "", ""), expires_at=clock.now + 30)
+    run_tick(scheduler)
+    # 预算只够两次，第三个被跳过，没有令牌时下一轮仍被跳过
+    assert len(refresher.refreshed) == 2
+    assert scheduler.skipped_budget == 1
+    for key in refresher.refreshed:
+        scheduler.set_expiry(key, clock.now + 3600)
+    run_tick(scheduler)
+    assert len(refresher.refreshed) == 2
+    assert scheduler.skipped_budget == 2
+    # 令牌按 budget_per_hour 匀速恢复：半小时恢复一个
+    clock.now += 1800
+    scheduler.set_expiry(("site2.com", "", ""), clock.now + 30)
+    make_hot(scheduler, ("site2.com", "", ""))
+    run_tick(scheduler)
+    assert len(refresher.refreshed) == 3
+
+
+def test_failed_refresh_is_not_retried(clock):
+    refresher = Refresher(fail=True)
+    scheduler = refresher.scheduler()
+    make_hot(scheduler, expires_at=clock.now + 30)
+    run_tick(scheduler)
+    run_tick(scheduler)
+    assert refresher.refreshed == [KEY]
+    assert scheduler.failed == 1
+    assert scheduler.entries[KEY].expires_at is None
+
+
+def test_cold_expired_entries_are_pruned_and_coldest_evicted(clock):
+    scheduler = Refresher().scheduler(max_tracked=2)
+    make_hot(scheduler, ("a.com", "", ""), requests=5)
+    make_hot(scheduler, ("b.com", "", ""), requests=1)
+    make_hot(scheduler, ("c.com", "", ""), requests=2)
+    # 超出上限时淘汰请求频率最低的
+    assert set(k[0] for k in scheduler.entries) == {"a.com", "c.com"}
+    clock.now += 6000
+    run_tick(scheduler)
+    assert scheduler.entries == {}
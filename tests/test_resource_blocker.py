@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+
+import resource_blocker
+from resource_blocker import BlockPolicy, ResourceBlocker, split_patterns
+
+TARGET = "https://www.example.com/page"
+
+
+class FakeCdp:
+    """记录调用的CDP会话，回调由测试直接触发"""
+
+    instances = []
+
+    def __init__(self, tab_id, target_type, address):
+        self.calls = []
+        self.callbacks = {}
+        self.stopped = threading.Event()
+        self.fail_on = None
+        FakeCdp.instances.append(self)
+
+    def set_callback(self, event, callback):
+        self.callbacks[event] = callback
+
+    def run(self, method, **kwargs):
+        if method == self.fail_on:
+            raise RuntimeError("连接已断开")
+        self.calls.append((method, kwargs))
+
+    def stop(self):
+        self.stopped.set()
+
+    def methods(self):
+        return [method for method, _ in self.calls]
+
+
+class FakeDriver:
+    tab_id = "tab"
+    browser = type("Browser", (), {"address": "127.0.0.1:9222"})()
+
+
+@pytest.fixture
+def cdp(monkeypatch):
+    FakeCdp.instances = []
+    monkeypatch.setattr(resource_blocker, "Driver", FakeCdp)
+    return FakeCdp.instances
+
+
+def pause(cdp: FakeCdp, url: str, resource_type: str, request_id: str = "1"):
+    cdp.callbacks["Fetch.requestPaused"](requestId=request_id, request={"url": url}, resourceType=resource_type)
+
+
+def test_split_patterns():
+    assert split_patterns(" *.a.com/* ,, *://*/ads/* ") == ("*.a.com/*", "*://*/ads/*")
+    assert split_patterns(None) == ()
+
+
+def test_policy_matching_order():
+    policy = BlockPolicy(TARGET, "strict", allow=("*://cdn.other.com/*",), deny=("*/tracker.js",))
+    # Cloudflare 验证请求无论如何都放行
+    assert not policy.should_block("https://challenges.cloudflare.com/x.png", "Image")
+    assert not policy.should_block("https://www.example.com/cdn-cgi/challenge-platform/x.css", "Stylesheet")
+    # allow 优先于 deny 和档位
+    assert not policy.should_block("https://cdn.other.com/tracker.js", "Script")
+    assert policy.should_block("https://www.example.com/tracker.js", "Script")
+    assert not policy.should_block("https://other.com/", "Document")
+    assert not policy.should_block("data:image/png;base64,xx", "Image")
+    assert policy.should_block("https://www.example.com/a.css", "Stylesheet")
+    # 第三方判断按可注册域名，同站子域名不算第三方
+    assert not policy.should_block("https://static.example.com/app.js", "Script")
+    assert policy.should_block("https://ads.other.com/app.js", "Script")
+
+
+def test_profiles():
+    assert not BlockPolicy(TARGET).enabled
+    assert BlockPolicy(TARGET, deny=("*.gif",)).enabled
+    light = BlockPolicy(TARGET, "light")
+    assert light.should_block("https://www.example.com/a.woff2", "Font")
+    assert not light.should_block("https://www.example.com/a.css", "Stylesheet")
+    assert not light.should_block("https://ads.other.com/app.js", "Script")
+    with pytest.raises(ValueError):
+        BlockPolicy(TARGET, "all")
+
+
+def test_blocks_and_continues_paused_requests(cdp):
+    blocker = ResourceBlocker(FakeDriver(), BlockPolicy(TARGET, "light")).start()
+    session = cdp[0]
+    assert session.methods() == ["Network.enable", "Fetch.enable"]
+    pause(session, "https://www.example.com/a.png", "Image", "1")
+    pause(session, "https://www.example.com/app.js", "Script", "2")
+    session.callbacks["Network.loadingFinished"](encodedDataLength=1000)
+    assert session.calls[-2:] == [("Fetch.failRequest", {"requestId": "1", "errorReason": "BlockedByClient"}),
+                                  ("Fetch.continueRequest", {"requestId": "2"})]
+    stats = blocker.get_stats()
+    assert (stats["allowed"], stats["blocked"], stats["blocked_by_type"]) == (1, 1, {"Image": 1})
+    assert stats["bytes_received"] == 1000
+
+
+def test_failed_continue_does_not_raise(cdp):
+    ResourceBlocker(FakeDriver(), BlockPolicy(TARGET, "light")).start()
+    cdp[0].fail_on = "Fetch.continueRequest"
+    pause(cdp[0], "https://www.example.com/app.js", "Script")
+
+
+def test_stop_releases_paused_requests(cdp):
+    blocker = ResourceBlocker(FakeDriver(), BlockPolicy(TARGET, "light")).start()
+    session = cdp[0]
+    blocker.stop()
+    # 关闭 Fetch 拦截后浏览器会放行仍在暂停的请求，会话在后台关闭
+    assert session.methods()[-1] == "Fetch.disable"
+    assert session.stopped.wait(2)
+    # 停止后到达的回调不再处理，重复停止无副作用
+    pause(session, "https://www.example.com/a.png", "Image")
+    assert session.methods()[-1] == "Fetch.disable"
+    blocker.stop()
+
+
+def test_off_profile_only_counts_bytes(cdp):
+    blocker = ResourceBlocker(FakeDriver(), BlockPolicy(TARGET)).start()
+    session = cdp[0]
+    assert session.methods() == ["Network.enable"]
+    assert "Fetch.requestPaused" not in session.callbacks
+    blocker.stop()
+    assert "Fetch.disable" not in session.methods()
+    assert session.stopped.wait(2)
+
+
+def test_start_failure_disables_blocker(cdp, monkeypatch):
+    original = FakeCdp.__init__
+
+    def failing_init(self, *args):
+        original(self, *args)
+        self.fail_on = "Fetch.enable"
+
+    monkeypatch.setattr(FakeCdp, "__init__", failing_init)
+    blocker = ResourceBlocker(FakeDriver(), BlockPolicy(TARGET, "light")).start()
+    assert blocker.cdp is None
+    assert cdp[0].stopped.wait(2)
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def run_job(process_func, deadline: float):
+    ticket = server.JobTicket("test-client", deadline=deadline)
+    return asyncio.run(server.run_bypass_job(process_func, "https://example.com/", 1, None, None, ticket))
+
+
+def test_job_returns_result():
+    def process(url, retries, proxy, user_agent, result):
+        server.browser_pool.release_browser()
+        result.set_result("ok")
+
+    assert run_job(process, 10).result == "ok"
+    assert server.browser_pool.active_browsers == 0
+
+
+def test_no_time_left_before_admission(monkeypatch):
+    called = []
+    ticket = server.JobTicket("test-client", deadline=5)
+    ticket.expires_at = time.time() - 1
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(server.run_bypass_job(lambda *args: called.append(args), "https://example.com/", 1, None, None,
+                                          ticket))
+    assert e.value.status_code == 504
+    assert not called
+    assert server.browser_pool.active_browsers == 0
+
+
+def test_admission_gets_remaining_deadline(monkeypatch):
+    deadlines = []
+
+    async def admit(client, priority, weight, deadline):
+        deadlines.append(deadline)
+        raise server.AdmissionRejected("无法在截止时间内获得浏览器资源", retry_after=1)
+
+    monkeypatch.setattr(server.admission_queue, "admit", admit)
+    ticket = server.JobTicket("test-client", deadline=10)
+    # 合并等待等已经用掉了 6 秒
+    ticket.expires_at -= 6
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(server.run_bypass_job(lambda *args: None, "https://example.com/", 1, None, None, ticket))
+    assert e.value.status_code == 503
+    assert 3.5 < deadlines[0] <= 4
+
+
+def test_job_timeout_uses_remaining_deadline():
+    def process(url, retries, proxy, user_agent, result):
+        try:
+            deadline = time.time() + 5
+            while not result.cancel_token.cancelled and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            server.browser_pool.release_browser()
+
+    started = time.time()
+    with pytest.raises(HTTPException) as e:
+        run_job(process, 0.5)
+    assert e.value.status_code == 504
+    # 远小于 JOB_TIMEOUT
+    assert time.time() - started < 3
+
+
+def test_resource_blocking_is_opt_in():
+    assert not server.make_block_policy("https://example.com/").enabled
+    policy = server.make_block_policy("https://example.com/", "light", deny="*.doubleclick.net/*")
+    assert policy.should_block("https://example.com/a.png", "Image")
+    assert policy.should_block("https://ad.doubleclick.net/x", "Script")
+    assert not policy.should_block("https://example.com/cdn-cgi/challenge-platform/x.png", "Image")
+    with pytest.raises(HTTPException):
+        server.make_block_policy("https://example.com/", "all")
@@ -0,0 +1,79 @@
+import os
+import subprocess
+
+import pytest
+
+from shared_slots import SharedSlotTable
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "slots")
+
+
+def as_process(table: SharedSlotTable, pid: int) -> SharedSlotTable:
+    """让同一测试进程中的表模拟另一个服务进程"""
+    table.pid = pid
+    return table
+
+
+def test_slots_are_global(path):
+    first = SharedSlotTable(path, 2)
+    second = as_process(SharedSlotTable(path, 2), os.getppid())
+    assert first.try_acquire()
+    assert second.try_acquire()
+    assert not first.try_acquire()
+    second.release()
+    assert first.try_acquire()
+    assert first.get_stats()["in_use_by_pid"] == {os.getpid(): 2}
+
+
+def test_slots_of_dead_process_are_reaped(path):
+    dead = as_process(SharedSlotTable(path, 1), dead_pid())
+    assert dead.try_acquire()
+    table = SharedSlotTable(path, 1)
+    table.reap()
+    assert table.get_stats()["in_use"] == 0
+    assert table.reaped_slots == 1
+
+
+def test_browser_budget_counts_all_processes(path):
+    first = SharedSlotTable(path, 4)
+    second = as_process(SharedSlotTable(path, 4), os.getppid())
+    assert first.reserve_process("chrome", 2)
+    assert second.reserve_process("chrome", 2)
+    assert not first.reserve_process("chrome", 2)
+    # 代理进程不占浏览器名额
+    assert second.reserve_process("mitmdump", 2)
+    second.cancel_reservation("chrome")
+    assert first.reserve_process("chrome", 2)
+    assert first.count_processes("chrome") == 2
+    assert second.count_processes("chrome", others_only=True) == 2
+
+
+def test_track_fills_reservation(path):
+    table = SharedSlotTable(path, 1)
+    assert table.reserve_process("chrome", 1)
+    table.track_process(os.getpid(), "chrome")
+    stats = table.get_stats()
+    assert stats["browsers"] == 1
+    assert stats["tracked_processes"] == 1
+    table.untrack_process(os.getpid())
+    assert table.count_processes("chrome") == 0
+
+
+def test_reservations_of_dead_process_are_ignored_and_reaped(path):
+    dead = as_process(SharedSlotTable(path, 1), dead_pid())
+    assert dead.reserve_process("chrome", 1)
+    dead.reserve_process("waiting")
+    table = SharedSlotTable(path, 1)
+    assert table.count_processes("waiting") == 0
+    assert table.reserve_process("chrome", 1)
+    table.reap()
+    assert table.get_stats()["browsers"] == 1
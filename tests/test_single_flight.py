@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+KEY = ("example.com", "", "", "cookies")
+
+
+def test_concurrent_calls_share_one_execution():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def solve():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "cookies"
+
+        results = await asyncio.gather(*(flight.do(KEY, solve) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(main())
+    assert calls == [1]
+    assert results == ["cookies"] * 5
+    assert flight.get_stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_different_keys_run_separately():
+    async def main():
+        flight = SingleFlight()
+
+        async def solve(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        return await asyncio.gather(flight.do(KEY, lambda: solve(1)), flight.do(("other",), lambda: solve(2)))
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_errors_are_shared_and_key_is_released():
+    async def main():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("过盾失败")
+
+        results = await asyncio.gather(flight.do(KEY, fail), flight.do(KEY, fail), return_exceptions=True)
+        # 失败后同一个键可以重新执行
+        retry = await flight.do(KEY, lambda: asyncio.sleep(0, result="ok"))
+        return results, retry
+
+    results, retry = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert retry == "ok"
+
+
+def test_leader_disconnect_does_not_cancel_other_waiters():
+    async def main():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def solve():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "cookies"
+
+        leader = asyncio.ensure_future(flight.do(KEY, solve))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.do(KEY, solve))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "cookies"
@@ -0,0 +1,78 @@
+// 在turnstile_token写入的瞬间通知页面外的等待者，替代轮询
+(function () {
+    if (window.__cfTurnstileWatcher) {
+        return;
+    }
+
+    const SELECTOR = 'input[name="cf-turnstile-response"]';
+    const nativeValue = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value');
+    let token = '';
+    let resolveToken;
+    const ready = new Promise(resolve => { resolveToken = resolve; });
+
+    function publish(value) {
+        if (value && !token) {
+            token = value;
+            resolveToken(value);
+        }
+    }
+
+    function scan() {
+        for (const input of document.querySelectorAll(SELECTOR)) {
+            publish(nativeValue.get.call(input));
+        }
+        return token;
+    }
+
+    // 只在token输入框这个实例上挂钩，不修改原型
+    function hook(input) {
+        if (input.__cfTurnstileHooked) {
+            return;
+        }
+        input.__cfTurnstileHooked = true;
+        Object.defineProperty(input, 'value', {
+            configurable: true,
+            get() { return nativeValue.get.call(this); },
+            set(value) {
+                nativeValue.set.call(this, value);
+                publish(value);
+            }
+        });
+        publish(nativeValue.get.call(input));
+    }
+
+    function inspect(node) {
+        if (node.nodeType !== Node.ELEMENT_NODE) {
+            return;
+        }
+        if (node.matches(SELECTOR)) {
+            hook(node);
+        }
+        node.querySelectorAll(SELECTOR).forEach(hook);
+    }
+
+    const observer = new MutationObserver(mutations => {
+        for (const mutation of mutations) {
+            if (mutation.type === 'attributes') {
+                if (mutation.target.matches(SELECTOR)) {
+                    publish(mutation.target.getAttribute('value'));
+                }
+                continue;
+            }
+            mutation.addedNodes.forEach(inspect);
+        }
+    });
+    observer.observe(document, {childList: true, subtree: true, attributes: true, attributeFilter: ['value']});
+    if (document.documentElement) {
+        inspect(document.documentElement);
+    }
+
+    window.__cfTurnstileWatcher = {
+        token: () => token || scan(),
+        // 等到token写入或超时（毫秒），返回token，超时返回空字符串
+        wait: timeoutMs => Promise.race([
+            ready,
+            new Promise(resolve => setTimeout(() => resolve(token || scan()), timeoutMs))
+        ])
+    };
+})();
@@ -1,7 +1,15 @@
 import os
 import platform
 import logging
+import logging.handlers
+import atexit
+import contextvars
+import json
+import queue
+import random
 import time
+import threading
+import uuid
 
 # 环境变量配置
 LOG_LANG = os.getenv("LOG_LANG", "zh")  # 日志语言 zh/en
@@ -23,20 +31,170 @@ class ColoredFormatter(logging.Formatter):
             return f"{self.COLORS[record.levelname]}{log_message}{self.COLORS['RESET']}"
         return log_message
 
-# 配置日志记录
-colored_formatter = ColoredFormatter('%(asctime)s - %(levelname)s - %(message)s')
-file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+# 日志相关环境变量
+LOG_FILE = os.getenv("LOG_FILE", "cloudflare_bypass.log")
+LOG_FILE_FORMAT = os.getenv("LOG_FILE_FORMAT", "json")  # 日志文件格式 json/text
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))  # 单个日志文件大小上限，超出后轮转
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0))  # 按请求采样输出调试日志的比例，0~1
+
+# 当前请求的日志上下文：请求ID、所处阶段、是否采样调试日志
+log_request_id = contextvars.ContextVar("log_request_id", default="-")
+log_phase = contextvars.ContextVar("log_phase", default="-")
+log_debug_sampled = contextvars.ContextVar("log_debug_sampled", default=False)
+
+
+def start_log_context(request_id: str = None) -> str:
+    """为当前请求设置日志上下文，返回请求ID"""
+    request_id = request_id or uuid.uuid4().hex[:12]
+    log_request_id.set(request_id)
+    log_phase.set("-")
+    log_debug_sampled.set(LOG_DEBUG_SAMPLE_RATE > 0 and random.random() < LOG_DEBUG_SAMPLE_RATE)
+    return request_id
+
+
+class LazyMessage:
+    """延迟格式化的日志消息，只在后台线程真正写日志时才拼接字符串"""
+    __slots__ = ("template", "args")
+
+    def __init__(self, template: str, *args):
+        self.template = template
+        self.args = args
+
+    def __str__(self):
+        return self.template.format(*self.args) if self.args else self.template
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程中记录请求上下文；调试日志只在被采样的请求中保留"""
+
+    def filter(self, record):
+        record.request_id = log_request_id.get()
+        record.phase = log_phase.get()
+        if record.levelno <= logging.DEBUG and not log_debug_sampled.get():
+            return False
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """直接把日志记录放入队列，消息格式化留给后台线程"""
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "phase": getattr(record, "phase", "-"),
+            "thread": record.threadName
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+
+# 配置日志记录：调用方只把记录放进队列，格式化和写入都在后台线程完成
+colored_formatter = ColoredFormatter('%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s')
+file_formatter = (JsonFormatter() if LOG_FILE_FORMAT == "json"
+                  else logging.Formatter('%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s'))
 
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(colored_formatter)
 
-file_handler = logging.FileHandler('cloudflare_bypass.log', mode='w')
+file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                                    encoding="utf-8")
 file_handler.setFormatter(file_formatter)
 
+log_queue = queue.SimpleQueue()
+queue_handler = DeferredQueueHandler(log_queue)
+queue_handler.addFilter(ContextFilter())
+log_listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+
 logging.basicConfig(
-    level=logging.INFO,
-    handlers=[console_handler, file_handler]
+    level=logging.DEBUG if LOG_DEBUG_SAMPLE_RATE > 0 else logging.INFO,
+    handlers=[queue_handler]
 )
+log_listener.start()
+# 退出时把队列中剩余的日志写完
+atexit.register(log_listener.stop)
+
+
+class BypassCancelled(Exception):
+    """任务已被取消（例如请求超时），应尽快停止并释放浏览器"""
+
+
+class CancellationToken:
+    """在请求处理协程与工作线程之间传递取消信号"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = ""
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "", executor=None):
+        """
+        设置取消标志并执行回调。
+        Args:
+            reason: 取消原因
+            executor: 执行回调的线程池；回调会关闭浏览器等阻塞操作，在事件循环中取消时必须传入
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        if not callbacks:
+            return
+        if executor is not None:
+            executor.submit(contextvars.copy_context().run, self._run_callbacks, callbacks)
+        else:
+            self._run_callbacks(callbacks)
+
+    @staticmethod
+    def _run_callbacks(callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"执行取消回调失败: {e}")
+
+    def add_callback(self, callback):
+        """注册取消时执行的回调；已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise BypassCancelled(self.reason or "任务已取消")
+
+
+def stop_cdp_session(cdp):
+    """
+    在后台线程中关闭独立的CDP会话（DrissionPage 的 Driver）。
+    Driver.stop 会等待事件线程退出（最长约1秒），不能阻塞过盾流程。
+    """
+    threading.Thread(target=cdp.stop, daemon=True).start()
+
+
 def get_browser_path():
     """自动获取系统中已安装的浏览器路径"""
     system = platform.system()
@@ -73,10 +231,18 @@ def get_browser_path():
 
     return None
 
-def check_cf_clearance(driver,retries=5):
+def check_cf_clearance(driver,retries=5,watcher=None):
     retry_interval = 1
     cf_clearance = ""
     retry_count = 0
+    if watcher is not None and watcher.active:
+        # 有事件监听时无需轮询：先查一次现有cookie，再等待 cf_clearance 写入事件
+        if any(cookie['name'] == 'cf_clearance' for cookie in driver.cookies()):
+            return True
+        if watcher.wait_for_clearance(retries * retry_interval):
+            return True
+        logging.error("未能获取到cf_clearance cookie")
+        return ""
     while retry_count < retries:
         cookies = driver.cookies()
         for cookie in cookies: